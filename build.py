@@ -1,3 +1,5 @@
+import sys
+
 from pybuilder.core import use_plugin, init, Author
 from pybuilder.vcs import VCSRevision
 
@@ -32,12 +34,13 @@ def set_properties(project):
     project.set_property("verbose", True)
 
     project.depends_on("docopt")
-    project.depends_on("boto")
     project.depends_on("boto3")
     project.depends_on("python-cloudwatchlogs-logging")
     project.depends_on("yamlreader")
     project.depends_on("pils")
     project.depends_on("mock")
+    if sys.version_info[0] < 3:
+        project.depends_on("futures")
 
     project.build_depends_on("unittest2>=0.7")
     project.build_depends_on("moto>=0.4.31")
@@ -15,6 +15,7 @@
 from __future__ import print_function, absolute_import, division
 
 import logging
+import threading
 import monocyte.handler.acm
 import monocyte.handler.cloudformation
 import monocyte.handler.dynamodb
@@ -22,10 +23,27 @@ import monocyte.handler.ec2
 import monocyte.handler.rds2
 import monocyte.handler.s3
 import monocyte.handler.iam
+from monocyte import clients, discovery, regions
+from monocyte.deadline import Deadline, DeadlineExceeded
+from monocyte.handler import DEFAULT_REGION_WORKERS, Resource
+from monocyte.plugins.streaming import BatchPluginAdapter
+from monocyte.snapshots import RunSnapshots
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pils import get_item_from_module
 
 from cloudwatchlogs_logging import CloudWatchLogsHandler
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+DEFAULT_HANDLER_WORKERS = 4
+DEFAULT_DELETION_WORKERS = 4
+DEFAULT_DELETION_QUEUE_SIZE = 100
+# Region of the placeholder resource that reports an incomplete handler.
+ALL_REGIONS = "all"
+
 
 class Monocyte(object):
     def __init__(self,
@@ -37,6 +55,24 @@ class Monocyte(object):
                  dry_run=True,
                  logger=None,
                  whitelist=None,
+                 region_workers=DEFAULT_REGION_WORKERS,
+                 handler_workers=DEFAULT_HANDLER_WORKERS,
+                 handler_dependencies=None,
+                 deletion_workers=DEFAULT_DELETION_WORKERS,
+                 deletion_queue_size=DEFAULT_DELETION_QUEUE_SIZE,
+                 max_pool_connections=None,
+                 max_attempts=None,
+                 api_rates=None,
+                 page_size=None,
+                 cache_dir=None,
+                 handler_config=None,
+                 discovery_mode=discovery.SERVICE_DISCOVERY,
+                 region_cache_max_age=regions.DEFAULT_MAX_AGE,
+                 run_timeout=None,
+                 handler_timeout=None,
+                 region_timeout=None,
+                 connect_timeout=None,
+                 read_timeout=None,
                  **kwargs):
         self.allowed_regions_prefixes = allowed_regions_prefixes
         self.ignored_regions = ignored_regions
@@ -45,20 +81,53 @@ class Monocyte(object):
         self.handler_names = handler_names
         self.dry_run = dry_run
         self.whitelist = whitelist
+        self.region_workers = region_workers
+        self.handler_workers = handler_workers
+        self.handler_dependencies = handler_dependencies or {}
+        self.deletion_workers = deletion_workers
+        self.deletion_queue_size = deletion_queue_size
+        self.page_size = page_size
+        self.cache_dir = cache_dir
+        self.handler_config = handler_config or {}
+        self.discovery_mode = discovery_mode
+        self.region_cache_max_age = region_cache_max_age
+        self.run_timeout = run_timeout
+        self.handler_timeout = handler_timeout
+        self.region_timeout = region_timeout
+        self.deadline = Deadline()
+        if max_pool_connections:
+            clients.registry.max_pool_connections = max_pool_connections
+        if max_attempts:
+            clients.registry.max_attempts = max_attempts
+        if api_rates:
+            clients.registry.rate_limiters.service_rates.update(api_rates)
+        if connect_timeout:
+            clients.registry.connect_timeout = connect_timeout
+        if read_timeout:
+            clients.registry.read_timeout = read_timeout
         self.config = kwargs
 
         self.logger = logger or logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%dT%H:%M:%S')
+        # All Monocytes of a process share the logger, e.g. one per account
+        # in a multi-account sweep, so the handlers are only added once.
+        if not self.logger.handlers:
+            formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s', datefmt='%Y-%m-%dT%H:%M:%S')
 
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(formatter)
 
-        self.logger.addHandler(console_handler)
+            self.logger.addHandler(console_handler)
 
         self.problematic_resources = []
 
         self.unwanted_resources = []
+        self.results_lock = threading.Lock()
+        # (handler name, region name) of the incomplete sweeps reported.
+        self.incomplete_sweeps = set()
+        self.plugins = []
+        self.plugin_queue = None
+        self.plugin_thread = None
 
     def is_region_allowed(self, region):
         region_prefix = region.lower()[:2]
@@ -72,7 +141,8 @@ class Monocyte(object):
 
     def search_and_destroy_unwanted_resources(self):
         self.logger.warning("Monocyte - Search and Destroy unwanted AWS Resources relentlessly.")
-        if self.cloudwatchlogs_config:
+        if self.cloudwatchlogs_config and not any(isinstance(handler, CloudWatchLogsHandler)
+                                                  for handler in self.logger.handlers):
             cloudwatch_handler = CloudWatchLogsHandler(self.cloudwatchlogs_config["region"],
                                                        self.cloudwatchlogs_config["groupname"],
                                                        "search_and_destroy_unwanted_resources",
@@ -82,24 +152,20 @@ class Monocyte(object):
 
         if self.dry_run:
             self.logger.info("Dry Run Activated. Will not destroy anything.")
+        self.deadline = Deadline(self.run_timeout)
 
-        specific_handlers = self.instantiate_handlers()
+        self.load_region_catalogue()
+        specific_handlers = self.instantiate_handlers(RunSnapshots())
 
         self.logger.info("Handler activated in Order: {0}".format(self.handler_names))
         self.logger.info("Allowed regions start with: {0}".format(self.allowed_regions_prefixes))
         self.logger.info("Ignored regions: {0}".format(self.ignored_regions))
 
-        for specific_handler in specific_handlers:
-            self.logger.info("Start handling %s resources" % specific_handler.name)
-            try:
-                self.handle_service(specific_handler)
-            except Exception:
-                self.logger.exception("Error while trying to fetch resources "
-                                      "from %s:", specific_handler.name)
-            else:
-                self.logger.info("Finished handling %s resources" % specific_handler.name)
-
         self.start_plugins()
+        self.run_handlers(specific_handlers)
+        self.finish_plugins()
+        self.logger.info("AWS clients: {0} created, {1} reused".format(
+            clients.registry.misses, clients.registry.hits))
 
         if self.problematic_resources:
             self.logger.info("Problems encountered while deleting the following resources.")
@@ -109,25 +175,194 @@ class Monocyte(object):
             return 1
         return 0
 
+    def load_region_catalogue(self):
+        """Resolve the regions enabled for the account before any handler looks at regions."""
+        catalogue = regions.RegionCatalogue(self.cache_dir, max_age=self.region_cache_max_age, logger=self.logger)
+        try:
+            clients.registry.load_region_catalogue(catalogue)
+        except Exception:
+            self.logger.exception("Could not find out which regions are enabled, trying all of them:")
+
+    def get_handler_dependencies(self, handlers):
+        """Map each handler name to the names of the handlers it has to wait for.
+
+        Dependencies are declared by the handler classes (DEPENDS_ON) and can
+        be extended via the handler_dependencies config. Dependencies on
+        handlers that are not activated are ignored.
+        """
+        handler_names = set(handler.name for handler in handlers)
+        dependencies = {}
+        for handler in handlers:
+            declared = list(handler.DEPENDS_ON) + list(self.handler_dependencies.get(handler.name, []))
+            dependencies[handler.name] = set(name for name in declared
+                                             if name in handler_names and name != handler.name)
+
+        unresolved = dict(dependencies)
+        while unresolved:
+            resolvable = [name for name, required in unresolved.items()
+                          if not required.intersection(unresolved)]
+            if not resolvable:
+                raise ValueError("Circular dependencies between handlers: {0}".format(
+                    ", ".join(sorted(unresolved))))
+            for name in resolvable:
+                del unresolved[name]
+        return dependencies
+
+    def run_handlers(self, handlers):
+        """Run all handlers, each one as soon as its dependencies are finished.
+
+        When the run deadline passes, the running handlers are cancelled
+        and reported as incomplete. They are not waited for, so that the
+        plugins still run in time.
+        """
+        dependencies = self.get_handler_dependencies(handlers)
+        pending = list(handlers)
+        running = {}
+        finished = set()
+        executor = ThreadPoolExecutor(max_workers=max(1, self.handler_workers))
+        try:
+            while pending or running:
+                for handler in list(pending):
+                    if dependencies[handler.name].issubset(finished):
+                        pending.remove(handler)
+                        running[executor.submit(self.run_handler, handler)] = handler
+                done, _ = wait(running, timeout=self.deadline.remaining(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished.add(running.pop(future).name)
+                if self.deadline.expired() and (pending or running):
+                    self.deadline.cancel()
+                    for handler in list(running.values()) + pending:
+                        self.record_incomplete(handler, ALL_REGIONS, DeadlineExceeded(
+                            "Run deadline reached, {0} {1}".format(
+                                handler.name, "was cancelled" if handler in running.values() else "did not start")))
+                    return
+        finally:
+            executor.shutdown(wait=not self.deadline.expired())
+
+    def run_handler(self, specific_handler):
+        if self.deadline.expired():
+            # The deadline passed while the handler was queued, run_handlers
+            # reports it.
+            return
+        self.logger.info("Start handling %s resources" % specific_handler.name)
+        specific_handler.deadline = self.deadline.child(self.handler_timeout)
+        try:
+            self.handle_service(specific_handler)
+        except DeadlineExceeded as exc:
+            self.record_incomplete(specific_handler, ALL_REGIONS, exc)
+        except Exception:
+            self.logger.exception("Error while trying to fetch resources "
+                                  "from %s:", specific_handler.name)
+        else:
+            self.logger.info("Finished handling %s resources" % specific_handler.name)
+        for region_name, exc in specific_handler.incomplete_regions:
+            self.record_incomplete(specific_handler, region_name, exc)
+        if specific_handler.skipped_regions:
+            self.logger.info("%s: skipped %d regions without tagged resources: %s", specific_handler.name,
+                             len(specific_handler.skipped_regions), ", ".join(sorted(specific_handler.skipped_regions)))
+
     def handle_service(self, specific_handler):
-        for resource in specific_handler.fetch_unwanted_resources():
-            if not self.is_region_allowed(resource.region):
+        """Delete the unwanted resources of a handler while they are discovered.
+
+        Discovery runs in the calling thread and feeds a bounded queue that
+        is drained by deletion_workers threads. Resources are queued in
+        batches of up to DELETE_BATCH_SIZE resources of the same region. A
+        full queue blocks the discovery. Handlers that list region by region
+        through fetch_in_regions() then stop requesting further pages once
+        their region queues are full, so the number of resources held does
+        not grow with the number found.
+        """
+        work_queue = queue.Queue(maxsize=max(1, self.deletion_queue_size))
+        batch_size = max(1, specific_handler.DELETE_BATCH_SIZE)
+        worker_count = max(1, self.deletion_workers)
+        executor = ThreadPoolExecutor(max_workers=worker_count)
+        workers = [executor.submit(self.delete_queued_batches, specific_handler, work_queue)
+                   for _ in range(worker_count)]
+        batch = []
+        try:
+            for resource in specific_handler.fetch_unwanted_resources():
+                specific_handler.deadline.check("the search for {0} resources".format(specific_handler.name))
+                if self.is_region_allowed(resource.region):
+                    continue
                 self.logger.warning(specific_handler.to_string(resource))
-                try:
-                    specific_handler.delete(resource)
-                except Warning as warn:
-                    # At least boto.ec2 throws an "exception.Warning"
-                    # if dry_run would succeed.
-                    self.logger.info(str(warn))
-                    self.unwanted_resources.append(resource)
-                except Exception as exc:
-                    self.logger.error("Error while trying to delete "
-                                      "resource\n%s" % str(exc))
-                    self.problematic_resources.append((resource, specific_handler, exc))
-                else:
-                    self.unwanted_resources.append(resource)
-
-    def instantiate_handlers(self):
+                if batch and batch[0].region != resource.region:
+                    work_queue.put(batch)
+                    batch = []
+                batch.append(resource)
+                if len(batch) >= batch_size:
+                    work_queue.put(batch)
+                    batch = []
+            if batch:
+                work_queue.put(batch)
+        finally:
+            for _ in workers:
+                work_queue.put(None)
+            executor.shutdown(wait=True)
+        for worker in workers:
+            worker.result()
+
+    def delete_queued_batches(self, specific_handler, work_queue):
+        while True:
+            batch = work_queue.get()
+            if batch is None:
+                return
+            if specific_handler.deadline.expired():
+                for resource in batch:
+                    self.record_problematic_resource(resource, specific_handler,
+                                                     DeadlineExceeded("Time is up, deletion was not attempted"))
+                continue
+            self.delete_batch(specific_handler, batch)
+
+    def delete_batch(self, specific_handler, batch):
+        try:
+            results = list(specific_handler.delete_many(batch))
+        except Exception as exc:
+            results = [(resource, exc) for resource in batch]
+
+        for resource, exc in results:
+            if exc is None:
+                self.record_unwanted_resource(resource)
+            elif isinstance(exc, Warning):
+                # Handlers raise a Warning if dry_run would succeed, if the
+                # deletion continues in a later run or if there is nothing
+                # left to delete.
+                self.logger.info(str(exc))
+                self.record_unwanted_resource(resource)
+            else:
+                self.logger.error("Error while trying to delete "
+                                  "resource\n%s" % str(exc))
+                self.record_problematic_resource(resource, specific_handler, exc)
+
+    def record_unwanted_resource(self, resource):
+        with self.results_lock:
+            self.unwanted_resources.append(resource)
+            self.notify_plugins("on_resource", resource)
+
+    def record_problematic_resource(self, resource, specific_handler, exc):
+        with self.results_lock:
+            self.problematic_resources.append((resource, specific_handler, exc))
+            self.notify_plugins("on_problem", resource, specific_handler, exc)
+
+    def record_incomplete(self, specific_handler, region_name, exc):
+        """Report that the resources of a handler in a region may be incomplete, because of exc.
+
+        Each region is reported once, and not at all once the handler is
+        reported for all regions. E.g. a handler cancelled at the run
+        deadline also stops with DeadlineExceeded in its own thread.
+        """
+        with self.results_lock:
+            if {(specific_handler.name, region_name), (specific_handler.name, ALL_REGIONS)} & self.incomplete_sweeps:
+                return
+            self.incomplete_sweeps.add((specific_handler.name, region_name))
+        placeholder = Resource(resource=None, resource_type=specific_handler.resource_type,
+                               resource_id="(incomplete sweep)", creation_date=None, region=region_name,
+                               reason=str(exc))
+        self.record_problematic_resource(placeholder, specific_handler, exc)
+
+    def instantiate_handlers(self, snapshots=None):
+        """Create the activated handlers, which share snapshots (by default a new one)."""
+        if snapshots is None:
+            snapshots = RunSnapshots()
         handler_classes = self.get_all_handler_classes()
         handlers = []
 
@@ -136,10 +371,18 @@ class Monocyte(object):
             ignored_resources = self.ignored_resources.get(handler_prefix)
 
             handler_class = handler_classes["monocyte.handler." + handler_name]
+            handler_kwargs = self.handler_config.get(handler_name) or {}
             handler = handler_class(self.is_region_handled,
                                     dry_run=self.dry_run,
                                     ignored_resources=ignored_resources,
-                                    whitelist=self.whitelist)
+                                    whitelist=self.whitelist,
+                                    region_workers=self.region_workers,
+                                    page_size=self.page_size,
+                                    cache_dir=self.cache_dir,
+                                    discovery_mode=self.discovery_mode,
+                                    region_timeout=self.region_timeout,
+                                    snapshots=snapshots,
+                                    **handler_kwargs)
             handlers.append(handler)
 
         return handlers
@@ -164,6 +407,12 @@ class Monocyte(object):
         return handler_classes
 
     def start_plugins(self):
+        """Create the plugins, which then get every result as soon as it is recorded.
+
+        Plugins without on_resource() only have run(). They get all results
+        at the end of the run, through a BatchPluginAdapter.
+        """
+        plugins = []
         for plugin in self.config.get("plugins") or []:
             module_name = plugin["module"]
             item_name = plugin["item"]
@@ -172,7 +421,53 @@ class Monocyte(object):
             self.logger.debug("Starting plugin '%s.%s' with config %s  ", module_name, item_name, config)
 
             PluginClass = get_item_from_module(module_name, item_name)
-            plugin = PluginClass(self.unwanted_resources, self.problematic_resources, self.dry_run, **config)
+            if hasattr(PluginClass, "on_resource"):
+                plugin = PluginClass(self.dry_run, **config)
+            else:
+                plugin = BatchPluginAdapter(PluginClass, self.dry_run, **config)
+            plugins.append(("%s.%s" % (module_name, item_name), plugin))
+        plugin_queue = queue.Queue()
+        self.plugin_thread = threading.Thread(target=self.call_plugins, args=(plugins, plugin_queue),
+                                              name="plugins")
+        self.plugin_thread.daemon = True
+        self.plugin_thread.start()
+        with self.results_lock:
+            self.plugins = plugins
+            self.plugin_queue = plugin_queue
+
+    def notify_plugins(self, callback_name, *args):
+        # Called with results_lock held, so the plugins get the results in
+        # the order they were recorded. The plugins are called by their own
+        # thread, so a slow plugin never holds up the handlers.
+        if self.plugin_queue is not None:
+            self.plugin_queue.put((callback_name, args))
+
+    def call_plugins(self, plugins, plugin_queue):
+        """Pass the queued results to the plugins, one call at a time, until None is queued."""
+        while True:
+            item = plugin_queue.get()
+            if item is None:
+                return
+            callback_name, args = item
+            for plugin_name, plugin in plugins:
+                try:
+                    getattr(plugin, callback_name)(*args)
+                except Exception:
+                    self.logger.exception("Plugin '%s' failed in %s():", plugin_name, callback_name)
 
-            plugin.run()
-            self.logger.debug("Plugin '%s.%s' finished successfully", module_name, item_name)
+    def finish_plugins(self):
+        # Handlers cancelled at the run deadline may still record results,
+        # but the plugins are done with this run.
+        with self.results_lock:
+            plugins, self.plugins = self.plugins, []
+            plugin_queue, self.plugin_queue = self.plugin_queue, None
+        if plugin_queue is not None:
+            plugin_queue.put(None)
+            self.plugin_thread.join()
+        for plugin_name, plugin in plugins:
+            try:
+                plugin.on_finish()
+            except Exception:
+                self.logger.exception("Plugin '%s' failed in on_finish():", plugin_name)
+            else:
+                self.logger.debug("Plugin '%s' finished successfully", plugin_name)
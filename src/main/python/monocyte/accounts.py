@@ -0,0 +1,167 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Sweep many accounts in one run
+
+The accounts are listed from AWS Organizations or read from a file. Each
+account is swept by its own Monocyte in a worker process, with the
+credentials of a role assumed in that account. The plugins run in the
+parent process and get the results of all accounts.
+"""
+from __future__ import print_function, absolute_import, division
+
+import logging
+import boto3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from monocyte import Monocyte, clients, credentials
+
+ORGANIZATIONS_SOURCE = 'organizations'
+DEFAULT_ACCOUNT_WORKERS = 4
+DEFAULT_ROLE_NAME = 'monocyte'
+
+
+def list_organization_accounts(client):
+    accounts = []
+    for page in client.get_paginator('list_accounts').paginate():
+        accounts.extend(account['Id'] for account in page['Accounts'] if account['Status'] == 'ACTIVE')
+    return accounts
+
+
+def read_accounts_file(path):
+    """Read one account ID per line. Empty lines and "#" comments are skipped."""
+    accounts = []
+    with open(path) as accounts_file:
+        for line in accounts_file:
+            account_id = line.split('#', 1)[0].strip()
+            if account_id:
+                accounts.append(account_id)
+    return accounts
+
+
+def get_role_arn(account_id, role_name):
+    return "arn:aws:iam::{0}:role/{1}".format(account_id, role_name)
+
+
+def assume_role(role_arn, cache_dir=None):
+    """Return a boto3 session with the credentials of role_arn, refreshed while it is in use."""
+    base_session = boto3.session.Session()
+    provider = credentials.get_provider(role_arn, base_session.client('sts'), cache_dir=cache_dir)
+    # Assume the role now, not in the first API call of a handler.
+    provider.get_credentials()
+    return provider.create_session(region_name=base_session.region_name)
+
+
+class HandlerSummary(object):
+    """Stands in for a handler of another process in problematic resources."""
+    def __init__(self, name):
+        self.name = name
+
+
+class AccountResult(object):
+    def __init__(self, account_id, status=0, unwanted_resources=None, problematic_resources=None, error=None):
+        self.account_id = account_id
+        self.status = status
+        self.unwanted_resources = unwanted_resources or []
+        self.problematic_resources = problematic_resources or []
+        self.error = error
+
+
+def sweep_account(account_id, role_arn, config):
+    """Sweep one account. Runs in a worker process, so the result must be picklable."""
+    # Clients inherited from the parent process must not be shared with it.
+    clients.registry.reset()
+    try:
+        clients.registry.use_session(assume_role(role_arn, cache_dir=config.get('cache_dir')))
+        monocyte = Monocyte(**config)
+        status = monocyte.search_and_destroy_unwanted_resources()
+    except Exception as exc:
+        logging.getLogger(__name__).exception("Sweeping account %s failed:", account_id)
+        return AccountResult(account_id, status=1, error="{0}: {1}".format(type(exc).__name__, exc))
+    finally:
+        # The worker process goes on with other accounts, so the refresher
+        # of this one must not keep running.
+        credentials.release_provider(role_arn)
+
+    for resource in monocyte.unwanted_resources:
+        resource.account_id = account_id
+    problematic_resources = []
+    for resource, service_handler, exc in monocyte.problematic_resources:
+        resource.account_id = account_id
+        problematic_resources.append((resource, HandlerSummary(service_handler.name), Exception(str(exc))))
+    return AccountResult(account_id, status, monocyte.unwanted_resources, problematic_resources)
+
+
+class MultiAccountSweep(object):
+    def __init__(self, config, source=ORGANIZATIONS_SOURCE, role_name=DEFAULT_ROLE_NAME,
+                 workers=DEFAULT_ACCOUNT_WORKERS, logger=None):
+        self.config = dict(config)
+        self.plugins = self.config.pop('plugins', None)
+        self.source = source
+        self.role_name = role_name
+        self.workers = workers
+        self.logger = logger or logging.getLogger(__name__)
+        self.results = []
+
+    def get_account_ids(self):
+        if self.source == ORGANIZATIONS_SOURCE:
+            return list_organization_accounts(clients.get_client('organizations'))
+        return read_accounts_file(self.source)
+
+    def create_executor(self):
+        return ProcessPoolExecutor(max_workers=max(1, self.workers))
+
+    def run(self):
+        account_ids = self.get_account_ids()
+        self.logger.warning("Sweeping {0} accounts with {1} workers.".format(len(account_ids), self.workers))
+        self.monocyte = Monocyte(plugins=self.plugins, **self.config)
+        executor = self.create_executor()
+        try:
+            futures = dict((executor.submit(sweep_account, account_id,
+                                            get_role_arn(account_id, self.role_name), self.config), account_id)
+                           for account_id in account_ids)
+            # The plugins get the results of each account as soon as it is
+            # done. Their thread starts only now that the worker processes
+            # are forked, so that no worker inherits it with a held lock.
+            self.monocyte.start_plugins()
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    # E.g. a worker process that died.
+                    result = AccountResult(futures[future], status=1, error=str(exc))
+                self.record_result(result)
+        finally:
+            executor.shutdown(wait=True)
+        self.results.sort(key=lambda result: result.account_id)
+        self.monocyte.finish_plugins()
+
+        failed = [result for result in self.results if result.status]
+        if failed:
+            self.logger.warning("Sweeps with problems: {0}".format(
+                ", ".join(result.account_id for result in failed)))
+            return 1
+        return 0
+
+    def record_result(self, result):
+        if result.error:
+            self.logger.error("Account {0}: {1}".format(result.account_id, result.error))
+        else:
+            self.logger.info("Account {0}: {1} unwanted and {2} problematic resources".format(
+                result.account_id, len(result.unwanted_resources), len(result.problematic_resources)))
+        for resource in result.unwanted_resources:
+            self.monocyte.record_unwanted_resource(resource)
+        for resource, service_handler, exc in result.problematic_resources:
+            self.monocyte.record_problematic_resource(resource, service_handler, exc)
+        self.results.append(result)
@@ -0,0 +1,105 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Small key/value caches that survive between sweeps
+
+Each cache is a JSON file in the configured cache directory. Without a
+cache directory, a cache only lives in memory.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class JsonCache(object):
+    def __init__(self, path=None, logger=None):
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._data = self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            self.logger.warning("Ignoring unreadable cache file %s", self.path, exc_info=True)
+            return {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            if self._data.get(key) != value:
+                self._data[key] = value
+                self._dirty = True
+
+    def delete(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._dirty = True
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def retain(self, keys):
+        """Forget all entries whose key is not in keys."""
+        keys = set(keys)
+        with self._lock:
+            for key in list(self._data):
+                if key not in keys:
+                    del self._data[key]
+                    self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if self.path is None or not self._dirty:
+                return
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # Write to a temporary file first, so that a crash never leaves
+            # a truncated cache behind.
+            handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.cache-')
+            with os.fdopen(handle, 'w') as cache_file:
+                json.dump(self._data, cache_file, sort_keys=True)
+            _replace(temp_path, self.path)
+            self._dirty = False
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, cache_dir=None):
+    """Return the cache called name, shared by all users of the same file."""
+    if cache_dir is None:
+        return JsonCache()
+    path = os.path.join(os.path.abspath(os.path.expanduser(cache_dir)), name + '.json')
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = JsonCache(path)
+        return _caches[path]
@@ -4,6 +4,7 @@ import boto3
 import logging
 import yaml
 from monocyte import Monocyte
+from monocyte.accounts import MultiAccountSweep
 
 
 def read_config(path):
@@ -73,6 +74,10 @@ def main(arguments):
     config = yamlreader.data_merge(config, load_whitelist(whitelist_uri))
     apply_default_config(config)
 
+    accounts_config = config.pop('accounts', None)
+    if accounts_config:
+        return run_multi_account_sweep(config, accounts_config)
+
     monocyte = Monocyte(**config)
 
     try:
@@ -82,6 +87,15 @@ def main(arguments):
         return 1
 
 
+def run_multi_account_sweep(config, accounts_config):
+    sweep = MultiAccountSweep(config, **accounts_config)
+    try:
+        return sweep.run()
+    except Exception:
+        sweep.logger.exception("Error while sweeping accounts:")
+        return 1
+
+
 def load_whitelist(whitelist_uri):
     if whitelist_uri is not None:
         bucket_name = whitelist_uri.split('/', 4)[2]
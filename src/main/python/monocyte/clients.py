@@ -0,0 +1,190 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Process-wide registry of boto3 clients
+
+Creating a client means loading the service model, resolving credentials
+and opening new HTTPS connections. boto3 clients are thread-safe, so all
+handlers and plugins share one client per service, region and credentials.
+All requests of a client pass its rate limiter, and throttled requests are
+retried with jittered backoff.
+"""
+from __future__ import absolute_import
+
+import threading
+import boto3
+from botocore.config import Config
+
+from monocyte.ratelimit import RateLimiterRegistry
+
+DEFAULT_MAX_POOL_CONNECTIONS = 25
+# Attempts per request, including the first one, in botocore's "standard"
+# retry mode. Its backoff is exponential with full jitter.
+DEFAULT_MAX_ATTEMPTS = 8
+# Seconds to wait for a connection and for a response. Timeouts are retried
+# like other errors, so a call that keeps hanging takes up to max_attempts *
+# (connect_timeout + read_timeout) plus backoff, over 9 minutes with the
+# defaults. Deadlines are only checked between calls.
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+# Where to ask for the enabled regions if the session has no region.
+DEFAULT_REGION = 'us-east-1'
+# Largest page sizes of operations whose service model does not state them.
+MAX_PAGE_SIZES = {
+    ('ec2', 'DescribeInstances'): 1000,
+    ('ec2', 'DescribeVolumes'): 500,
+    ('rds', 'DescribeDBInstances'): 100,
+    ('rds', 'DescribeDBSnapshots'): 100,
+    ('resourcegroupstaggingapi', 'GetResources'): 100,
+}
+
+
+class ClientRegistry(object):
+    def __init__(self, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = max_attempts
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.rate_limiters = RateLimiterRegistry()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._clients = {}
+        self._session = None
+        self._credentials_key = None
+        self._account_ids = {}
+        self._available_regions = {}
+        self.disabled_regions = frozenset()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = boto3.session.Session()
+                credentials = self._session.get_credentials()
+                self._credentials_key = credentials.access_key if credentials else None
+            return self._session
+
+    def use_session(self, session):
+        """Create all further clients from session, e.g. one with assumed role credentials."""
+        with self._lock:
+            self.reset()
+            credentials = session.get_credentials()
+            self._session = session
+            self._credentials_key = credentials.access_key if credentials else None
+
+    def get_config(self):
+        return Config(max_pool_connections=self.max_pool_connections,
+                      tcp_keepalive=True,
+                      connect_timeout=self.connect_timeout,
+                      read_timeout=self.read_timeout,
+                      retries={'mode': 'standard', 'max_attempts': self.max_attempts})
+
+    def get_client(self, service_name, region_name=None):
+        with self._lock:
+            session = self.session
+            key = (service_name, region_name, self._credentials_key)
+            client = self._clients.get(key)
+            if client is None:
+                self.misses += 1
+                client = session.client(service_name, region_name=region_name, config=self.get_config())
+                self.rate_limiters.attach(client, self._credentials_key, service_name, client.meta.region_name)
+                self._clients[key] = client
+            else:
+                self.hits += 1
+            return client
+
+    def get_account_id(self):
+        """Return the account of the current credentials, asking STS only once."""
+        with self._lock:
+            client = self.get_client('sts')
+            credentials_key = self._credentials_key
+            account_id = self._account_ids.get(credentials_key)
+        if account_id is None:
+            # Ask without holding the lock, which would block every get_client().
+            account_id = client.get_caller_identity().get('Account')
+            with self._lock:
+                account_id = self._account_ids.setdefault(credentials_key, account_id)
+        return account_id
+
+    def get_available_regions(self, service_name):
+        """Return the regions of a service, without the regions that are disabled."""
+        with self._lock:
+            regions = self._available_regions.get(service_name)
+            if regions is None:
+                regions = [region_name for region_name in self.session.get_available_regions(service_name)
+                           if region_name not in self.disabled_regions]
+                self._available_regions[service_name] = regions
+            return list(regions)
+
+    def load_region_catalogue(self, catalogue):
+        """Prune the regions that catalogue reports as disabled for the current account."""
+        with self._lock:
+            client = self.get_client('ec2', region_name=self.session.region_name or DEFAULT_REGION)
+        disabled_regions = frozenset(catalogue.get_disabled_regions(self.get_account_id(), client))
+        with self._lock:
+            self.disabled_regions = disabled_regions
+            self._available_regions = {}
+        return disabled_regions
+
+    def reset(self):
+        """Forget all clients, e.g. after the credentials have changed."""
+        with self._lock:
+            self._clients = {}
+            self._session = None
+            self._credentials_key = None
+            self._account_ids = {}
+            self._available_regions = {}
+            self.disabled_regions = frozenset()
+            self.hits = 0
+            self.misses = 0
+
+
+registry = ClientRegistry()
+
+
+def get_client(service_name, region_name=None):
+    return registry.get_client(service_name, region_name=region_name)
+
+
+def get_account_id():
+    return registry.get_account_id()
+
+
+def get_available_regions(service_name):
+    return registry.get_available_regions(service_name)
+
+
+def get_pagination_config(paginator, page_size):
+    """Return the PaginationConfig that asks paginator for pages of page_size items.
+
+    Operations without a page size parameter, like CloudFormation
+    ListStacks, reject a PageSize, so they get none. Otherwise page_size is
+    clamped to the range the operation accepts.
+    """
+    if not page_size:
+        return {}
+    # botocore has no public accessor for the limit key of a paginator.
+    limit_key = paginator._pagination_cfg.get('limit_key')
+    if not limit_key:
+        return {}
+    operation_model = paginator._model
+    limits = operation_model.input_shape.members[limit_key].metadata
+    maximum = limits.get('max', MAX_PAGE_SIZES.get((operation_model.service_model.service_name,
+                                                    operation_model.name)))
+    page_size = max(page_size, limits.get('min', 1))
+    if maximum:
+        page_size = min(page_size, maximum)
+    return {'PageSize': page_size}
@@ -0,0 +1,175 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Assumed role credentials that do not expire during a sweep
+
+botocore refreshes temporary credentials itself, but it does so in the
+thread that happens to make the next API call, which then waits for STS.
+Here a background thread assumes the role again some time before botocore
+wants to refresh, so botocore's refresh only picks up the new credentials.
+The credentials are kept per role, in memory and, with a cache directory,
+on disk, so that worker processes and later runs reuse them.
+"""
+from __future__ import absolute_import, division
+
+import datetime
+import hashlib
+import logging
+import threading
+
+import boto3
+import botocore.session
+from botocore.credentials import CredentialProvider, RefreshableCredentials
+from botocore.utils import parse_timestamp
+from dateutil.tz import tzutc
+
+from monocyte import cache
+
+ROLE_SESSION_NAME = 'monocyte'
+DEFAULT_DURATION = 60 * 60
+# botocore starts to refresh 15 minutes before expiry, so assume the role
+# again a little earlier than that.
+DEFAULT_REFRESH_AHEAD = 20 * 60
+RETRY_INTERVAL = 60
+
+
+def get_remaining_seconds(metadata):
+    expiry_time = parse_timestamp(metadata['expiry_time'])
+    return (expiry_time - datetime.datetime.now(tzutc())).total_seconds()
+
+
+class AssumedRoleProvider(object):
+    """Credentials of one role, refreshed in the background while they are in use."""
+    def __init__(self, role_arn, sts_client, credentials_cache=None, duration=DEFAULT_DURATION,
+                 refresh_ahead=DEFAULT_REFRESH_AHEAD, logger=None):
+        self.role_arn = role_arn
+        self.sts_client = sts_client
+        self.cache = credentials_cache if credentials_cache is not None else cache.JsonCache()
+        self.duration = duration
+        self.refresh_ahead = refresh_ahead
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._metadata = None
+        self._credentials = None
+        self._refresher = None
+
+    def get_metadata(self, min_remaining=None):
+        """Return credentials valid for at least min_remaining seconds, assuming the role only if needed."""
+        if min_remaining is None:
+            min_remaining = self.refresh_ahead
+        with self._lock:
+            if self._metadata is None or get_remaining_seconds(self._metadata) < min_remaining:
+                cached = self.cache.get(self.role_arn)
+                if cached is not None and get_remaining_seconds(cached) >= min_remaining:
+                    self._metadata = cached
+                else:
+                    self._metadata = self.assume_role()
+                    self.cache.set(self.role_arn, self._metadata)
+                    self.cache.save()
+            return self._metadata
+
+    def assume_role(self):
+        self.logger.info("Assuming role %s", self.role_arn)
+        response = self.sts_client.assume_role(RoleArn=self.role_arn, RoleSessionName=ROLE_SESSION_NAME,
+                                               DurationSeconds=self.duration)
+        credentials = response['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat(),
+        }
+
+    def get_credentials(self):
+        with self._lock:
+            credentials = self._credentials
+        if credentials is None:
+            credentials = RefreshableCredentials.create_from_metadata(
+                self.get_metadata(), refresh_using=self.get_metadata, method='assume-role')
+            with self._lock:
+                self._credentials = self._credentials or credentials
+                credentials = self._credentials
+        self.start_refresher()
+        return credentials
+
+    def create_session(self, region_name=None):
+        """Return a boto3 session whose clients all use these credentials."""
+        botocore_session = botocore.session.get_session()
+        botocore_session.get_component('credential_provider').insert_before('env', _AssumedRoleCredentialProvider(self))
+        return boto3.session.Session(botocore_session=botocore_session, region_name=region_name)
+
+    def start_refresher(self):
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_ahead,
+                                                   name='credentials-' + self.role_arn)
+                self._refresher.daemon = True
+                self._refresher.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _refresh_ahead(self):
+        while True:
+            with self._lock:
+                metadata = self._metadata
+            delay = get_remaining_seconds(metadata) - self.refresh_ahead if metadata else 0
+            if self._stopped.wait(max(0, delay)):
+                return
+            try:
+                # Ask for more than refresh_ahead, or the credentials
+                # would still count as fresh enough.
+                self.get_metadata(min_remaining=self.refresh_ahead + RETRY_INTERVAL)
+            except Exception:
+                self.logger.warning("Refreshing the credentials of %s failed, retrying in %s seconds",
+                                    self.role_arn, RETRY_INTERVAL, exc_info=True)
+                if self._stopped.wait(RETRY_INTERVAL):
+                    return
+
+
+class _AssumedRoleCredentialProvider(CredentialProvider):
+    METHOD = 'assume-role'
+
+    def __init__(self, provider):
+        super(_AssumedRoleCredentialProvider, self).__init__()
+        self.provider = provider
+
+    def load(self):
+        return self.provider.get_credentials()
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(role_arn, sts_client, cache_dir=None, **kwargs):
+    """Return the provider of role_arn, shared by all threads of the process."""
+    with _providers_lock:
+        provider = _providers.get(role_arn)
+        if provider is None:
+            # One file per role, so that processes working on different
+            # roles never overwrite each other's credentials.
+            cache_name = 'credentials-' + hashlib.sha256(role_arn.encode('utf-8')).hexdigest()[:16]
+            provider = AssumedRoleProvider(role_arn, sts_client, cache.get_cache(cache_name, cache_dir), **kwargs)
+            _providers[role_arn] = provider
+        return provider
+
+
+def release_provider(role_arn):
+    """Stop refreshing the credentials of role_arn and forget its provider."""
+    with _providers_lock:
+        provider = _providers.pop(role_arn, None)
+    if provider is not None:
+        provider.stop()
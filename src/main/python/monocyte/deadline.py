@@ -0,0 +1,61 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Time budgets for runs, handlers and regions
+
+Threads cannot be interrupted, so work stops cooperatively: handlers check
+their deadline between pages and resources, and the botocore timeouts
+bound how long a single request may take.
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """Expires after seconds (never if None), when cancelled or when its parent expires."""
+    def __init__(self, seconds=None, parent=None, clock=time.time):
+        self.parent = parent
+        self._clock = clock
+        self._cancelled = threading.Event()
+        self.expires_at = None if seconds is None else clock() + seconds
+        if parent is not None and parent.expires_at is not None:
+            self.expires_at = parent.expires_at if self.expires_at is None else min(self.expires_at,
+                                                                                    parent.expires_at)
+
+    def child(self, seconds=None):
+        return Deadline(seconds, parent=self, clock=self._clock)
+
+    def remaining(self):
+        """Seconds until expiry, or None without a time limit."""
+        if self.expires_at is None:
+            return None
+        return max(0, self.expires_at - self._clock())
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def expired(self):
+        if self._cancelled.is_set() or (self.parent is not None and self.parent.expired()):
+            return True
+        return self.expires_at is not None and self._clock() >= self.expires_at
+
+    def check(self, what):
+        if self.expired():
+            raise DeadlineExceeded("Time is up, {0} was not finished".format(what))
@@ -0,0 +1,68 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Find out which regions contain resources at all
+
+The Resource Groups Tagging API lists the resources of many services with
+one paginated call per region. With the "tagging" discovery, a handler only
+runs its own list calls in regions where this inventory found resources of
+its type. The Tagging API only knows resources that have or once had tags,
+so this discovery is a fast first pass, not a replacement for a full sweep.
+The regions it skips are reported with the results.
+"""
+from __future__ import absolute_import
+
+from monocyte.clients import get_client, get_pagination_config
+
+SERVICE_DISCOVERY = 'service'
+TAGGING_DISCOVERY = 'tagging'
+DISCOVERY_MODES = [SERVICE_DISCOVERY, TAGGING_DISCOVERY]
+
+# Tagging API resource types of the handlers that sweep region by region.
+HANDLER_RESOURCE_TYPES = {
+    'cloudformation.Stack': 'cloudformation:stack',
+    'dynamodb.Table': 'dynamodb:table',
+    'ec2.Instance': 'ec2:instance',
+    'ec2.Volume': 'ec2:volume',
+    'rds2.Instance': 'rds:db',
+    'rds2.Snapshot': 'rds:snapshot',
+}
+
+
+def get_resource_type(arn):
+    """Return the Tagging API resource type of an ARN, e.g. "ec2:instance"."""
+    parts = arn.split(':', 5)
+    if len(parts) < 6:
+        return None
+    service, resource = parts[2], parts[5]
+    for separator in ('/', ':'):
+        if separator in resource:
+            return '{0}:{1}'.format(service, resource.split(separator, 1)[0])
+    # ARNs like arn:aws:s3:::bucket-name have no resource type.
+    return service
+
+
+def fetch_inventory(region_name, page_size=None):
+    """Return the ARNs of the tagged resources of a region, by resource type."""
+    kwargs = {'ResourceTypeFilters': sorted(set(HANDLER_RESOURCE_TYPES.values()))}
+    paginator = get_client('resourcegroupstaggingapi', region_name=region_name).get_paginator('get_resources')
+    pagination_config = get_pagination_config(paginator, page_size)
+    if pagination_config:
+        kwargs['PaginationConfig'] = pagination_config
+    inventory = {}
+    for page in paginator.paginate(**kwargs):
+        for mapping in page.get('ResourceTagMappingList', []):
+            arn = mapping['ResourceARN']
+            inventory.setdefault(get_resource_type(arn), []).append(arn)
+    return inventory
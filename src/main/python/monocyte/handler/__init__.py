@@ -14,20 +14,33 @@
 # limitations under the License.
 
 from __future__ import absolute_import
+import collections
+import itertools
 import warnings
 import logging
-import boto3
+import threading
+from monocyte import cache, discovery
+from monocyte.snapshots import RunSnapshots
+from monocyte.clients import get_account_id, get_pagination_config
+from monocyte.deadline import Deadline, DeadlineExceeded
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 class Resource(object):
     def __init__(self, resource, resource_type, resource_id, creation_date,
-                 region=None, reason=None):
+                 region=None, reason=None, account_id=None):
         self.wrapped = resource
         self.region = region
         self.resource_type = resource_type
         self.resource_id = resource_id
         self.creation_date = creation_date
         self.reason = reason
+        self.account_id = account_id
 
     def __eq__(self, other):
         if type(other) is type(self):
@@ -54,16 +67,69 @@ class Resource(object):
 
 
 HANDLER_PREFIX = "monocyte.handler."
+DEFAULT_REGION_WORKERS = 8
+# How many resources of one region are fetched ahead of the consumer.
+REGION_QUEUE_SIZE = 100
+_REGION_DONE = object()
+
+
+def map_ordered(function, items, max_workers):
+    """Apply function to all items on a pool of at most max_workers threads.
+
+    The results are yielded in the order of items, each one as soon as it
+    and all of its predecessors are available. Items are taken from the
+    iterable as workers become free, so at most max_workers of them are in
+    flight at any time.
+    """
+    max_workers = max(1, max_workers)
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = collections.deque(executor.submit(function, item) for item in itertools.islice(items, max_workers))
+    try:
+        while futures:
+            result = futures.popleft().result()
+            for item in itertools.islice(items, 1):
+                futures.append(executor.submit(function, item))
+            yield result
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
 
 
 class Handler(object):
-    def __init__(self, region_filter, dry_run=True, logger=None, ignored_resources=None, whitelist=None):
+    # Names of handlers (e.g. "ec2.Instance") that must be finished before
+    # this handler may start.
+    DEPENDS_ON = []
+    # How many resources of one region are passed to delete_many() at once.
+    DELETE_BATCH_SIZE = 1
+
+    def __init__(self, region_filter, dry_run=True, logger=None, ignored_resources=None, whitelist=None,
+                 region_workers=DEFAULT_REGION_WORKERS, page_size=None, cache_dir=None,
+                 discovery_mode=discovery.SERVICE_DISCOVERY, region_timeout=None, snapshots=None):
+        if discovery_mode not in discovery.DISCOVERY_MODES:
+            raise ValueError("Unknown discovery mode {0!r}, use one of {1}".format(
+                discovery_mode, ", ".join(discovery.DISCOVERY_MODES)))
         warnings.filterwarnings('error')
         self.region_filter = region_filter
         self.region_names = [region_name for region_name in self.fetch_region_names() if self.region_filter(region_name)]
         self.dry_run = dry_run
         self.ignored_resources = ignored_resources or []
         self.whitelist = whitelist or {}
+        self.region_workers = region_workers
+        self.page_size = page_size
+        self.cache_dir = cache_dir
+        self.discovery_mode = discovery_mode
+        # Monocyte shares one RunSnapshots between the handlers of a run.
+        self.snapshots = snapshots if snapshots is not None else RunSnapshots()
+        # Monocyte replaces the deadline when the handler starts.
+        self.deadline = Deadline()
+        self.region_timeout = region_timeout
+        self.incomplete_regions = []
+        # Regions the tagging discovery ruled out.
+        self.skipped_regions = []
+        self._regions_lock = threading.Lock()
+        self._caches = {}
         self.logger = logger or logging.getLogger(__name__)
 
     @property
@@ -76,20 +142,189 @@ class Handler(object):
         full_name = "%s.%s" % (self.__class__.__module__, self.__class__.__name__)
         return full_name.replace(HANDLER_PREFIX, "")
 
+    @property
+    def whitelist(self):
+        return self._whitelist
+
+    @whitelist.setter
+    def whitelist(self, whitelist):
+        self._whitelist = whitelist or {}
+        self._whitelisted_arns = None
+
     def get_account_id(self):
-        return boto3.client('sts').get_caller_identity().get('Account')
+        return get_account_id()
 
     def get_whitelist(self):
+        if not self.whitelist:
+            return {}
         return self.whitelist.get(self.get_account_id(), {})
 
+    def get_whitelisted_arns(self):
+        """Return {arn: reason} of this account's whitelist, built on first use."""
+        if self._whitelisted_arns is None:
+            whitelisted_arns = {}
+            for arn_with_reason in self.get_whitelist().get('Arns', []):
+                whitelisted_arns[arn_with_reason['Arn']] = arn_with_reason.get('Reason')
+            self._whitelisted_arns = whitelisted_arns
+        return self._whitelisted_arns
+
+    def is_arn_whitelisted(self, arn):
+        return arn in self.get_whitelisted_arns()
+
+    def get_cache(self, name, per_account=True):
+        """Return the cache called name of this handler's account.
+
+        Every account has its own cache files, so that the sweeps of
+        different accounts never evict or overwrite each other's entries.
+        Caches whose entries hold for any account, e.g. verdicts keyed by
+        the policy document, pass per_account=False and are shared.
+        """
+        if name not in self._caches:
+            if self.cache_dir and per_account:
+                handler_cache = cache.get_cache("{0}-{1}".format(name, self.get_account_id()), self.cache_dir)
+            else:
+                handler_cache = cache.get_cache(name, self.cache_dir)
+            self._caches.setdefault(name, handler_cache)
+        return self._caches[name]
+
     def fetch_region_names(self):
         raise NotImplementedError("Should have implemented this")
 
     def fetch_unwanted_resources(self):
+        return self.fetch_in_regions(self._fetch_discovered_resources)
+
+    def has_discovered_resources(self, region_name):
+        """Tell whether region_name may contain resources of this handler.
+
+        Only the tagging discovery can rule a region out. If the Tagging API
+        fails, the region is swept as usual. The handlers of a run share
+        the inventory of each region.
+        """
+        resource_type = discovery.HANDLER_RESOURCE_TYPES.get(self.name)
+        if self.discovery_mode != discovery.TAGGING_DISCOVERY or resource_type is None:
+            return True
+        try:
+            inventory = self.snapshots.get(('tagging_inventory', region_name),
+                                           lambda: discovery.fetch_inventory(region_name, page_size=self.page_size))
+        except Exception:
+            self.logger.exception("Tagging API failed in %s, sweeping all %s resources there:",
+                                  region_name, self.name)
+            return True
+        return bool(inventory.get(resource_type))
+
+    def _fetch_discovered_resources(self, region_name):
+        if not self.has_discovered_resources(region_name):
+            self.logger.debug("%s: skipping %s, the Tagging API lists no resources there", self.name, region_name)
+            with self._regions_lock:
+                self.skipped_regions.append(region_name)
+            return []
+        return self._fetch_unwanted_resources(region_name)
+
+    def _fetch_unwanted_resources(self, region_name):
         raise NotImplementedError("Should have implemented this")
 
+    def paginate(self, client, operation_name, result_key, **kwargs):
+        """Yield the result_key items of all pages of a boto3 list operation.
+
+        Pages are requested lazily, so only one page is held in memory at a
+        time. If page_size is None, or the operation has no page size, the
+        service default is used.
+        """
+        paginator = client.get_paginator(operation_name)
+        pagination_config = get_pagination_config(paginator, self.page_size)
+        if pagination_config:
+            kwargs['PaginationConfig'] = pagination_config
+        self.deadline.check(operation_name)
+        for page in paginator.paginate(**kwargs):
+            for item in page.get(result_key, []):
+                yield item
+            self.deadline.check(operation_name)
+
+    def fetch_in_regions(self, fetch_region, region_names=None):
+        """Run fetch_region(region_name) for all handled regions concurrently.
+
+        Resources are yielded region by region in the order of region_names
+        (by default self.region_names), so the output is the same as for a
+        serial sweep. At most region_workers regions are fetched at a time,
+        each at most REGION_QUEUE_SIZE resources ahead of the consumer, so a
+        consumer that stops reading also stops the listing. A region that
+        runs out of time keeps the resources found so far and is listed in
+        incomplete_regions.
+        """
+        stopped = threading.Event()
+
+        def fetch(region_name, results):
+            region_deadline = self.deadline.child(self.region_timeout)
+            try:
+                region_deadline.check("the sweep of " + region_name)
+                for resource in fetch_region(region_name):
+                    if stopped.is_set():
+                        return
+                    results.put(resource)
+                    region_deadline.check("the sweep of " + region_name)
+            except DeadlineExceeded as exc:
+                self.record_incomplete_region(region_name, exc)
+            finally:
+                if not stopped.is_set():
+                    results.put(_REGION_DONE)
+
+        if region_names is None:
+            region_names = self.region_names
+        region_names = iter(region_names)
+        workers = max(1, self.region_workers)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        in_flight = collections.deque()
+
+        def start(region_names):
+            for region_name in region_names:
+                results = queue.Queue(maxsize=REGION_QUEUE_SIZE)
+                in_flight.append((executor.submit(fetch, region_name, results), results))
+
+        try:
+            start(itertools.islice(region_names, workers))
+            while in_flight:
+                future, results = in_flight[0]
+                resource = results.get()
+                while resource is not _REGION_DONE:
+                    yield resource
+                    resource = results.get()
+                in_flight.popleft()
+                future.result()
+                start(itertools.islice(region_names, 1))
+        finally:
+            # A fetch blocked on a full queue puts at most one more
+            # resource after the queue was emptied, then sees stopped.
+            stopped.set()
+            for future, results in in_flight:
+                future.cancel()
+                while not results.empty():
+                    results.get_nowait()
+            executor.shutdown(wait=True)
+
+    def record_incomplete_region(self, region_name, exc):
+        """Remember that the sweep of region_name missed resources, because of exc."""
+        self.logger.warning("%s in %s: %s", self.name, region_name, exc)
+        with self._regions_lock:
+            self.incomplete_regions.append((region_name, exc))
+
     def to_string(self, resource):
         raise NotImplementedError("Should have implemented this")
 
     def delete(self, resource):
         raise NotImplementedError("Should have implemented this")
+
+    def delete_many(self, resources):
+        """Delete resources of one region and return (resource, exception) pairs.
+
+        The exception is None if the resource was deleted. Handlers whose
+        APIs accept several resources in one call override this.
+        """
+        results = []
+        for resource in resources:
+            try:
+                self.delete(resource)
+            except Exception as exc:
+                results.append((resource, exc))
+            else:
+                results.append((resource, None))
+        return results
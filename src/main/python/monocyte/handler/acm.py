@@ -11,44 +11,82 @@ can also check imported certificates (which cannot be renewed by ACM).
 """
 from __future__ import absolute_import, print_function, division
 
+import bisect
 import datetime
-import boto3
-from monocyte.handler import Resource, Handler
+from monocyte.clients import get_client, get_available_regions
+from monocyte.handler import Resource, Handler, map_ordered
 
 # ACM attempts to renew SSL certificates 60 before expiration. If it
 # is still not renewed 55 days before expiration, something is wrong.
 MIN_VALID_DAYS = 55
+DEFAULT_CERTIFICATE_WORKERS = 4
+
+
+def format_expiry(not_after):
+    # Remove time zone information so we can compare with normal datetimes.
+    # The format sorts like the dates it represents.
+    return datetime.datetime.replace(not_after, tzinfo=None).strftime('%Y-%m-%dT%H:%M:%S')
+
 
 class Certificate(Handler):
+    def __init__(self, region_filter, certificate_workers=DEFAULT_CERTIFICATE_WORKERS, **kwargs):
+        self.certificate_workers = certificate_workers
+        super(Certificate, self).__init__(region_filter, **kwargs)
+
     def fetch_region_names(self):
         # Since we want to check all regions, regardless of what's allowed or
         # not, we handle multi-region stuff ourselves.
         return []
 
     def fetch_unwanted_resources(self):
-        session = boto3.session.Session()
-        region_names = session.get_available_regions('acm')
-        unwanted_resources = []
-
-        for region_name in region_names:
-            unwanted_resources.extend(list(self._fetch_unwanted_resources(region_name)))
-        return unwanted_resources
-
-    def _fetch_unwanted_resources(self, region_name):
-        client = boto3.client('acm', region_name=region_name)
-        response = client.list_certificates(CertificateStatuses=['ISSUED'])
-        certificate_arns = [summary['CertificateArn'] for summary in response['CertificateSummaryList']]
-
-        limit = datetime.datetime.now() + datetime.timedelta(days=MIN_VALID_DAYS)
+        index = self.get_cache('acm_certificates')
+        listed_arns = set()
+
+        def fetch_region(region_name):
+            return self._fetch_unwanted_resources(region_name, index, listed_arns)
+
+        try:
+            for resource in self.fetch_in_regions(fetch_region, region_names=get_available_regions('acm')):
+                yield resource
+            index.retain(listed_arns)
+        finally:
+            index.save()
+
+    def _fetch_unwanted_resources(self, region_name, index, listed_arns):
+        """Report the certificates of a region that expire within MIN_VALID_DAYS.
+
+        The index remembers the expiry date of every certificate, so only new
+        certificates and those about to expire are described. The latter
+        because ACM renews a certificate in place, under the same ARN.
+        """
+        client = get_client('acm', region_name=region_name)
+        summaries = self.paginate(client, 'list_certificates', 'CertificateSummaryList',
+                                  CertificateStatuses=['ISSUED'])
+        certificate_arns = [summary['CertificateArn'] for summary in summaries]
+        listed_arns.update(certificate_arns)
+
+        def describe_certificate(certificate_arn):
+            # The client's rate limiter keeps the calls below ACM's limit.
+            certificate = client.describe_certificate(CertificateArn=certificate_arn)['Certificate']
+            index.set(certificate_arn, {'NotAfter': format_expiry(certificate['NotAfter']),
+                                        'DomainName': certificate['DomainName']})
+            return certificate
+
+        limit = format_expiry(datetime.datetime.now() + datetime.timedelta(days=MIN_VALID_DAYS))
+
+        new_arns = [arn for arn in certificate_arns if index.get(arn) is None]
+        described = dict((certificate['CertificateArn'], certificate) for certificate in
+                         map_ordered(describe_certificate, new_arns, self.certificate_workers))
+
+        expiries = sorted((index.get(arn)['NotAfter'], arn) for arn in certificate_arns)
+        expiring = expiries[:bisect.bisect_right([not_after for not_after, _ in expiries], limit)]
+        renewal_candidates = [arn for _, arn in expiring if arn not in described]
+        for certificate in map_ordered(describe_certificate, renewal_candidates, self.certificate_workers):
+            described[certificate['CertificateArn']] = certificate
 
         for certificate_arn in certificate_arns:
-            response = client.describe_certificate(CertificateArn=certificate_arn)
-            certificate = response['Certificate']
-
-            # Remove time zone information so we can compare with normal datetimes.
-            not_after = datetime.datetime.replace(certificate['NotAfter'], tzinfo=None)
-
-            if not_after > limit:
+            certificate = described.get(certificate_arn)
+            if certificate is None or format_expiry(certificate['NotAfter']) > limit:
                 continue
 
             resource_wrapper = Resource(
@@ -14,46 +14,55 @@
 # limitations under the License.
 
 import warnings
-from boto import cloudformation
+from monocyte.clients import get_client, get_available_regions
 from monocyte.handler import Resource, Handler
 
+STACK_STATUSES = [
+    "CREATE_IN_PROGRESS", "CREATE_FAILED", "CREATE_COMPLETE",
+    "ROLLBACK_IN_PROGRESS", "ROLLBACK_FAILED", "ROLLBACK_COMPLETE",
+    "DELETE_IN_PROGRESS", "DELETE_FAILED", "DELETE_COMPLETE",
+    "UPDATE_IN_PROGRESS", "UPDATE_COMPLETE_CLEANUP_IN_PROGRESS", "UPDATE_COMPLETE",
+    "UPDATE_FAILED", "UPDATE_ROLLBACK_IN_PROGRESS", "UPDATE_ROLLBACK_FAILED",
+    "UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS", "UPDATE_ROLLBACK_COMPLETE",
+    "REVIEW_IN_PROGRESS",
+    "IMPORT_IN_PROGRESS", "IMPORT_COMPLETE", "IMPORT_ROLLBACK_IN_PROGRESS",
+    "IMPORT_ROLLBACK_FAILED", "IMPORT_ROLLBACK_COMPLETE",
+]
+
 
 class Stack(Handler):
 
     VALID_TARGET_STATES = ["DELETE_COMPLETE", "DELETE_IN_PROGRESS"]
 
     def fetch_region_names(self):
-        return [region.name for region in cloudformation.regions()]
-
-    def fetch_unwanted_resources(self):
-        for region_name in self.region_names:
-            connection = cloudformation.connect_to_region(region_name)
-            unwanted_states = set(connection.valid_states)
-            unwanted_states.remove("DELETE_COMPLETE")
-            resources = connection.list_stacks(stack_status_filters=list(unwanted_states)) or []
-            for resource in resources:
-                resource_wrapper = Resource(resource=resource,
-                                            resource_type=self.resource_type,
-                                            resource_id=resource.stack_id,
-                                            creation_date=resource.creation_time,
-                                            region=region_name)
-                if resource.stack_name in self.ignored_resources:
-                    self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
-                    continue
-
-                yield resource_wrapper
+        return get_available_regions('cloudformation')
+
+    def _fetch_unwanted_resources(self, region_name):
+        client = get_client('cloudformation', region_name=region_name)
+        unwanted_states = [state for state in STACK_STATUSES if state not in Stack.VALID_TARGET_STATES]
+        for resource in self.paginate(client, 'list_stacks', 'StackSummaries', StackStatusFilter=unwanted_states):
+            resource_wrapper = Resource(resource=resource,
+                                        resource_type=self.resource_type,
+                                        resource_id=resource['StackId'],
+                                        creation_date=resource['CreationTime'],
+                                        region=region_name)
+            if resource['StackName'] in self.ignored_resources:
+                self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
+                continue
+
+            yield resource_wrapper
 
     def to_string(self, resource):
         return "CloudFormation Stack found in {region}, ".format(**vars(resource)) + \
-               "with name {stack_name}, created {creation_time}, " \
-               "with state {stack_status}".format(**vars(resource.wrapped))
+               "with name {StackName}, created {CreationTime}, " \
+               "with state {StackStatus}".format(**resource.wrapped)
 
     def delete(self, resource):
-        if resource.wrapped.stack_status in Stack.VALID_TARGET_STATES:
+        if resource.wrapped['StackStatus'] in Stack.VALID_TARGET_STATES:
             warnings.warn(Warning("Skipping deletion: State '{0}' is a valid target state.".format(
-                resource.wrapped.stack_status)))
+                resource.wrapped['StackStatus'])))
         if self.dry_run:
             return
-        self.logger.info("Initiating deletion sequence for {stack_name}.".format(**vars(resource.wrapped)))
-        connection = cloudformation.connect_to_region(resource.region)
-        connection.delete_stack(resource.wrapped.stack_id)
+        self.logger.info("Initiating deletion sequence for {StackName}.".format(**resource.wrapped))
+        client = get_client('cloudformation', region_name=resource.region)
+        client.delete_stack(StackName=resource.wrapped['StackId'])
@@ -13,43 +13,59 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import datetime
-from boto import dynamodb2
-from monocyte.handler import Resource, Handler
+from botocore.exceptions import ClientError
+from monocyte.clients import get_client, get_available_regions
+from monocyte.handler import Resource, Handler, map_ordered
+
+DEFAULT_TABLE_WORKERS = 8
 
 
 class Table(Handler):
+    def __init__(self, region_filter, table_workers=DEFAULT_TABLE_WORKERS, **kwargs):
+        self.table_workers = table_workers
+        super(Table, self).__init__(region_filter, **kwargs)
+
     def fetch_region_names(self):
-        return [region.name for region in dynamodb2.regions()]
-
-    def fetch_unwanted_resources(self):
-        for region_name in self.region_names:
-            connection = dynamodb2.connect_to_region(region_name)
-            names = connection.list_tables(limit=100) or {}
-            for name in names.get("TableNames"):
-                resource = connection.describe_table(name)
-                resource_wrapper = Resource(resource=resource["Table"],
-                                            resource_type=self.resource_type,
-                                            resource_id=resource["Table"]["TableName"],
-                                            creation_date=resource["Table"]["CreationDateTime"],
-                                            region=region_name)
-                if name in self.ignored_resources:
-                    self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
-                    continue
-
-                yield resource_wrapper
+        return get_available_regions('dynamodb')
+
+    def _fetch_unwanted_resources(self, region_name):
+        client = get_client('dynamodb', region_name=region_name)
+        names = []
+        for name in self.paginate(client, 'list_tables', 'TableNames'):
+            if name in self.ignored_resources:
+                self.logger.info('IGNORE DynamoDB Table {0} in {1}'.format(name, region_name))
+                continue
+            names.append(name)
+
+        def describe_table(name):
+            try:
+                return client.describe_table(TableName=name)["Table"]
+            except ClientError as exc:
+                # The table was deleted after it had been listed.
+                if exc.response.get("Error", {}).get("Code") == "ResourceNotFoundException":
+                    return None
+                raise
+
+        for table in map_ordered(describe_table, names, self.table_workers):
+            if table is None:
+                continue
+            yield Resource(resource=table,
+                           resource_type=self.resource_type,
+                           resource_id=table["TableName"],
+                           creation_date=table["CreationDateTime"],
+                           region=region_name)
 
     def to_string(self, resource):
         table = resource.wrapped
         return "DynamoDB Table found in {0}, ".format(resource.region) + \
                "with name {0}, created {1}, with state {2}".format(
                    table["TableName"],
-                   datetime.datetime.fromtimestamp(table["CreationDateTime"]).strftime('%Y-%m-%d %H:%M:%S.%f'),
+                   table["CreationDateTime"].strftime('%Y-%m-%d %H:%M:%S.%f'),
                    table["TableStatus"])
 
     def delete(self, resource):
         if self.dry_run:
             return
-        connection = dynamodb2.connect_to_region(resource.region)
+        client = get_client('dynamodb', region_name=resource.region)
         self.logger.info("Initiating deletion sequence for {0}.".format(resource.wrapped["TableName"]))
-        connection.delete_table(resource.wrapped["TableName"])
+        client.delete_table(TableName=resource.wrapped["TableName"])
@@ -13,91 +13,173 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import warnings
-from boto import ec2
-from boto.exception import EC2ResponseError
+from botocore.exceptions import ClientError
+from monocyte.clients import get_client, get_available_regions
 from monocyte.handler import Resource, Handler
 
+DRY_RUN_ERROR_CODE = "DryRunOperation"
+
+# Instances and volumes in other states are already on their way out, so
+# they are filtered out by the API instead of being listed at all.
+UNWANTED_INSTANCE_STATES = ["pending", "running", "stopping", "stopped"]
+UNWANTED_VOLUME_STATES = ["creating", "available", "in-use", "error"]
+
+
+def raise_on_dry_run(exc):
+    if exc.response.get("Error", {}).get("Code") == DRY_RUN_ERROR_CODE:
+        raise Warning("Termination {0}".format(exc.response["Error"].get("Message")))
+
 
 class Instance(Handler):
     VALID_TARGET_STATES = ["terminated", "shutting-down"]
+    # TerminateInstances accepts many instance IDs per call.
+    DELETE_BATCH_SIZE = 100
 
     def fetch_region_names(self):
-        return [region.name for region in ec2.regions()]
+        return get_available_regions('ec2')
 
-    def fetch_unwanted_resources(self):
-        for region_name in self.region_names:
-            connection = ec2.connect_to_region(region_name)
-            resources = connection.get_only_instances() or []
-            for resource in resources:
+    def _fetch_unwanted_resources(self, region_name):
+        client = get_client('ec2', region_name=region_name)
+        state_filter = {'Name': 'instance-state-name', 'Values': UNWANTED_INSTANCE_STATES}
+        for reservation in self.paginate(client, 'describe_instances', 'Reservations', Filters=[state_filter]):
+            for resource in reservation['Instances']:
                 resource_wrapper = Resource(resource=resource,
                                             resource_type=self.resource_type,
-                                            resource_id=resource.id,
-                                            creation_date=resource.launch_time,
+                                            resource_id=resource['InstanceId'],
+                                            creation_date=resource['LaunchTime'],
                                             region=region_name)
-                if resource.id in self.ignored_resources:
+                if resource['InstanceId'] in self.ignored_resources:
                     self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
                     continue
                 yield resource_wrapper
 
     def to_string(self, resource):
-        return "ec2 instance found in {region.name}, " \
+        instance = resource.wrapped
+        return "ec2 instance found in {region}, " \
                "with identifier {id}, instance type is {instance_type}, created {launch_time}, " \
-               "dnsname is {public_dns_name}, key {key_name}, with state {_state}".format(**vars(resource.wrapped))
+               "dnsname is {public_dns_name}, key {key_name}, with state {state}".format(
+                   region=resource.region,
+                   id=instance['InstanceId'],
+                   instance_type=instance.get('InstanceType'),
+                   launch_time=instance['LaunchTime'],
+                   public_dns_name=instance.get('PublicDnsName'),
+                   key_name=instance.get('KeyName'),
+                   state=instance['State']['Name'])
 
     def delete(self, resource):
-        if resource.wrapped.state in Instance.VALID_TARGET_STATES:
-            raise Warning("state '{0}' is a valid target state, skipping".format(
-                resource.wrapped.state))
-        connection = ec2.connect_to_region(resource.region)
+        self._check_target_state(resource)
+        client = get_client('ec2', region_name=resource.region)
+        return self._terminate_instances(client, [resource.wrapped['InstanceId']])
+
+    def delete_many(self, resources):
+        results = []
+        candidates = []
+        for resource in resources:
+            try:
+                self._check_target_state(resource)
+            except Warning as warn:
+                results.append((resource, warn))
+            else:
+                candidates.append(resource)
+        if not candidates:
+            return results
+
+        client = get_client('ec2', region_name=candidates[0].region)
+        try:
+            self._terminate_instances(client, [resource.wrapped['InstanceId'] for resource in candidates])
+        except Exception as exc:
+            if isinstance(exc, Warning) or len(candidates) == 1:
+                results.extend((resource, exc) for resource in candidates)
+                return results
+            # A single broken instance fails the whole call, so find out which one it is.
+            self.logger.info("Terminating {0} instances failed, retrying one by one: {1}".format(
+                len(candidates), exc))
+            for resource in candidates:
+                try:
+                    self._terminate_instances(client, [resource.wrapped['InstanceId']])
+                except Exception as item_exc:
+                    results.append((resource, item_exc))
+                else:
+                    results.append((resource, None))
+        else:
+            results.extend((resource, None) for resource in candidates)
+        return results
+
+    def _check_target_state(self, resource):
+        state = resource.wrapped['State']['Name']
+        if state in Instance.VALID_TARGET_STATES:
+            raise Warning("state '{0}' is a valid target state, skipping".format(state))
+
+    def _terminate_instances(self, client, instance_ids):
         if self.dry_run:
             try:
-                connection.terminate_instances([resource.wrapped.id], dry_run=True)
-            except EC2ResponseError as exc:
-                if exc.status == 412:  # Precondition Failed
-                    raise Warning("Termination {message}".format(**vars(exc)))
+                client.terminate_instances(InstanceIds=instance_ids, DryRun=True)
+            except ClientError as exc:
+                raise_on_dry_run(exc)
                 raise
         else:
-            instances = connection.terminate_instances([resource.wrapped.id], dry_run=False)
-            self.logger.info("Initiating shutdown sequence for {0}".format(instances))
+            response = client.terminate_instances(InstanceIds=instance_ids, DryRun=False)
+            instances = response['TerminatingInstances']
+            self.logger.info("Initiating shutdown sequence for {0}".format(
+                [instance['InstanceId'] for instance in instances]))
             return instances
 
 
 class Volume(Handler):
+    # Volumes of running instances cannot be deleted.
+    DEPENDS_ON = ["ec2.Instance"]
+    # Volumes are deleted one by one, but share one client per batch.
+    DELETE_BATCH_SIZE = 50
 
     def fetch_region_names(self):
-        return [region.name for region in ec2.regions()]
+        return get_available_regions('ec2')
 
-    def fetch_unwanted_resources(self):
-        for region_name in self.region_names:
-            connection = ec2.connect_to_region(region_name)
-            resources = connection.get_all_volumes() or []
-            for resource in resources:
-                resource_wrapper = Resource(resource=resource,
-                                            resource_type=self.resource_type,
-                                            resource_id=resource.id,
-                                            creation_date=resource.create_time,
-                                            region=region_name)
-                if resource.id in self.ignored_resources:
-                    self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
-                    continue
-                yield resource_wrapper
+    def _fetch_unwanted_resources(self, region_name):
+        client = get_client('ec2', region_name=region_name)
+        status_filter = {'Name': 'status', 'Values': UNWANTED_VOLUME_STATES}
+        for resource in self.paginate(client, 'describe_volumes', 'Volumes', Filters=[status_filter]):
+            resource_wrapper = Resource(resource=resource,
+                                        resource_type=self.resource_type,
+                                        resource_id=resource['VolumeId'],
+                                        creation_date=resource['CreateTime'],
+                                        region=region_name)
+            if resource['VolumeId'] in self.ignored_resources:
+                self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
+                continue
+            yield resource_wrapper
 
     def to_string(self, resource):
-        return "ebs volume found in {region.name}, " \
+        return "ebs volume found in {region}, " \
                "with identifier {id}, created {create_time}, " \
-               "with state {status}".format(**vars(resource.wrapped))
+               "with state {status}".format(region=resource.region,
+                                            id=resource.wrapped['VolumeId'],
+                                            create_time=resource.wrapped['CreateTime'],
+                                            status=resource.wrapped['State'])
 
     def delete(self, resource):
-        connection = ec2.connect_to_region(resource.region)
+        client = get_client('ec2', region_name=resource.region)
+        self._delete_volume(client, resource)
+
+    def delete_many(self, resources):
+        client = get_client('ec2', region_name=resources[0].region)
+        results = []
+        for resource in resources:
+            try:
+                self._delete_volume(client, resource)
+            except Exception as exc:
+                results.append((resource, exc))
+            else:
+                results.append((resource, None))
+        return results
 
+    def _delete_volume(self, client, resource):
+        volume_id = resource.wrapped['VolumeId']
         if self.dry_run:
             try:
-                connection.delete_volume(resource.wrapped.id, dry_run=True)
-            except EC2ResponseError as exc:
-                if exc.status == 412:  # Precondition Failed
-                    warnings.warn(Warning("Termination {message}".format(**vars(exc))))
+                client.delete_volume(VolumeId=volume_id, DryRun=True)
+            except ClientError as exc:
+                raise_on_dry_run(exc)
                 raise
         else:
-            self.logger.info("Initiating deletion of EBS volume {0}".format(resource.wrapped.id))
-            connection.delete_volume(resource.wrapped.id, dry_run=False)
+            self.logger.info("Initiating deletion of EBS volume {0}".format(volume_id))
+            client.delete_volume(VolumeId=volume_id, DryRun=False)
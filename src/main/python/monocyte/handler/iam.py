@@ -1,20 +1,143 @@
 from __future__ import print_function, absolute_import, division
 
-import boto3
-from boto import iam
+import csv
+import datetime
+import io
+import time
+
+from dateutil.tz import tzutc
+from monocyte.clients import get_client, get_available_regions, get_pagination_config
+from monocyte.deadline import Deadline
 from monocyte.handler import Resource, Handler
+from monocyte.policy_analyzer import PolicyAnalyzer
+
+AUTHORIZATION_DETAILS_FILTER = ['User', 'Role', 'LocalManagedPolicy']
+
+CREDENTIAL_REPORT_POLL_INTERVAL = 2
+CREDENTIAL_REPORT_POLL_ATTEMPTS = 60
+DEFAULT_MAX_KEY_AGE_DAYS = 90
+DEFAULT_MAX_UNUSED_DAYS = 90
+ROOT_ACCOUNT_USER = '<root_account>'
+
+
+def parse_report_date(value):
+    """Parse a credential report timestamp (always UTC), or return None for "N/A" and friends."""
+    try:
+        return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=tzutc())
+    except (TypeError, ValueError):
+        return None
+
+
+def read_credential_report(content):
+    """Yield the rows of a credential report CSV as dicts, one line at a time."""
+    lines = (line.decode('utf-8') for line in io.BytesIO(content))
+    return csv.DictReader(lines)
+
+
+class AuthorizationDetails(object):
+    """Users, roles with their inline policies and customer managed policies
+    with their versions, read with the bulk GetAccountAuthorizationDetails call.
+    """
+    def __init__(self, users, roles, policies):
+        self.users = users
+        self.roles = roles
+        self.policies = policies
+
+    @classmethod
+    def fetch(cls, client, page_size=None, deadline=None):
+        deadline = deadline or Deadline()
+        kwargs = {'Filter': AUTHORIZATION_DETAILS_FILTER}
+        paginator = client.get_paginator('get_account_authorization_details')
+        pagination_config = get_pagination_config(paginator, page_size)
+        if pagination_config:
+            kwargs['PaginationConfig'] = pagination_config
+        users, roles, policies = [], [], []
+        deadline.check('get_account_authorization_details')
+        for page in paginator.paginate(**kwargs):
+            users.extend(page.get('UserDetailList', []))
+            roles.extend(page.get('RoleDetailList', []))
+            policies.extend(page.get('Policies', []))
+            deadline.check('get_account_authorization_details')
+        return cls(users, roles, policies)
+
+
+class IamHandler(Handler):
+    def fetch_region_names(self):
+        return get_available_regions('iam')
 
+    def get_authorization_details(self):
+        return self.snapshots.get('iam_authorization_details',
+                                  lambda: AuthorizationDetails.fetch(get_client('iam'), page_size=self.page_size,
+                                                                     deadline=self.deadline))
 
-class User(Handler):
-    def fetch_region_names(self):
-        return [region.name for region in iam.regions()]
+
+class User(IamHandler):
+    def __init__(self, region_filter, use_credential_report=False, max_key_age_days=DEFAULT_MAX_KEY_AGE_DAYS,
+                 max_unused_days=DEFAULT_MAX_UNUSED_DAYS, **kwargs):
+        self.use_credential_report = use_credential_report
+        self.max_key_age_days = max_key_age_days
+        self.max_unused_days = max_unused_days
+        super(User, self).__init__(region_filter, **kwargs)
 
     def get_users(self):
-        iam = boto3.client('iam')
-        user_response = iam.list_users()
-        return user_response['Users']
+        return self.get_authorization_details().users
+
+    def get_credential_report(self):
+        client = get_client('iam')
+        for _ in range(CREDENTIAL_REPORT_POLL_ATTEMPTS):
+            self.deadline.check("the generation of the IAM credential report")
+            if client.generate_credential_report()['State'] == 'COMPLETE':
+                return client.get_credential_report()['Content']
+            time.sleep(CREDENTIAL_REPORT_POLL_INTERVAL)
+        raise RuntimeError("IAM credential report was not ready after {0} seconds".format(
+            CREDENTIAL_REPORT_POLL_ATTEMPTS * CREDENTIAL_REPORT_POLL_INTERVAL))
 
     def fetch_unwanted_resources(self):
+        if self.use_credential_report:
+            return self.fetch_unwanted_resources_from_report()
+        return self.fetch_unwanted_users()
+
+    def fetch_unwanted_resources_from_report(self):
+        now = datetime.datetime.now(tzutc())
+        for row in read_credential_report(self.get_credential_report()):
+            if row['user'] == ROOT_ACCOUNT_USER:
+                continue
+            if self.is_arn_whitelisted(row['arn']) or row['arn'] in self.ignored_resources:
+                self.logger.info('IGNORE user with {0}'.format(row['arn']))
+                continue
+            findings = self.classify_credentials(row, now)
+            if not findings:
+                continue
+            yield Resource(resource=row,
+                           resource_type=self.resource_type,
+                           resource_id=row['arn'],
+                           creation_date=parse_report_date(row['user_creation_time']),
+                           region='global',
+                           reason="{0} {1}.".format(self.email_string(), ", ".join(findings)))
+
+    def classify_credentials(self, row, now):
+        """Describe the static credentials of a credential report row; empty if it has none."""
+        findings = []
+        if row.get('password_enabled') == 'true':
+            findings.append("console password enabled")
+        for number in ('1', '2'):
+            prefix = 'access_key_{0}_'.format(number)
+            if row.get(prefix + 'active') != 'true':
+                continue
+            details = []
+            last_rotated = parse_report_date(row.get(prefix + 'last_rotated'))
+            if last_rotated and (now - last_rotated).days > self.max_key_age_days:
+                details.append("{0} days old".format((now - last_rotated).days))
+            last_used = parse_report_date(row.get(prefix + 'last_used_date'))
+            if last_used is None:
+                details.append("never used")
+            elif (now - last_used).days > self.max_unused_days:
+                details.append("unused for {0} days".format((now - last_used).days))
+            findings.append("active access key {0}{1}".format(
+                number, " ({0})".format(", ".join(details)) if details else ""))
+        return findings
+
+    def fetch_unwanted_users(self):
         for user in self.get_users():
             if self.is_user_in_whitelist(user) or self.is_user_in_ignored_resources(user):
                 self.logger.info('IGNORE user with {0}'.format(user['Arn']))
@@ -28,12 +151,7 @@ class User(Handler):
             yield unwanted_resource
 
     def is_user_in_whitelist(self, user):
-        whitelist_arns = self.get_whitelist().get('Arns', [])
-        for arn_with_reason in whitelist_arns:
-            if user['Arn'] == arn_with_reason['Arn']:
-                return True
-
-        return False
+        return self.is_arn_whitelisted(user['Arn'])
 
     def is_user_in_ignored_resources(self, user):
         return user['Arn'] in self.ignored_resources
@@ -50,33 +168,27 @@ class User(Handler):
         raise NotImplementedError("Should have implemented this")
 
 
-class Policy(Handler):
-    def fetch_region_names(self):
-        return [region.name for region in iam.regions()]
-
-    def gather_actions(self, policy_document):
-        statement = policy_document['Statement']
-        if isinstance(statement, dict):
-            if isinstance(statement['Action'], list):
-                return statement['Action']
-            return [statement['Action']]
-        actions = []
-        for action in statement:
-            if isinstance(action['Action'], list):
-                actions.extend(action['Action'])
-            else:
-                actions.append(action['Action'])
-        return actions
-
-    def check_policy_action_for_forbidden_string(self, actions):
-        return '*:*' in actions or '*' in actions
+class Policy(IamHandler):
+    def __init__(self, region_filter, forbidden_actions=None, **kwargs):
+        super(Policy, self).__init__(region_filter, **kwargs)
+        # The verdicts only depend on the policy document, so all accounts
+        # share them.
+        verdicts = self.get_cache('iam_policy_verdicts', per_account=False)
+        self.analyzer = PolicyAnalyzer(forbidden_actions, verdicts=verdicts)
+
+    def is_policy_document_forbidden(self, policy_document):
+        return self.analyzer.is_forbidden(policy_document)
+
+    def fetch_unwanted_resources(self):
+        try:
+            for resource in self.fetch_unwanted_policies():
+                yield resource
+        finally:
+            self.analyzer.verdicts.save()
 
     def is_arn_in_whitelist(self, policy):
-        whitelist_arns = self.get_whitelist().get('Arns', [])
-        for arn_with_reason in whitelist_arns:
-            if policy['Arn'] == arn_with_reason['Arn']:
-                return True
-        return False
+        whitelisted_arns = self.get_whitelisted_arns()
+        return bool(whitelisted_arns) and policy['Arn'] in whitelisted_arns
 
     def delete(self, resource):
         if self.dry_run:
@@ -89,20 +201,25 @@ class Policy(Handler):
 
 class IamPolicy(Policy):
     def get_policies(self):
-        client = boto3.client('iam')
-        return client.list_policies(Scope='Local')['Policies']
+        return self.get_authorization_details().policies
 
     def get_policy_document(self, arn, version):
-        resource = boto3.resource('iam')
-        return resource.PolicyVersion(arn, version).document
+        response = get_client('iam').get_policy_version(PolicyArn=arn, VersionId=version)
+        return response['PolicyVersion']['Document']
 
-    def fetch_unwanted_resources(self):
+    def get_default_policy_document(self, policy):
+        for version in policy.get('PolicyVersionList', []):
+            if version['IsDefaultVersion']:
+                return version['Document']
+        return self.get_policy_document(policy['Arn'], policy['DefaultVersionId'])
+
+    def fetch_unwanted_policies(self):
         for policy in self.get_policies():
+            self.deadline.check("the check of iam policies")
             if self.is_arn_in_whitelist(policy):
                 continue
-            policy_document = self.get_policy_document(policy['Arn'], policy['DefaultVersionId'])
-            actions = self.gather_actions(policy_document)
-            if self.check_policy_action_for_forbidden_string(actions):
+            policy_document = self.get_default_policy_document(policy)
+            if self.is_policy_document_forbidden(policy_document):
                 unwanted_resource = Resource(resource=policy,
                                              resource_type=self.resource_type,
                                              resource_id=policy['Arn'],
@@ -116,27 +233,15 @@ class IamPolicy(Policy):
 
 class InlinePolicy(Policy):
     def get_all_iam_roles_in_account(self):
-        client = boto3.client('iam')
-        roles_response = client.list_roles()['Roles']
-        return roles_response
-
-    def get_all_inline_policies_for_role(self, role_name):
-        iam = boto3.resource('iam')
-        role_policies = []
-        role = iam.Role(role_name)
-        for role_policy in role.policies.all():
-            role_policies.append(role_policy)
-        return role_policies
+        return self.get_authorization_details().roles
 
-    def fetch_unwanted_resources(self):
+    def fetch_unwanted_policies(self):
         for role in self.get_all_iam_roles_in_account():
+            self.deadline.check("the check of iam inline policies")
             if self.is_arn_in_whitelist(role):
                 continue
-            policies = self.get_all_inline_policies_for_role(role['RoleName'])
-            for policy in policies:
-                actions = self.gather_actions(policy.policy_document)
-                if self.check_policy_action_for_forbidden_string(
-                        actions):
+            for policy in role.get('RolePolicyList', []):
+                if self.is_policy_document_forbidden(policy['PolicyDocument']):
                     unwanted_resource = Resource(resource=role,
                                                  resource_type=self.resource_type,
                                                  resource_id=role['Arn'],
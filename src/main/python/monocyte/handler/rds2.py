@@ -14,7 +14,7 @@
 # limitations under the License.
 
 import warnings
-from boto import rds2
+from monocyte.clients import get_client, get_available_regions
 from monocyte.handler import Resource, Handler
 
 SKIPPING_CREATION_STATEMENT = "Currently in creation. Skipping."
@@ -24,28 +24,27 @@ DELETION_STATEMENT = "Initiating deletion sequence for %s."
 
 CREATION_STATUS = "creating"
 AUTOMATED_STATUS = "automated"
+MANUAL_SNAPSHOT_TYPE = "manual"
 DELETION_STATUS = "deleting"
 
 
 class Instance(Handler):
 
     def fetch_region_names(self):
-        return [region.name for region in rds2.regions()]
-
-    def fetch_unwanted_resources(self):
-        for region_name in self.region_names:
-            connection = rds2.connect_to_region(region_name)
-            resources = connection.describe_db_instances() or []
-            for resource in resources["DescribeDBInstancesResponse"]["DescribeDBInstancesResult"]["DBInstances"]:
-                resource_wrapper = Resource(resource=resource,
-                                            resource_type=self.resource_type,
-                                            resource_id=resource["DBInstanceIdentifier"],
-                                            creation_date=resource["InstanceCreateTime"],
-                                            region=region_name)
-                if resource['DBInstanceIdentifier'] in self.ignored_resources:
-                    self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
-                    continue
-                yield resource_wrapper
+        return get_available_regions('rds')
+
+    def _fetch_unwanted_resources(self, region_name):
+        client = get_client('rds', region_name=region_name)
+        for resource in self.paginate(client, 'describe_db_instances', 'DBInstances'):
+            resource_wrapper = Resource(resource=resource,
+                                        resource_type=self.resource_type,
+                                        resource_id=resource["DBInstanceIdentifier"],
+                                        creation_date=resource["InstanceCreateTime"],
+                                        region=region_name)
+            if resource['DBInstanceIdentifier'] in self.ignored_resources:
+                self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
+                continue
+            yield resource_wrapper
 
     def to_string(self, resource):
         return "Database Instance found in {region}, ".format(**vars(resource)) + \
@@ -57,29 +56,30 @@ class Instance(Handler):
         if resource.wrapped["DBInstanceStatus"] == DELETION_STATUS:
             warnings.warn(Warning(SKIPPING_DELETION_STATEMENT))
         self.logger.info(DELETION_STATEMENT % resource.wrapped["DBInstanceIdentifier"])
-        connection = rds2.connect_to_region(resource.region)
-        connection.delete_db_instance(resource.wrapped["DBInstanceIdentifier"], skip_final_snapshot=True)
+        client = get_client('rds', region_name=resource.region)
+        client.delete_db_instance(DBInstanceIdentifier=resource.wrapped["DBInstanceIdentifier"],
+                                  SkipFinalSnapshot=True)
 
 
 class Snapshot(Handler):
 
     def fetch_region_names(self):
-        return [region.name for region in rds2.regions()]
-
-    def fetch_unwanted_resources(self):
-        for region_name in self.region_names:
-            connection = rds2.connect_to_region(region_name)
-            resources = connection.describe_db_snapshots() or []
-            for resource in resources["DescribeDBSnapshotsResponse"]["DescribeDBSnapshotsResult"]["DBSnapshots"]:
-                resource_wrapper = Resource(resource=resource,
-                                            resource_type=self.resource_type,
-                                            resource_id=resource["DBSnapshotIdentifier"],
-                                            creation_date=resource["SnapshotCreateTime"],
-                                            region=region_name)
-                if resource['DBSnapshotIdentifier'] in self.ignored_resources:
-                    self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
-                    continue
-                yield resource_wrapper
+        return get_available_regions('rds')
+
+    def _fetch_unwanted_resources(self, region_name):
+        client = get_client('rds', region_name=region_name)
+        # Automated snapshots are never deleted, so do not even list them.
+        for resource in self.paginate(client, 'describe_db_snapshots', 'DBSnapshots',
+                                      SnapshotType=MANUAL_SNAPSHOT_TYPE):
+            resource_wrapper = Resource(resource=resource,
+                                        resource_type=self.resource_type,
+                                        resource_id=resource["DBSnapshotIdentifier"],
+                                        creation_date=resource["SnapshotCreateTime"],
+                                        region=region_name)
+            if resource['DBSnapshotIdentifier'] in self.ignored_resources:
+                self.logger.info('IGNORE ' + self.to_string(resource_wrapper))
+                continue
+            yield resource_wrapper
 
     def to_string(self, resource):
         return "Database Snapshot found in {region}, ".format(**vars(resource)) + \
@@ -96,5 +96,5 @@ class Snapshot(Handler):
             warnings.warn(Warning(SKIPPING_AUTOGENERATED_STATEMENT))
 
         self.logger.info(DELETION_STATEMENT % resource.wrapped["DBSnapshotIdentifier"])
-        connection = rds2.connect_to_region(resource.region)
-        connection.delete_db_snapshot(resource.wrapped["DBSnapshotIdentifier"])
+        client = get_client('rds', region_name=resource.region)
+        client.delete_db_snapshot(DBSnapshotIdentifier=resource.wrapped["DBSnapshotIdentifier"])
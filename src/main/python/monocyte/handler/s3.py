@@ -13,32 +13,178 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import boto3
-from monocyte.handler import Resource, Handler
+import datetime
+import logging
+import threading
+from botocore.exceptions import ClientError
+from dateutil.tz import tzutc
+from concurrent.futures import ThreadPoolExecutor
+from monocyte.clients import get_client, get_available_regions
+from monocyte.deadline import Deadline
+from monocyte.handler import Resource, Handler, map_ordered
 
 US_STANDARD_REGION = "us-east-1"
 SIGV4_REGIONS = ['eu-central-1']
 AVAILABILITY_ZONES = {'EU': 'eu-west-1', None: US_STANDARD_REGION}
 
+# DeleteObjects accepts at most 1000 keys per call.
+DELETE_OBJECTS_BATCH_SIZE = 1000
+DEFAULT_EMPTY_WORKERS = 8
+
+# "delete" empties a bucket with the BucketEmptier. "lifecycle" lets S3
+# expire all objects and deletes the bucket in a later run once it is empty.
+EMPTY_STRATEGIES = ["delete", "lifecycle"]
+DRAIN_LIFECYCLE_CONFIGURATION = {'Rules': [
+    {'ID': 'monocyte-drain',
+     'Filter': {'Prefix': ''},
+     'Status': 'Enabled',
+     'Expiration': {'Days': 1},
+     'NoncurrentVersionExpiration': {'NoncurrentDays': 1},
+     'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': 1}},
+    {'ID': 'monocyte-drain-delete-markers',
+     'Filter': {'Prefix': ''},
+     'Status': 'Enabled',
+     'Expiration': {'ExpiredObjectDeleteMarker': True}}]}
+
+
+class BucketEmptier(object):
+    """Delete all object versions, delete markers and multipart uploads of a bucket.
+
+    The keys are listed in shards, one per top level prefix, which are
+    emptied in parallel. Deleted versions drop out of the listing, so each
+    shard is listed again from where the deleted page started, and a bucket
+    too large for max_deletions or for the deadline is drained over several
+    runs without remembering a position. The deadline is checked before
+    every page, and raises DeadlineExceeded when it has passed.
+    """
+    def __init__(self, client, bucket_name, workers=DEFAULT_EMPTY_WORKERS, max_deletions=None,
+                 logger=None, deadline=None):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.workers = workers
+        self.max_deletions = max_deletions
+        self.deadline = deadline or Deadline()
+        self.logger = logger or logging.getLogger(__name__)
+        self.deleted = 0
+        self.reserved = 0
+        self._lock = threading.Lock()
+
+    def empty(self):
+        """Return True if the bucket is empty, False if max_deletions was reached or deletions failed."""
+        executor = ThreadPoolExecutor(max_workers=max(1, self.workers))
+        try:
+            futures = [executor.submit(self.abort_multipart_uploads)]
+            futures.extend(executor.submit(self.empty_shard, prefix, delimiter)
+                           for prefix, delimiter in self.get_shards())
+            return all([future.result() for future in futures])
+        finally:
+            executor.shutdown(wait=True)
+
+    def get_shards(self):
+        """Return (prefix, delimiter) of the shards the bucket is listed in.
+
+        The objects at the top level are listed with a delimiter, everything
+        else in one shard per top level prefix.
+        """
+        shards = [('', '/')]
+        paginator = self.client.get_paginator('list_object_versions')
+        for page in paginator.paginate(Bucket=self.bucket_name, Delimiter='/'):
+            self.check_deadline()
+            for common_prefix in page.get('CommonPrefixes', []):
+                shards.append((common_prefix['Prefix'], None))
+        return shards
+
+    def abort_multipart_uploads(self):
+        paginator = self.client.get_paginator('list_multipart_uploads')
+        for page in paginator.paginate(Bucket=self.bucket_name):
+            self.check_deadline()
+            for upload in page.get('Uploads', []):
+                self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=upload['Key'],
+                                                   UploadId=upload['UploadId'])
+        return True
+
+    def empty_shard(self, prefix, delimiter):
+        markers = {}
+        failed = set()
+        while True:
+            self.check_deadline()
+            kwargs = dict(Bucket=self.bucket_name, Prefix=prefix, MaxKeys=DELETE_OBJECTS_BATCH_SIZE, **markers)
+            if delimiter:
+                kwargs['Delimiter'] = delimiter
+            response = self.client.list_object_versions(**kwargs)
+            batch = [{'Key': version['Key'], 'VersionId': version['VersionId']}
+                     for version in response.get('Versions', []) + response.get('DeleteMarkers', [])
+                     if (version['Key'], version['VersionId']) not in failed]
+            if batch:
+                allowed = self.reserve(len(batch))
+                failed.update(self.delete_objects(batch[:allowed]))
+                if allowed < len(batch):
+                    return False
+            if not response.get('IsTruncated'):
+                return not failed
+            if not batch:
+                # Nothing on this page could be deleted, so it is still
+                # there and its markers are safe to continue from.
+                markers = {'KeyMarker': response['NextKeyMarker']}
+                if response.get('NextVersionIdMarker'):
+                    markers['VersionIdMarker'] = response['NextVersionIdMarker']
+
+    def delete_objects(self, objects):
+        """Delete up to 1000 object versions, return (key, version ID) of those that failed."""
+        response = self.client.delete_objects(Bucket=self.bucket_name,
+                                              Delete={'Objects': objects, 'Quiet': True})
+        failed = []
+        for error in response.get('Errors', []):
+            self.logger.warning("Failed to delete %s version %s from bucket %s: %s",
+                                error.get('Key'), error.get('VersionId'), self.bucket_name, error.get('Message'))
+            failed.append((error.get('Key'), error.get('VersionId')))
+        with self._lock:
+            self.deleted += len(objects) - len(failed)
+        return failed
+
+    def check_deadline(self):
+        self.deadline.check("emptying bucket {0}".format(self.bucket_name))
+
+    def reserve(self, count):
+        """Return how many of count deletions are left of max_deletions, and take them."""
+        with self._lock:
+            if self.max_deletions is None:
+                return count
+            allowed = max(0, min(count, self.max_deletions - self.reserved))
+            self.reserved += allowed
+            return allowed
+
 
 class Bucket(Handler):
+    def __init__(self, region_filter, empty_workers=DEFAULT_EMPTY_WORKERS, max_deletions_per_run=None,
+                 empty_strategy="delete", **kwargs):
+        if empty_strategy not in EMPTY_STRATEGIES:
+            raise ValueError("Unknown empty_strategy {0!r}, expected one of {1}".format(
+                empty_strategy, ", ".join(EMPTY_STRATEGIES)))
+        self.empty_workers = empty_workers
+        self.max_deletions_per_run = max_deletions_per_run
+        self.empty_strategy = empty_strategy
+        super(Bucket, self).__init__(region_filter, **kwargs)
+
     def map_location(self, region):
         return AVAILABILITY_ZONES.get(region, region)
 
     def get_client(self):
-        return boto3.client('s3', region_name='eu-central-1')
+        return get_client('s3', region_name='eu-central-1')
 
     def fetch_region_names(self):
-        session = boto3.session.Session()
-        return session.get_available_regions('s3')
+        return get_available_regions('s3')
 
-    def fetch_unwanted_resources(self):
-        client = self.get_client()
-        response = client.list_buckets()
-        buckets = [(bucket['Name'], bucket['CreationDate'])
-                   for bucket in response['Buckets']]
+    def get_location_key(self, bucket_name, creation_date):
+        # A bucket that was deleted and created again may live in another
+        # region, so the creation date is part of the key.
+        return "{0}@{1}".format(bucket_name, creation_date)
 
-        for bucket_name, creation_date in buckets:
+    def get_bucket_region(self, client, locations, bucket_name, creation_date):
+        location_key = self.get_location_key(bucket_name, creation_date)
+        region_name = locations.get(location_key)
+        if region_name is None:
+            self.deadline.check("the location lookup of s3 buckets")
             try:
                 response = client.get_bucket_location(Bucket=bucket_name)
             except Exception:
@@ -46,35 +192,61 @@ class Bucket(Handler):
                 # found it. E.g. during concurrent integration tests.
                 self.logger.exception("Failed to get location for bucket %r:",
                                       bucket_name)
-                continue
+                return bucket_name, creation_date, None
             region_name = self.map_location(response['LocationConstraint'])
-            if region_name not in self.region_names or self.is_on_whitelist(bucket_name):
-                self.logger.debug("Bucket %s in region %s is OK.",
-                                  bucket_name, region_name)
-                continue
-
-            self.logger.info("Reporting bucket %s in region %s as unwanted.",
-                             bucket_name, region_name)
-            resource_wrapper = Resource(
-                resource="Bucket " + bucket_name,
-                resource_type=self.resource_type,
-                resource_id=bucket_name,
-                creation_date=creation_date,
-                region=region_name)
-            yield resource_wrapper
+            locations.set(location_key, region_name)
+        return bucket_name, creation_date, region_name
+
+    def fetch_unwanted_resources(self):
+        client = self.get_client()
+        response = client.list_buckets()
+        buckets = [(bucket['Name'], bucket['CreationDate'])
+                   for bucket in response['Buckets']]
+        locations = self.get_cache('s3_bucket_regions')
+        draining = self.get_cache('s3_draining')
+
+        def get_bucket_region(bucket):
+            return self.get_bucket_region(client, locations, *bucket)
+
+        try:
+            for bucket_name, creation_date, region_name in map_ordered(get_bucket_region, buckets,
+                                                                       self.region_workers):
+                if region_name is None:
+                    continue
+                if region_name not in self.region_names or self.is_on_whitelist(bucket_name):
+                    self.logger.debug("Bucket %s in region %s is OK.",
+                                      bucket_name, region_name)
+                    continue
+
+                self.logger.info("Reporting bucket %s in region %s as unwanted.",
+                                 bucket_name, region_name)
+                resource_wrapper = Resource(
+                    resource="Bucket " + bucket_name,
+                    resource_type=self.resource_type,
+                    resource_id=bucket_name,
+                    creation_date=creation_date,
+                    region=region_name)
+                draining_since = draining.get(self.get_location_key(bucket_name, creation_date))
+                if draining_since:
+                    self.mark_draining(resource_wrapper, draining_since)
+                yield resource_wrapper
+            bucket_keys = [self.get_location_key(*bucket) for bucket in buckets]
+            locations.retain(bucket_keys)
+            draining.retain(bucket_keys)
+        finally:
+            locations.save()
+            draining.save()
+
+    def mark_draining(self, resource, since):
+        if isinstance(resource, Resource):
+            resource.reason = "Draining through a lifecycle configuration since {0}.".format(since)
 
     def to_string(self, resource):
         return "s3 bucket found in {0}, with name {1}, created {2}".format(
             resource.region, resource.resource_id, resource.creation_date)
 
     def is_on_whitelist(self, bucket_name):
-        bucket_arn = "arn:aws:s3:::%s" % bucket_name
-        whitelist_arns = self.get_whitelist().get('Arns', [])
-        for arn_with_reason in whitelist_arns:
-            if bucket_arn == arn_with_reason['Arn']:
-                return True
-
-        return False
+        return self.is_arn_whitelisted("arn:aws:s3:::%s" % bucket_name)
 
     def delete(self, resource):
         if self.dry_run:
@@ -82,19 +254,68 @@ class Bucket(Handler):
 
         if isinstance(resource, Resource):
             bucket_name = resource.resource_id
+            creation_date = resource.creation_date
         else:
             bucket_name = resource
+            creation_date = None
         client = self.get_client()
 
-        while True:
-            response = client.list_objects_v2(Bucket=bucket_name)
-            if response['KeyCount'] == 0:
-                break
-            keys = [item['Key'] for item in response['Contents']]
-            delete_spec = {'Objects': [{'Key': key} for key in keys]}
-            client.delete_objects(Bucket=bucket_name, Delete=delete_spec)
+        if self.empty_strategy == "lifecycle":
+            draining = self.get_cache('s3_draining')
+            draining_key = self.get_location_key(bucket_name, creation_date)
+            self.drain(client, bucket_name, resource, draining, draining_key)
+            self.delete_bucket(client, bucket_name, resource)
+            draining.delete(draining_key)
+            draining.save()
+            return
+
+        emptier = BucketEmptier(client, bucket_name, workers=self.empty_workers,
+                                max_deletions=self.max_deletions_per_run, logger=self.logger,
+                                deadline=self.deadline)
+        if not emptier.empty():
+            raise Warning("Bucket {0} is not empty yet, {1} objects deleted in this run.".format(
+                bucket_name, emptier.deleted))
+        self.delete_bucket(client, bucket_name, resource)
+
+    def delete_bucket(self, client, bucket_name, resource):
         try:
             client.delete_bucket(Bucket=bucket_name)
         except Exception:
             self.logger.exception("Failed to delete bucket %r:" % resource)
             raise
+
+    def drain(self, client, bucket_name, resource, draining, draining_key):
+        """Raise a Warning unless the bucket has been drained by its lifecycle configuration."""
+        since = draining.get(draining_key)
+        if since is None and self.has_drain_lifecycle(client, bucket_name):
+            # Without a cache_dir, the start of the drain is not known.
+            since = "an earlier run"
+            draining.set(draining_key, since)
+        if since is None:
+            client.put_bucket_lifecycle_configuration(Bucket=bucket_name,
+                                                      LifecycleConfiguration=DRAIN_LIFECYCLE_CONFIGURATION)
+            since = datetime.datetime.now(tzutc()).strftime("%Y-%m-%d %H:%M UTC")
+            draining.set(draining_key, since)
+            draining.save()
+            self.mark_draining(resource, since)
+            raise Warning("Bucket {0} is now draining through a lifecycle configuration.".format(bucket_name))
+        if not self.is_bucket_empty(client, bucket_name):
+            self.mark_draining(resource, since)
+            raise Warning("Bucket {0} is still draining since {1}.".format(bucket_name, since))
+
+    def has_drain_lifecycle(self, client, bucket_name):
+        try:
+            response = client.get_bucket_lifecycle_configuration(Bucket=bucket_name)
+        except ClientError as exc:
+            if exc.response['Error']['Code'] == 'NoSuchLifecycleConfiguration':
+                return False
+            raise
+        rule_ids = [rule.get('ID') for rule in response.get('Rules', [])]
+        return DRAIN_LIFECYCLE_CONFIGURATION['Rules'][0]['ID'] in rule_ids
+
+    def is_bucket_empty(self, client, bucket_name):
+        versions = client.list_object_versions(Bucket=bucket_name, MaxKeys=1)
+        if versions.get('Versions') or versions.get('DeleteMarkers'):
+            return False
+        uploads = client.list_multipart_uploads(Bucket=bucket_name, MaxUploads=1)
+        return not uploads.get('Uploads')
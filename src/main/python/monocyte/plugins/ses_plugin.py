@@ -1,8 +1,9 @@
 from __future__ import print_function, absolute_import, division
 
-import boto3
 import logging
 
+from monocyte.clients import get_client
+
 
 class AwsSesPlugin(object):
 
@@ -31,7 +32,7 @@ class AwsSesPlugin(object):
         return self.mail_body
 
     def send_email(self):
-        conn = boto3.client('ses', region_name=self.region)
+        conn = get_client('ses', region_name=self.region)
 
         self.logger.info("Sending Email to %s", ", ".join(self.recipients))
 
@@ -1,9 +1,10 @@
 from __future__ import print_function, absolute_import, division
 
-import boto3
 import json
 import logging
 
+from monocyte.clients import get_client
+
 
 class AwsSQSPlugin(object):
 
@@ -19,26 +20,41 @@ class AwsSQSPlugin(object):
         self.logger = logging.getLogger(__name__)
 
     def _get_account_alias(self):
-        iam = boto3.client('iam')
-        response = iam.list_account_aliases()
+        response = get_client('iam').list_account_aliases()
         return response['AccountAliases'][0]
 
-    def monocyte_status(self):
-        if self.unwanted_resources or self.problematic_resources:
-            return "Found {0} unwanted and {1} problematic resources.".format(
-                len(self.unwanted_resources), len(self.problematic_resources)
-            )
+    def format_status(self, unwanted_count, problematic_count):
+        if unwanted_count or problematic_count:
+            return "Found {0} unwanted and {1} problematic resources.".format(unwanted_count, problematic_count)
         return "no issues"
 
+    def monocyte_status(self):
+        return self.format_status(len(self.unwanted_resources), len(self.problematic_resources))
+
+    def get_account_statuses(self):
+        """Return the status of each account a multi-account sweep found resources in."""
+        counts = {}
+        for resource in self.unwanted_resources:
+            counts.setdefault(resource.account_id, [0, 0])[0] += 1
+        for resource, _, _ in self.problematic_resources:
+            counts.setdefault(resource.account_id, [0, 0])[1] += 1
+        return dict((account_id, self.format_status(*account_counts))
+                    for account_id, account_counts in counts.items() if account_id is not None)
+
     def get_body(self):
+        # "account" is the account Monocyte runs in, the swept accounts
+        # of a multi-account sweep are listed in "accounts".
         body = {
             'status': self.monocyte_status(),
             'account': self._get_account_alias()
         }
+        account_statuses = self.get_account_statuses()
+        if account_statuses:
+            body['accounts'] = account_statuses
         return json.dumps(body)
 
     def send_message(self, body):
-        sqs = boto3.client('sqs', region_name=self.queue_region)
+        sqs = get_client('sqs', region_name=self.queue_region)
         response = sqs.get_queue_url(QueueName=self.queue_name, QueueOwnerAWSAccountId=self.queue_account)
         sqs.send_message(QueueUrl=response['QueueUrl'], MessageBody=body)
 
@@ -1,8 +1,8 @@
 from __future__ import print_function, absolute_import, division
 
-import boto3
 import json
 
+from monocyte.clients import get_client
 from .ses_plugin import AwsSesPlugin
 
 
@@ -20,22 +20,30 @@ class StatusMailPlugin(AwsSesPlugin):
         email_body = '''Dear AWS User,
 
 our Compliance checker found some issues in your account.
-{0}
-
-Account: {1}\n'''.format(unwanted_resources_info, self._get_account_alias())
-
-        email_body += self._handle_resources(self.unwanted_resources)
-
-        if self.problematic_resources:
-            email_body += ("\nAdditionally we had issues checking the following "
-                           "resource, please ensure that they are in the proper region:\n")
-            email_body += self._handle_resources(self.problematic_resources)
+{0}\n'''.format(unwanted_resources_info)
+
+        problematic_resources = [resource for resource, _, _ in self.problematic_resources]
+        for account_id in self._get_account_ids():
+            email_body += "\nAccount: {0}\n".format(account_id or self._get_account_alias())
+            email_body += self._handle_resources([resource for resource in self.unwanted_resources
+                                                  if resource.account_id == account_id])
+            account_problems = [resource for resource in problematic_resources if resource.account_id == account_id]
+            if account_problems:
+                email_body += ("\nAdditionally we had issues checking the following "
+                               "resource, please ensure that they are in the proper region:\n")
+                email_body += self._handle_resources(account_problems)
 
         email_footer = '\n Kind regards.\n\tYour Compliance Team'
         email_body += email_footer
 
         return email_body
 
+    def _get_account_ids(self):
+        """Return the IDs of the accounts with results, None for the account Monocyte runs in."""
+        resources = list(self.unwanted_resources) + [resource for resource, _, _ in self.problematic_resources]
+        account_ids = set(resource.account_id for resource in resources)
+        return sorted(account_ids, key=lambda account_id: (account_id is not None, account_id)) or [None]
+
     def _handle_resources(self, resources):
         return_text = ""
         regions = sorted(list(set([res.region for res in resources])))
@@ -48,8 +56,11 @@ Account: {1}\n'''.format(unwanted_resources_info, self._get_account_alias())
                 selected_res = (resource for resource in resources
                                 if resource.region == region and resource.resource_type == res_type)
                 for resource in selected_res:
-                    res_text = "\t{0} with identifier {1}, created {2}.".format(
-                        res_type, resource.resource_id, resource.creation_date)
+                    res_text = "\t{0} with identifier {1}".format(res_type, resource.resource_id)
+                    # Placeholders of incomplete sweeps have no creation date.
+                    if resource.creation_date is not None:
+                        res_text += ", created {0}".format(resource.creation_date)
+                    res_text += "."
                     if resource.reason:
                         res_text += ' ' + resource.reason
                     res_text += '\n'
@@ -57,8 +68,7 @@ Account: {1}\n'''.format(unwanted_resources_info, self._get_account_alias())
         return return_text or "\tNone\n"
 
     def _get_account_alias(self):
-        iam = boto3.client('iam')
-        response = iam.list_account_aliases()
+        response = get_client('iam').list_account_aliases()
         return response['AccountAliases'][0]
 
     def run(self):
@@ -73,7 +83,7 @@ class UsofaStatusMailPlugin(StatusMailPlugin):
         self.usofa_bucket_name = usofa_bucket_name
 
     def _get_usofa_data(self):
-        s3 = boto3.client('s3', region_name=self.region)
+        s3 = get_client('s3', region_name=self.region)
         response = s3.get_object(Bucket=self.usofa_bucket_name, Key='accounts.json')
         account_data = json.loads(response['Body'].read().decode('utf-8'))
         return account_data
@@ -81,11 +91,16 @@ class UsofaStatusMailPlugin(StatusMailPlugin):
     @property
     def recipients(self):
         usofa = self._get_usofa_data()
-        account_alias = self._get_account_alias()
-        responsible = usofa[account_alias]['email']
+        responsible = []
+        for account_id in self._get_account_ids():
+            if account_id is None:
+                responsible.append(usofa[self._get_account_alias()]['email'])
+            else:
+                # Accounts of a multi-account sweep are known by their ID.
+                responsible.extend(account['email'] for account in usofa.values() if account.get('id') == account_id)
 
         if self.mail_recipients:
             recipients = list(self.mail_recipients)
-            recipients.append(responsible)
+            recipients.extend(responsible)
             return recipients
-        return [responsible]
+        return responsible
@@ -0,0 +1,46 @@
+from __future__ import print_function, absolute_import, division
+
+import logging
+
+
+class StreamingPlugin(object):
+    """Base class of plugins that get the results of a run while they are found.
+
+    Monocyte creates the plugin before the first handler starts, calls
+    on_resource() and on_problem() for every result and on_finish() at the
+    end of the run. Calls never overlap, so plugins need no locking.
+    """
+
+    def __init__(self, dry_run, **kwargs):
+        self.dry_run = dry_run
+        self.logger = logging.getLogger(__name__)
+
+    def on_resource(self, resource):
+        pass
+
+    def on_problem(self, resource, service_handler, exception):
+        pass
+
+    def on_finish(self):
+        pass
+
+
+class BatchPluginAdapter(StreamingPlugin):
+    """Collects the results for a plugin that only has run(), and runs it at the end."""
+
+    def __init__(self, plugin_class, dry_run, **kwargs):
+        super(BatchPluginAdapter, self).__init__(dry_run)
+        self.plugin_class = plugin_class
+        self.config = kwargs
+        self.unwanted_resources = []
+        self.problematic_resources = []
+
+    def on_resource(self, resource):
+        self.unwanted_resources.append(resource)
+
+    def on_problem(self, resource, service_handler, exception):
+        self.problematic_resources.append((resource, service_handler, exception))
+
+    def on_finish(self):
+        plugin = self.plugin_class(self.unwanted_resources, self.problematic_resources, self.dry_run, **self.config)
+        plugin.run()
@@ -0,0 +1,133 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Find IAM policy documents that allow forbidden actions
+
+A forbidden action is an action pattern like "*" or "iam:*". A policy
+violates it if one of its Allow statements grants every action matching
+the pattern, either through a wildcard Action or through a NotAction that
+excludes none of them. Verdicts are cached by the hash of the document,
+so identical documents are analyzed only once.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import re
+import threading
+
+from monocyte.cache import JsonCache
+
+DEFAULT_FORBIDDEN_ACTIONS = ['*']
+
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+
+def normalize_action(action):
+    action = action.strip().lower()
+    # "*:*" is a common spelling of "*".
+    return '*' if action == '*:*' else action
+
+
+def get_matcher(pattern):
+    """Return a function telling whether a string matches the IAM wildcard pattern."""
+    with _matchers_lock:
+        matcher = _matchers.get(pattern)
+        if matcher is None:
+            regex = ''.join('.*' if char == '*' else '.' if char == '?' else re.escape(char)
+                            for char in pattern)
+            matcher = re.compile('^%s$' % regex, re.IGNORECASE | re.DOTALL).match
+            _matchers[pattern] = matcher
+        return matcher
+
+
+def covers(pattern, other_pattern):
+    """Tell whether pattern matches every action other_pattern matches."""
+    return get_matcher(pattern)(other_pattern) is not None
+
+
+def overlaps(pattern, other_pattern):
+    return covers(pattern, other_pattern) or covers(other_pattern, pattern)
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+class Statement(object):
+    def __init__(self, effect, actions, not_actions):
+        self.effect = effect
+        self.actions = actions
+        self.not_actions = not_actions
+
+    @classmethod
+    def from_dict(cls, statement):
+        # Statements without an Effect are treated like Allow, to be safe.
+        effect = statement.get('Effect', 'Allow')
+        actions = [normalize_action(action) for action in as_list(statement.get('Action'))]
+        not_actions = None
+        if 'NotAction' in statement:
+            not_actions = [normalize_action(action) for action in as_list(statement['NotAction'])]
+        return cls(effect, actions, not_actions)
+
+    def allows_all(self, forbidden_action):
+        if self.effect != 'Allow':
+            return False
+        if self.not_actions is not None:
+            return not any(overlaps(action, forbidden_action) for action in self.not_actions)
+        return any(covers(action, forbidden_action) for action in self.actions)
+
+
+def parse_statements(policy_document):
+    if not isinstance(policy_document, dict):
+        policy_document = json.loads(policy_document)
+    return [Statement.from_dict(statement) for statement in as_list(policy_document.get('Statement'))]
+
+
+class PolicyAnalyzer(object):
+    def __init__(self, forbidden_actions=None, verdicts=None):
+        self.forbidden_actions = sorted(set(
+            normalize_action(action) for action in (forbidden_actions or DEFAULT_FORBIDDEN_ACTIONS)))
+        self.verdicts = verdicts if verdicts is not None else JsonCache()
+        self.hits = 0
+        self.misses = 0
+
+    def get_document_key(self, policy_document):
+        canonical = json.dumps([self.forbidden_actions, policy_document], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get_violations(self, policy_document):
+        """Return the forbidden actions the document allows."""
+        key = self.get_document_key(policy_document)
+        violations = self.verdicts.get(key)
+        if violations is None:
+            self.misses += 1
+            violations = self.analyze(policy_document)
+            self.verdicts.set(key, violations)
+        else:
+            self.hits += 1
+        return violations
+
+    def is_forbidden(self, policy_document):
+        return bool(self.get_violations(policy_document))
+
+    def analyze(self, policy_document):
+        statements = parse_statements(policy_document)
+        return [forbidden_action for forbidden_action in self.forbidden_actions
+                if any(statement.allows_all(forbidden_action) for statement in statements)]
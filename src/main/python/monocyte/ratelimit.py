@@ -0,0 +1,183 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Client side rate limiting for AWS APIs with low request limits
+
+Every AWS client of the registry waits for an AdaptiveRateLimiter of its
+account, service and region before each request. While requests have to
+wait for it, the limiter raises its rate by a fixed step per second, and it
+halves the rate when AWS throttles, so the request rate settles just below
+the limit of the API.
+"""
+from __future__ import absolute_import, division
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Allow rate calls per second on average, with bursts of up to capacity calls."""
+    def __init__(self, rate, capacity=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = float(rate)
+
+    def acquire(self):
+        """Block until a call is allowed, return True if that took a wait."""
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Without a token left, the caller takes the next one in advance
+            # and waits until it has been refilled.
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            self._sleep(wait)
+        return bool(wait)
+
+
+# The error codes botocore's standard retry mode treats as throttling.
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'TransactionInProgressException',
+    'RequestLimitExceeded', 'BandwidthLimitExceeded', 'LimitExceededException', 'RequestThrottled',
+    'SlowDown', 'PriorRequestNotComplete', 'EC2ThrottledException',
+])
+
+DEFAULT_RATE = 20
+# Where to start for services whose limits are far below or above the
+# default. S3 allows thousands of requests per second and prefix.
+DEFAULT_SERVICE_RATES = {
+    'cloudformation': 5,
+    'dynamodb': 50,
+    'iam': 10,
+    'rds': 10,
+    's3': 500,
+    'sts': 10,
+}
+MIN_RATE = 0.5
+MAX_RATE = 200
+SERVICE_MAX_RATES = {
+    's3': 3500,
+}
+# The rate grows by RATE_INCREASE per INCREASE_INTERVAL seconds at most.
+RATE_INCREASE = 1.0
+INCREASE_INTERVAL = 1.0
+RATE_DECREASE_FACTOR = 0.5
+# Throttling errors within this many seconds after a decrease are answers
+# to requests sent before it, so they do not decrease the rate again.
+DECREASE_COOLDOWN = 1.0
+
+
+class AdaptiveRateLimiter(object):
+    """A TokenBucket whose rate follows the throttling of the API (AIMD)."""
+    def __init__(self, rate=DEFAULT_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE, clock=time.time, sleep=time.sleep):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.bucket = TokenBucket(rate, clock=clock, sleep=sleep)
+        self.throttled = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._decreased_at = None
+        self._changed_at = clock()
+        self._waited = False
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def acquire(self):
+        if self.bucket.acquire():
+            with self._lock:
+                self._waited = True
+
+    def on_success(self):
+        # Only a rate that holds requests back is worth raising, and only
+        # by one step per interval, however many requests succeed in it.
+        with self._lock:
+            now = self._clock()
+            if now - self._changed_at < INCREASE_INTERVAL or not self._waited:
+                return
+            self._changed_at = now
+            self._waited = False
+            if self.bucket.rate < self.max_rate:
+                self.bucket.set_rate(min(self.max_rate, self.bucket.rate + RATE_INCREASE))
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            now = self._clock()
+            if self._decreased_at is not None and now - self._decreased_at < DECREASE_COOLDOWN:
+                return
+            self._decreased_at = now
+            self._changed_at = now
+            self._waited = False
+            self.bucket.set_rate(max(self.min_rate, self.bucket.rate * RATE_DECREASE_FACTOR))
+
+
+class RateLimiterRegistry(object):
+    """One AdaptiveRateLimiter per account, service and region."""
+    def __init__(self, service_rates=None):
+        self.service_rates = dict(DEFAULT_SERVICE_RATES)
+        self.service_rates.update(service_rates or {})
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def get_limiter(self, account_key, service_name, region_name):
+        key = (account_key, service_name, region_name)
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                rate = self.service_rates.get(service_name, DEFAULT_RATE)
+                max_rate = max(rate, SERVICE_MAX_RATES.get(service_name, MAX_RATE))
+                limiter = AdaptiveRateLimiter(rate, max_rate=max_rate)
+                self._limiters[key] = limiter
+            return limiter
+
+    def attach(self, client, account_key, service_name, region_name):
+        """Make every request of client, including retries, wait for the limiter."""
+        limiter = self.get_limiter(account_key, service_name, region_name)
+
+        def before_send(**kwargs):
+            limiter.acquire()
+
+        def after_attempt(response=None, **kwargs):
+            if response is None:
+                return
+            if response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+                limiter.on_throttle()
+            else:
+                limiter.on_success()
+
+        client.meta.events.register('before-send', before_send)
+        # needs-retry follows every attempt. Returning None leaves the retry
+        # decision to botocore.
+        client.meta.events.register('needs-retry', after_attempt)
+        return limiter
+
+    def reset(self):
+        with self._lock:
+            self._limiters = {}
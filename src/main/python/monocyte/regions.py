@@ -0,0 +1,68 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Which regions an account can reach
+
+botocore knows all regions of a partition, including opt-in regions that
+are not enabled for the account. Calls to those fail, so the catalogue asks
+EC2 DescribeRegions once per account which regions are disabled and keeps
+the answer for max_age seconds, in one cache file per account.
+"""
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+from monocyte import cache
+
+# The set of enabled regions changes rarely and only by hand.
+DEFAULT_MAX_AGE = 24 * 60 * 60
+NOT_OPTED_IN = 'not-opted-in'
+
+
+class RegionCatalogue(object):
+    def __init__(self, cache_dir=None, max_age=DEFAULT_MAX_AGE, clock=time.time, logger=None):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.logger = logger or logging.getLogger(__name__)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._caches = {}
+
+    def get_cache(self, account_id):
+        if account_id not in self._caches:
+            self._caches[account_id] = cache.get_cache('regions-' + account_id, self.cache_dir)
+        return self._caches[account_id]
+
+    def get_disabled_regions(self, account_id, client):
+        """Return the names of the regions that are not enabled for account_id.
+
+        client is an EC2 client of any enabled region.
+        """
+        with self._lock:
+            account_cache = self.get_cache(account_id)
+            entry = account_cache.get(account_id)
+            if entry is None or self._clock() - entry['fetched_at'] > self.max_age:
+                entry = {'fetched_at': self._clock(), 'disabled': self.fetch_disabled_regions(client)}
+                account_cache.set(account_id, entry)
+                account_cache.save()
+            return set(entry['disabled'])
+
+    def fetch_disabled_regions(self, client):
+        response = client.describe_regions(AllRegions=True)
+        disabled = sorted(region['RegionName'] for region in response['Regions']
+                          if region.get('OptInStatus') == NOT_OPTED_IN)
+        self.logger.info("Regions not enabled for this account: {0}".format(", ".join(disabled) or "none"))
+        return disabled
@@ -0,0 +1,44 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Data the handlers of one run share
+
+Some listings, like the IAM authorization details, serve several handlers.
+Monocyte creates one RunSnapshots per run and hands it to all handlers, so
+each listing is fetched once per run and a new run always starts fresh.
+"""
+from __future__ import absolute_import
+
+import threading
+
+
+class RunSnapshots(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._snapshots = {}
+
+    def get(self, key, fetch):
+        """Return the snapshot of key, calling fetch() if this run has none yet.
+
+        A handler asking for a key that is being fetched waits for it
+        instead of fetching it again. If fetch() fails, the next handler
+        tries again.
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._snapshots:
+                self._snapshots[key] = fetch()
+            return self._snapshots[key]
@@ -0,0 +1,141 @@
+from __future__ import print_function, absolute_import, division
+
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from mock import Mock, patch
+
+from monocyte import accounts
+from monocyte.accounts import AccountResult, MultiAccountSweep, HandlerSummary
+from monocyte.handler import Resource
+
+
+def resource(resource_id):
+    return Resource("foo", "test_type", resource_id, datetime.datetime(2015, 1, 1), "us-west-1")
+
+
+class AccountSourcesTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_list_organization_accounts_returns_active_accounts(self):
+        client = Mock()
+        client.get_paginator.return_value.paginate.return_value = [
+            {'Accounts': [{'Id': '111111111111', 'Status': 'ACTIVE'},
+                          {'Id': '222222222222', 'Status': 'SUSPENDED'}]},
+            {'Accounts': [{'Id': '333333333333', 'Status': 'ACTIVE'}]}]
+
+        self.assertEqual(accounts.list_organization_accounts(client), ['111111111111', '333333333333'])
+
+    def test_read_accounts_file_skips_comments_and_empty_lines(self):
+        path = os.path.join(self.temp_dir, 'accounts.txt')
+        with open(path, 'w') as accounts_file:
+            accounts_file.write("# sandbox accounts\n111111111111\n\n222222222222  # team a\n")
+
+        self.assertEqual(accounts.read_accounts_file(path), ['111111111111', '222222222222'])
+
+    def test_get_role_arn(self):
+        self.assertEqual(accounts.get_role_arn('111111111111', 'monocyte'),
+                         'arn:aws:iam::111111111111:role/monocyte')
+
+
+class SweepAccountTest(TestCase):
+    def setUp(self):
+        self.registry_mock = patch('monocyte.accounts.clients.registry').start()
+        self.assume_role_mock = patch('monocyte.accounts.assume_role').start()
+        self.release_provider_mock = patch('monocyte.accounts.credentials.release_provider').start()
+        self.monocyte_class_mock = patch('monocyte.accounts.Monocyte').start()
+        self.monocyte = self.monocyte_class_mock.return_value
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_sweeps_account_with_assumed_role(self):
+        handler = Mock()
+        handler.name = "ec2.Instance"
+        self.monocyte.search_and_destroy_unwanted_resources.return_value = 1
+        self.monocyte.unwanted_resources = [resource("1")]
+        self.monocyte.problematic_resources = [(resource("2"), handler, ValueError("boom"))]
+
+        result = accounts.sweep_account('111111111111', 'any role arn', {'dry_run': True})
+
+        self.assume_role_mock.assert_called_once_with('any role arn', cache_dir=None)
+        self.registry_mock.use_session.assert_called_once_with(self.assume_role_mock.return_value)
+        self.monocyte_class_mock.assert_called_once_with(dry_run=True)
+        self.assertEqual(result.status, 1)
+        self.assertEqual([res.account_id for res in result.unwanted_resources], ['111111111111'])
+        problem_resource, problem_handler, problem = result.problematic_resources[0]
+        self.assertEqual(problem_resource.account_id, '111111111111')
+        self.assertEqual(problem_handler.name, "ec2.Instance")
+        self.assertEqual(str(problem), "boom")
+        self.release_provider_mock.assert_called_once_with('any role arn')
+
+    def test_reports_failed_account(self):
+        self.assume_role_mock.side_effect = Exception("AccessDenied")
+
+        result = accounts.sweep_account('111111111111', 'any role arn', {})
+
+        self.assertEqual(result.status, 1)
+        self.assertEqual(result.error, "Exception: AccessDenied")
+        self.release_provider_mock.assert_called_once_with('any role arn')
+
+
+class MultiAccountSweepTest(TestCase):
+    def setUp(self):
+        self.sweep_account_mock = patch('monocyte.accounts.sweep_account').start()
+        self.monocyte_class_mock = patch('monocyte.accounts.Monocyte').start()
+        self.monocyte = self.monocyte_class_mock.return_value
+        self.sweep = MultiAccountSweep({'dry_run': True, 'plugins': ['any plugin']}, logger=Mock())
+        self.sweep.get_account_ids = Mock(return_value=['222222222222', '111111111111'])
+        self.sweep.create_executor = lambda: ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_merges_results_of_all_accounts_for_plugins(self):
+        problem = (resource("3"), HandlerSummary("ec2.Volume"), Exception("boom"))
+        self.sweep_account_mock.side_effect = lambda account_id, role_arn, config: {
+            '111111111111': AccountResult('111111111111', 0, [resource("1")]),
+            '222222222222': AccountResult('222222222222', 0, [resource("2")], [problem])}[account_id]
+
+        status = self.sweep.run()
+
+        self.assertEqual(status, 0)
+        self.sweep_account_mock.assert_any_call('111111111111', 'arn:aws:iam::111111111111:role/monocyte',
+                                                {'dry_run': True})
+        self.monocyte_class_mock.assert_called_once_with(plugins=['any plugin'], dry_run=True)
+        self.monocyte.start_plugins.assert_called_once_with()
+        recorded = sorted(call[0][0].resource_id for call in self.monocyte.record_unwanted_resource.call_args_list)
+        self.assertEqual(recorded, ["1", "2"])
+        self.monocyte.record_problematic_resource.assert_called_once_with(*problem)
+        self.monocyte.finish_plugins.assert_called_once_with()
+
+    def test_starts_plugins_after_the_accounts_are_submitted(self):
+        events = []
+        executor = ThreadPoolExecutor(max_workers=2)
+        submit = executor.submit
+
+        def record_submit(function, account_id, *args):
+            events.append(account_id)
+            return submit(function, account_id, *args)
+        executor.submit = record_submit
+        self.sweep.create_executor = lambda: executor
+        self.monocyte.start_plugins.side_effect = lambda: events.append("plugins")
+        self.sweep_account_mock.side_effect = lambda account_id, role_arn, config: AccountResult(account_id)
+
+        self.sweep.run()
+
+        self.assertEqual(events, ['222222222222', '111111111111', "plugins"])
+
+    def test_fails_if_an_account_fails(self):
+        self.sweep_account_mock.side_effect = lambda account_id, role_arn, config: AccountResult(
+            account_id, status=1 if account_id == '222222222222' else 0)
+
+        self.assertEqual(self.sweep.run(), 1)
+        self.assertEqual([result.account_id for result in self.sweep.results], ['111111111111', '222222222222'])
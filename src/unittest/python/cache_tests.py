@@ -0,0 +1,62 @@
+from __future__ import print_function, absolute_import, division
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from monocyte import cache
+from monocyte.cache import JsonCache
+
+
+class JsonCacheTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.cache_dir, 'any.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_entries_survive_save_and_load(self):
+        json_cache = JsonCache(self.path)
+        json_cache.set('key', 'value')
+        json_cache.save()
+
+        self.assertEqual(JsonCache(self.path).get('key'), 'value')
+
+    def test_memory_cache_is_never_written(self):
+        json_cache = JsonCache()
+        json_cache.set('key', 'value')
+        json_cache.save()
+
+        self.assertEqual(json_cache.get('key'), 'value')
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_unreadable_file_gives_empty_cache(self):
+        with open(self.path, 'w') as cache_file:
+            cache_file.write('{not json')
+
+        self.assertEqual(JsonCache(self.path).keys(), [])
+
+    def test_retain_forgets_other_entries(self):
+        json_cache = JsonCache(self.path)
+        json_cache.set('old', 1)
+        json_cache.set('new', 2)
+        json_cache.retain(['new'])
+        json_cache.save()
+
+        with open(self.path) as cache_file:
+            self.assertEqual(json.load(cache_file), {'new': 2})
+
+    def test_save_creates_cache_dir(self):
+        path = os.path.join(self.cache_dir, 'sub', 'any.json')
+        json_cache = JsonCache(path)
+        json_cache.set('key', 'value')
+        json_cache.save()
+
+        self.assertTrue(os.path.exists(path))
+
+    def test_get_cache_shares_file_caches(self):
+        self.assertIs(cache.get_cache('name', self.cache_dir), cache.get_cache('name', self.cache_dir))
+        self.assertIsNot(cache.get_cache('name'), cache.get_cache('name'))
@@ -88,6 +88,28 @@ class CliTest(TestCase):
         self.assertEqual(test_config["cloudwatchlogs"], expected_config["cloudwatchlogs"])
 
 
+class MultiAccountTest(TestCase):
+    def setUp(self):
+        patch('monocyte.cli.read_config', return_value={
+            'accounts': {'source': '/any/accounts.txt', 'workers': 8}}).start()
+        self.sweep_class_mock = patch('monocyte.cli.MultiAccountSweep').start()
+        self.monocyte_class_mock = patch('monocyte.cli.Monocyte').start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_accounts_config_starts_multi_account_sweep(self):
+        self.sweep_class_mock.return_value.run.return_value = 0
+
+        status = cli.main({'--dry-run': 'True', '--config-path': '/any/path', '--whitelist': None})
+
+        self.assertEqual(status, 0)
+        config = self.sweep_class_mock.call_args[0][0]
+        self.assertFalse('accounts' in config)
+        self.assertEqual(self.sweep_class_mock.call_args[1], {'source': '/any/accounts.txt', 'workers': 8})
+        self.assertFalse(self.monocyte_class_mock.called)
+
+
 class ArgumentsToConfigTest(TestCase):
     def setUp(self):
         self.whitelist = 's3://bucket/whitelist.yaml'
@@ -0,0 +1,141 @@
+from __future__ import print_function, absolute_import, division
+
+import threading
+import boto3
+from unittest import TestCase
+from mock import Mock, patch, ANY
+
+from monocyte.clients import ClientRegistry, get_pagination_config
+
+
+class ClientRegistryTest(TestCase):
+    def setUp(self):
+        self.boto3_mock = patch('monocyte.clients.boto3').start()
+        self.session_mock = self.boto3_mock.session.Session.return_value
+        self.session_mock.get_credentials.return_value.access_key = 'any access key'
+        self.session_mock.client.side_effect = lambda *args, **kwargs: Mock()
+        self.registry = ClientRegistry(max_pool_connections=42)
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_client_is_reused_for_same_service_and_region(self):
+        first = self.registry.get_client('ec2', region_name='us-east-1')
+        second = self.registry.get_client('ec2', region_name='us-east-1')
+
+        self.assertIs(first, second)
+        self.assertEqual(self.session_mock.client.call_count, 1)
+        self.assertEqual((self.registry.misses, self.registry.hits), (1, 1))
+
+    def test_clients_differ_per_region_and_service(self):
+        clients = set([
+            self.registry.get_client('ec2', region_name='us-east-1'),
+            self.registry.get_client('ec2', region_name='us-west-1'),
+            self.registry.get_client('rds', region_name='us-east-1')])
+
+        self.assertEqual(len(clients), 3)
+        self.assertEqual(self.registry.misses, 3)
+
+    def test_session_is_created_once(self):
+        self.registry.get_client('ec2', region_name='us-east-1')
+        self.registry.get_client('iam')
+
+        self.assertEqual(self.boto3_mock.session.Session.call_count, 1)
+
+    def test_client_uses_tuned_config(self):
+        self.registry.get_client('ec2', region_name='us-east-1')
+
+        config = self.session_mock.client.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections, 42)
+        self.assertTrue(config.tcp_keepalive)
+        self.assertEqual(config.retries, {'mode': 'standard', 'max_attempts': 8})
+        self.assertEqual((config.connect_timeout, config.read_timeout), (10, 60))
+
+    def test_client_requests_pass_rate_limiter(self):
+        client = self.registry.get_client('iam')
+
+        registered = [call[0][0] for call in client.meta.events.register.call_args_list]
+        self.assertEqual(registered, ['before-send', 'needs-retry'])
+
+    def test_account_id_is_resolved_once(self):
+        self.session_mock.client.side_effect = None
+        sts_client = self.session_mock.client.return_value
+        sts_client.get_caller_identity.return_value = {'Account': '123456789012'}
+
+        account_ids = [self.registry.get_account_id() for _ in range(3)]
+
+        self.assertEqual(account_ids, ['123456789012'] * 3)
+        self.session_mock.client.assert_called_once_with('sts', region_name=None, config=ANY)
+        self.assertEqual(sts_client.get_caller_identity.call_count, 1)
+
+    def test_account_lookup_does_not_block_other_clients(self):
+        other_clients = []
+
+        def get_caller_identity():
+            thread = threading.Thread(target=lambda: other_clients.append(
+                self.registry.get_client('ec2', region_name='us-east-1')))
+            thread.start()
+            thread.join(1)
+            return {'Account': '123456789012'}
+        sts_client = Mock()
+        sts_client.get_caller_identity.side_effect = get_caller_identity
+        self.session_mock.client.side_effect = lambda service_name, **kwargs: \
+            sts_client if service_name == 'sts' else Mock()
+
+        self.assertEqual(self.registry.get_account_id(), '123456789012')
+        self.assertEqual(len(other_clients), 1)
+
+    def test_available_regions_exclude_disabled_regions(self):
+        self.session_mock.get_available_regions.return_value = ['eu-west-1', 'af-south-1', 'us-east-1']
+        catalogue = Mock()
+        catalogue.get_disabled_regions.return_value = ['af-south-1', 'me-south-1']
+        self.session_mock.client.side_effect = None
+        self.session_mock.client.return_value.get_caller_identity.return_value = {'Account': '123456789012'}
+
+        self.registry.load_region_catalogue(catalogue)
+
+        self.assertEqual(self.registry.get_available_regions('ec2'), ['eu-west-1', 'us-east-1'])
+        catalogue.get_disabled_regions.assert_called_once_with('123456789012', self.session_mock.client.return_value)
+
+    def test_available_regions_are_looked_up_once_per_service(self):
+        self.session_mock.get_available_regions.return_value = ['eu-west-1']
+
+        self.registry.get_available_regions('ec2')
+        self.registry.get_available_regions('ec2')
+
+        self.session_mock.get_available_regions.assert_called_once_with('ec2')
+
+    def test_reset_forgets_clients(self):
+        first = self.registry.get_client('iam')
+        self.registry.reset()
+        second = self.registry.get_client('iam')
+
+        self.assertIsNot(first, second)
+        self.assertEqual((self.registry.misses, self.registry.hits), (1, 0))
+
+
+class GetPaginationConfigTest(TestCase):
+    def get_paginator(self, service_name, operation_name):
+        client = boto3.client(service_name, region_name='us-east-1', aws_access_key_id='any',
+                              aws_secret_access_key='any')
+        return client.get_paginator(operation_name)
+
+    def test_no_config_without_page_size(self):
+        self.assertEqual(get_pagination_config(self.get_paginator('ec2', 'describe_volumes'), None), {})
+
+    def test_no_config_for_operation_without_limit_key(self):
+        self.assertEqual(get_pagination_config(self.get_paginator('cloudformation', 'list_stacks'), 100), {})
+
+    def test_page_size_within_limits_is_kept(self):
+        self.assertEqual(get_pagination_config(self.get_paginator('ec2', 'describe_volumes'), 50),
+                         {'PageSize': 50})
+
+    def test_page_size_is_clamped_to_maximum_of_service_model(self):
+        self.assertEqual(get_pagination_config(self.get_paginator('dynamodb', 'list_tables'), 500),
+                         {'PageSize': 100})
+
+    def test_page_size_is_clamped_to_known_maximum(self):
+        self.assertEqual(get_pagination_config(self.get_paginator('rds', 'describe_db_instances'), 500),
+                         {'PageSize': 100})
+        self.assertEqual(get_pagination_config(self.get_paginator('resourcegroupstaggingapi', 'get_resources'),
+                                               500), {'PageSize': 100})
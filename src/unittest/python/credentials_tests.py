@@ -0,0 +1,88 @@
+from __future__ import print_function, absolute_import, division
+
+import datetime
+import threading
+from unittest import TestCase
+from dateutil.tz import tzutc
+from mock import Mock
+
+from monocyte.cache import JsonCache
+from monocyte import credentials
+from monocyte.credentials import AssumedRoleProvider
+
+ROLE_ARN = 'arn:aws:iam::111111111111:role/monocyte'
+
+
+def expiring_in(seconds):
+    return datetime.datetime.now(tzutc()) + datetime.timedelta(seconds=seconds)
+
+
+class AssumedRoleProviderTest(TestCase):
+    def setUp(self):
+        self.sts_client = Mock()
+        self.assumed = threading.Event()
+        self.expirations = [expiring_in(3600)]
+
+        def assume_role(**kwargs):
+            self.assumed.set()
+            return {'Credentials': {'AccessKeyId': 'key{0}'.format(self.sts_client.assume_role.call_count),
+                                    'SecretAccessKey': 'secret', 'SessionToken': 'token',
+                                    'Expiration': self.expirations.pop(0) if len(self.expirations) > 1
+                                    else self.expirations[0]}}
+        self.sts_client.assume_role.side_effect = assume_role
+        self.cache = JsonCache()
+        self.provider = AssumedRoleProvider(ROLE_ARN, self.sts_client, self.cache, logger=Mock())
+
+    def tearDown(self):
+        self.provider.stop()
+
+    def test_role_is_assumed_once(self):
+        first = self.provider.get_metadata()
+        second = self.provider.get_metadata()
+
+        self.assertEqual(first, second)
+        self.sts_client.assume_role.assert_called_once_with(RoleArn=ROLE_ARN, RoleSessionName='monocyte',
+                                                            DurationSeconds=3600)
+        self.assertEqual(self.cache.get(ROLE_ARN)['access_key'], 'key1')
+
+    def test_cached_credentials_are_reused(self):
+        self.cache.set(ROLE_ARN, {'access_key': 'cached', 'secret_key': 'secret', 'token': 'token',
+                                  'expiry_time': expiring_in(3000).isoformat()})
+
+        self.assertEqual(self.provider.get_metadata()['access_key'], 'cached')
+        self.assertFalse(self.sts_client.assume_role.called)
+
+    def test_credentials_expiring_soon_are_replaced(self):
+        self.cache.set(ROLE_ARN, {'access_key': 'cached', 'secret_key': 'secret', 'token': 'token',
+                                  'expiry_time': expiring_in(600).isoformat()})
+
+        self.assertEqual(self.provider.get_metadata()['access_key'], 'key1')
+
+    def test_session_uses_assumed_credentials(self):
+        session = self.provider.create_session(region_name='eu-west-1')
+
+        credentials = session.get_credentials().get_frozen_credentials()
+        self.assertEqual((credentials.access_key, credentials.token), ('key1', 'token'))
+
+    def test_role_is_assumed_again_in_the_background_before_expiry(self):
+        self.provider.refresh_ahead = 1200
+        self.expirations = [expiring_in(1201), expiring_in(7200)]
+        self.provider.get_credentials()
+        self.assertEqual(self.sts_client.assume_role.call_count, 1)
+        self.assumed.clear()
+
+        self.assertTrue(self.assumed.wait(5))
+        self.assertEqual(self.sts_client.assume_role.call_count, 2)
+
+
+class ProviderRegistryTest(TestCase):
+    def test_released_provider_stops_refreshing_and_is_replaced(self):
+        provider = credentials.get_provider(ROLE_ARN, Mock())
+        self.assertIs(credentials.get_provider(ROLE_ARN, Mock()), provider)
+
+        credentials.release_provider(ROLE_ARN)
+
+        self.assertTrue(provider._stopped.is_set())
+        other_provider = credentials.get_provider(ROLE_ARN, Mock())
+        self.addCleanup(credentials.release_provider, ROLE_ARN)
+        self.assertIsNot(other_provider, provider)
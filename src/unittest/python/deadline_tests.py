@@ -0,0 +1,45 @@
+from __future__ import print_function, absolute_import, division
+
+from unittest import TestCase
+
+from monocyte.deadline import Deadline, DeadlineExceeded
+
+
+class DeadlineTest(TestCase):
+    def setUp(self):
+        self.now = 100.0
+
+    def clock(self):
+        return self.now
+
+    def test_deadline_without_time_limit_never_expires(self):
+        deadline = Deadline(clock=self.clock)
+        self.now += 10 ** 6
+
+        self.assertFalse(deadline.expired())
+        self.assertEqual(deadline.remaining(), None)
+
+    def test_deadline_expires_after_seconds(self):
+        deadline = Deadline(10, clock=self.clock)
+        self.now += 4
+        self.assertEqual(deadline.remaining(), 6)
+        self.assertFalse(deadline.expired())
+
+        self.now += 6
+        self.assertTrue(deadline.expired())
+        self.assertRaises(DeadlineExceeded, deadline.check, "the test")
+
+    def test_child_never_outlives_parent(self):
+        parent = Deadline(10, clock=self.clock)
+
+        self.assertEqual(parent.child(60).expires_at, 110)
+        self.assertEqual(parent.child(5).expires_at, 105)
+        self.assertEqual(parent.child().expires_at, 110)
+
+    def test_cancelling_parent_expires_children(self):
+        parent = Deadline(clock=self.clock)
+        child = parent.child(60)
+
+        parent.cancel()
+
+        self.assertTrue(child.expired())
@@ -0,0 +1,54 @@
+from __future__ import print_function, absolute_import, division
+
+from unittest import TestCase
+from mock import patch
+
+from monocyte import discovery
+from monocyte.discovery import fetch_inventory, get_resource_type
+
+
+class GetResourceTypeTest(TestCase):
+    def test_resource_type_separated_by_slash(self):
+        self.assertEqual(get_resource_type('arn:aws:ec2:eu-west-1:123456789012:instance/i-1234'), 'ec2:instance')
+        self.assertEqual(get_resource_type(
+            'arn:aws:cloudformation:eu-west-1:123456789012:stack/name/b4e5a2f0'), 'cloudformation:stack')
+
+    def test_resource_type_separated_by_colon(self):
+        self.assertEqual(get_resource_type('arn:aws:rds:eu-west-1:123456789012:db:mydb'), 'rds:db')
+
+    def test_arn_without_resource_type(self):
+        self.assertEqual(get_resource_type('arn:aws:s3:::any-bucket'), 's3')
+
+    def test_no_arn(self):
+        self.assertEqual(get_resource_type('i-1234'), None)
+
+
+class FetchInventoryTest(TestCase):
+    def setUp(self):
+        self.get_client_mock = patch('monocyte.discovery.get_client').start()
+        self.paginate_mock = self.get_client_mock.return_value.get_paginator.return_value.paginate
+        self.paginate_mock.return_value = [
+            {'ResourceTagMappingList': [{'ResourceARN': 'arn:aws:ec2:eu-west-1:1:instance/i-1'},
+                                        {'ResourceARN': 'arn:aws:ec2:eu-west-1:1:volume/vol-1'}]},
+            {'ResourceTagMappingList': [{'ResourceARN': 'arn:aws:ec2:eu-west-1:1:instance/i-2'}]}]
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_groups_arns_by_resource_type(self):
+        inventory = fetch_inventory('eu-west-1')
+
+        self.assertEqual(inventory, {
+            'ec2:instance': ['arn:aws:ec2:eu-west-1:1:instance/i-1', 'arn:aws:ec2:eu-west-1:1:instance/i-2'],
+            'ec2:volume': ['arn:aws:ec2:eu-west-1:1:volume/vol-1']})
+        self.get_client_mock.assert_called_once_with('resourcegroupstaggingapi', region_name='eu-west-1')
+
+    @patch('monocyte.discovery.get_pagination_config', return_value={'PageSize': 50})
+    def test_asks_only_for_handled_resource_types(self, get_pagination_config_mock):
+        fetch_inventory('eu-west-1', page_size=50)
+
+        self.paginate_mock.assert_called_once_with(
+            ResourceTypeFilters=sorted(set(discovery.HANDLER_RESOURCE_TYPES.values())),
+            PaginationConfig={'PageSize': 50})
+        get_pagination_config_mock.assert_called_once_with(
+            self.get_client_mock.return_value.get_paginator.return_value, 50)
@@ -0,0 +1,81 @@
+# Monocyte - Search and Destroy unwanted AWS Resources relentlessly.
+# Copyright 2015 Immobilien Scout GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+from unittest import TestCase
+from mock import patch
+
+from monocyte.handler import acm
+
+
+class CertificateTest(TestCase):
+
+    def setUp(self):
+        self.get_client_mock = patch("monocyte.handler.acm.get_client").start()
+        self.regions_mock = patch("monocyte.handler.acm.get_available_regions").start()
+        self.regions_mock.return_value = ['region-a', 'region-b']
+        self.client = self.get_client_mock.return_value
+        now = datetime.datetime.now()
+        self.certificates = {
+            'arn:expiring': {'CertificateArn': 'arn:expiring', 'DomainName': 'expiring.example.com',
+                             'NotAfter': now + datetime.timedelta(days=10), 'CreatedAt': now},
+            'arn:valid': {'CertificateArn': 'arn:valid', 'DomainName': 'valid.example.com',
+                          'NotAfter': now + datetime.timedelta(days=365), 'CreatedAt': now}}
+        self.client.get_paginator.return_value.paginate.return_value = [
+            {'CertificateSummaryList': [{'CertificateArn': 'arn:expiring'}, {'CertificateArn': 'arn:valid'}]}]
+        self.client.describe_certificate.side_effect = \
+            lambda CertificateArn: {'Certificate': self.certificates[CertificateArn]}
+        self.handler = acm.Certificate(lambda region_name: False)
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_all_regions_are_checked_regardless_of_region_filter(self):
+        resources = list(self.handler.fetch_unwanted_resources())
+
+        self.assertEqual([resource.resource_id for resource in resources], ['arn:expiring', 'arn:expiring'])
+        self.assertEqual(sorted(call[1]['region_name'] for call in self.get_client_mock.call_args_list),
+                         ['region-a', 'region-b'])
+
+    def test_known_valid_certificates_are_not_described_again(self):
+        list(self.handler.fetch_unwanted_resources())
+        self.client.describe_certificate.reset_mock()
+
+        resources = list(self.handler.fetch_unwanted_resources())
+
+        self.assertEqual(len(resources), 2)
+        described_arns = set(call[1]['CertificateArn'] for call in self.client.describe_certificate.call_args_list)
+        self.assertEqual(described_arns, set(['arn:expiring']))
+
+    def test_renewed_certificate_is_no_longer_reported(self):
+        list(self.handler.fetch_unwanted_resources())
+        self.certificates['arn:expiring']['NotAfter'] = datetime.datetime.now() + datetime.timedelta(days=395)
+
+        resources = list(self.handler.fetch_unwanted_resources())
+
+        self.assertEqual(resources, [])
+        self.client.describe_certificate.reset_mock()
+        list(self.handler.fetch_unwanted_resources())
+        self.assertFalse(self.client.describe_certificate.called)
+
+    def test_index_forgets_deleted_certificates(self):
+        list(self.handler.fetch_unwanted_resources())
+        self.client.get_paginator.return_value.paginate.return_value = [
+            {'CertificateSummaryList': [{'CertificateArn': 'arn:valid'}]}]
+
+        list(self.handler.fetch_unwanted_resources())
+
+        self.assertEqual(self.handler.get_cache('acm_certificates').keys(), ['arn:valid'])
@@ -13,11 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import boto.cloudformation
-import boto.cloudformation.stack
-
 from unittest import TestCase
-from mock import patch, Mock
+from mock import patch
 
 from monocyte.handler import cloudformation
 from monocyte.handler import Resource
@@ -31,16 +28,16 @@ VALID_TARGET_STATE_STATEMENT = "Skipping deletion: State 'DELETE_COMPLETE' is a
 class CloudFormationTest(TestCase):
 
     def setUp(self):
-        self.cloudformation_mock = patch("monocyte.handler.cloudformation.cloudformation").start()
-        self.positive_fake_region = Mock(boto.cloudformation.regions)
-        self.positive_fake_region.name = "allowed_region"
-        self.negative_fake_region = Mock(boto.cloudformation.regions)
-        self.negative_fake_region.name = "forbbiden_region"
+        self.get_client_mock = patch("monocyte.handler.cloudformation.get_client").start()
+        self.regions_mock = patch("monocyte.handler.cloudformation.get_available_regions").start()
+        self.client = self.get_client_mock.return_value
+        self.positive_fake_region = "allowed_region"
+        self.negative_fake_region = "forbbiden_region"
         self.resource_type = "cloudformation Stack"
-        self.cloudformation_mock.regions.return_value = [self.positive_fake_region, self.negative_fake_region]
+        self.regions_mock.return_value = [self.positive_fake_region, self.negative_fake_region]
         self.logger_mock = patch("monocyte.handler.logging").start()
         self.cloudformation_handler = cloudformation.Stack(
-            lambda region_name: region_name == self.positive_fake_region.name)
+            lambda region_name: region_name == self.positive_fake_region)
 
         self.stack_mock = self._given_stack_mock()
 
@@ -50,6 +47,15 @@ class CloudFormationTest(TestCase):
     def test_fetch_unwanted_resources_filtered_by_region(self):
         only_resource = list(self.cloudformation_handler.fetch_unwanted_resources())[0]
         self.assertEqual(only_resource.wrapped, self.stack_mock)
+        self.get_client_mock.assert_called_once_with('cloudformation', region_name=self.positive_fake_region)
+
+    def test_fetch_unwanted_resources_skips_deleted_stacks_server_side(self):
+        list(self.cloudformation_handler.fetch_unwanted_resources())
+
+        status_filter = self.client.get_paginator.return_value.paginate.call_args[1]['StackStatusFilter']
+        self.assertTrue('CREATE_COMPLETE' in status_filter)
+        self.assertFalse('DELETE_COMPLETE' in status_filter)
+        self.assertFalse('DELETE_IN_PROGRESS' in status_filter)
 
     def test_fetch_unwanted_resources_filtered_by_ignored_resources(self):
         self.cloudformation_handler.ignored_resources = [STACK_NAME]
@@ -60,41 +66,41 @@ class CloudFormationTest(TestCase):
         only_resource = list(self.cloudformation_handler.fetch_unwanted_resources())[0]
         resource_string = self.cloudformation_handler.to_string(only_resource)
 
-        self.assertTrue(self.stack_mock.stack_status in resource_string)
-        self.assertTrue(self.stack_mock.creation_time in resource_string)
-        self.assertTrue(self.stack_mock.region in resource_string)
+        self.assertTrue(self.stack_mock['StackStatus'] in resource_string)
+        self.assertTrue(self.stack_mock['CreationTime'] in resource_string)
+        self.assertTrue(self.positive_fake_region in resource_string)
 
     def test_skip_deletion_in_dry_run(self):
-        resource = Resource(self.stack_mock, self.resource_type, self.stack_mock.stack_id,
-                            self.stack_mock.creation_time, self.negative_fake_region.name)
+        resource = Resource(self.stack_mock, self.resource_type, self.stack_mock['StackId'],
+                            self.stack_mock['CreationTime'], self.negative_fake_region)
         self.cloudformation_handler.dry_run = True
         self.cloudformation_handler.delete(resource)
-        self.assertFalse(self.cloudformation_mock.connect_to_region.return_value.delete_stack.called)
+        self.assertFalse(self.client.delete_stack.called)
 
     def test_does_delete_if_not_dry_run(self):
-        resource = Resource(self.stack_mock, self.resource_type, self.stack_mock.stack_id,
-                            self.stack_mock.creation_time, self.negative_fake_region.name)
+        resource = Resource(self.stack_mock, self.resource_type, self.stack_mock['StackId'],
+                            self.stack_mock['CreationTime'], self.negative_fake_region)
         self.cloudformation_handler.dry_run = False
         self.cloudformation_handler.delete(resource)
-        self.logger_mock.getLogger.return_value.info.assert_called_with(DELETION_STATEMENT % self.stack_mock.stack_name)
-        self.assertTrue(self.cloudformation_mock.connect_to_region.return_value.delete_stack.called)
+        self.logger_mock.getLogger.return_value.info.assert_called_with(DELETION_STATEMENT % STACK_NAME)
+        self.get_client_mock.assert_called_with('cloudformation', region_name=self.negative_fake_region)
+        self.client.delete_stack.assert_called_once_with(StackName=self.stack_mock['StackId'])
 
     def test_skip_deletion_if_already_deleted(self):
-        self.stack_mock.stack_status = "DELETE_COMPLETE"
-        resource = Resource(self.stack_mock, self.resource_type, self.stack_mock.stack_id,
-                            self.stack_mock.creation_time, self.negative_fake_region.name)
+        self.stack_mock['StackStatus'] = "DELETE_COMPLETE"
+        resource = Resource(self.stack_mock, self.resource_type, self.stack_mock['StackId'],
+                            self.stack_mock['CreationTime'], self.negative_fake_region)
         self.cloudformation_handler.dry_run = False
         self.assertRaises(Warning, self.cloudformation_handler.delete, resource)
-        self.assertFalse(self.cloudformation_mock.connect_to_region.return_value.delete_stack.called)
+        self.assertFalse(self.client.delete_stack.called)
 
     def _given_stack_mock(self):
-        stack_mock = Mock(boto.cloudformation.stack.Stack, stack_name=STACK_NAME)
-        stack_mock.stack_id = "id-12345"
-        stack_mock.stack_status = "CREATE_COMPLETE"
-        stack_mock.creation_time = "01.01.2015"
-        stack_mock.region = self.positive_fake_region.name
-
-        self.cloudformation_mock.connect_to_region.return_value.valid_states = ('CREATE_COMPLETE',
-                                                                                'DELETE_COMPLETE')
-        self.cloudformation_mock.connect_to_region.return_value.list_stacks.return_value = [stack_mock]
+        stack_mock = {
+            'StackName': STACK_NAME,
+            'StackId': "id-12345",
+            'StackStatus': "CREATE_COMPLETE",
+            'CreationTime': "01.01.2015"
+        }
+
+        self.client.get_paginator.return_value.paginate.return_value = [{'StackSummaries': [stack_mock]}]
         return stack_mock
@@ -13,34 +13,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import boto.exception
-import boto.dynamodb2.table
-import boto.regioninfo
+import datetime
 
+from botocore.exceptions import ClientError
 from unittest import TestCase
-from mock import patch, Mock
-from monocyte.handler import dynamodb
+from mock import patch
+from monocyte.handler import dynamodb, Resource
 
 TABLE_NAME = "mock_table"
 
 
 class DynamoDbTableHandlerTest(TestCase):
     def setUp(self):
-        self.dynamodb_mock = patch("monocyte.handler.dynamodb.dynamodb2").start()
-        self.positive_fake_region = Mock(boto.regioninfo.RegionInfo)
-        self.positive_fake_region.name = "allowed_region"
-        self.negative_fake_region = Mock(boto.regioninfo.RegionInfo)
-        self.negative_fake_region.name = "forbidden_region"
+        self.get_client_mock = patch("monocyte.handler.dynamodb.get_client").start()
+        self.regions_mock = patch("monocyte.handler.dynamodb.get_available_regions").start()
+        self.positive_fake_region = "allowed_region"
+        self.negative_fake_region = "forbidden_region"
 
-        self.dynamodb_mock.regions.return_value = [self.positive_fake_region, self.negative_fake_region]
+        self.regions_mock.return_value = [self.positive_fake_region, self.negative_fake_region]
         self.logger_mock = patch("monocyte.handler.logging").start()
         self.dynamodb_handler = dynamodb.Table(
-            lambda region_name: region_name == self.positive_fake_region.name)
+            lambda region_name: region_name == self.positive_fake_region)
 
         self.instance_mock = self._given_instance_mock()
-        connection = self.dynamodb_mock.connect_to_region.return_value
-        connection.list_tables.return_value = {"TableNames": ["mock_table"]}
-        connection.describe_table.return_value = self.instance_mock
+        self.client = self.get_client_mock.return_value
+        self.client.get_paginator.return_value.paginate.return_value = [{"TableNames": [TABLE_NAME]}]
+        self.client.describe_table.return_value = self.instance_mock
 
     def tearDown(self):
         patch.stopall()
@@ -53,13 +51,48 @@ class DynamoDbTableHandlerTest(TestCase):
         self.dynamodb_handler.ignored_resources = [TABLE_NAME]
         empty_list = list(self.dynamodb_handler.fetch_unwanted_resources())
         self.assertEqual(empty_list, [])
+        self.assertFalse(self.client.describe_table.called)
+
+    def test_fetch_unwanted_resources_keeps_listing_order(self):
+        names = ["table-{0}".format(number) for number in range(20)]
+        self.client.get_paginator.return_value.paginate.return_value = [
+            {"TableNames": names[:10]}, {"TableNames": names[10:]}]
+        self.client.describe_table.side_effect = lambda TableName: {"Table": {
+            "TableName": TableName, "CreationDateTime": datetime.datetime(2015, 1, 1), "TableStatus": "ACTIVE"}}
+
+        resources = list(self.dynamodb_handler.fetch_unwanted_resources())
+
+        self.assertEqual([resource.resource_id for resource in resources], names)
+
+    def test_fetch_unwanted_resources_skips_tables_deleted_meanwhile(self):
+        self.client.describe_table.side_effect = ClientError(
+            {"Error": {"Code": "ResourceNotFoundException", "Message": "gone"}}, "DescribeTable")
+
+        self.assertEqual(list(self.dynamodb_handler.fetch_unwanted_resources()), [])
 
     def test_to_string(self):
         only_resource = list(self.dynamodb_handler.fetch_unwanted_resources())[0]
         resource_string = self.dynamodb_handler.to_string(only_resource)
 
         self.assertTrue("mock_table" in resource_string)
+        self.assertTrue("2015-01-01 00:00:00" in resource_string)
+
+    def test_skip_deletion_in_dry_run(self):
+        resource = Resource(self.instance_mock["Table"], "dynamodb Table", TABLE_NAME,
+                            self.instance_mock["Table"]["CreationDateTime"], self.negative_fake_region)
+        self.dynamodb_handler.delete(resource)
+        self.assertFalse(self.client.delete_table.called)
+
+    def test_does_delete_if_not_dry_run(self):
+        resource = Resource(self.instance_mock["Table"], "dynamodb Table", TABLE_NAME,
+                            self.instance_mock["Table"]["CreationDateTime"], self.negative_fake_region)
+        self.dynamodb_handler.dry_run = False
+        self.dynamodb_handler.delete(resource)
+        self.get_client_mock.assert_called_with('dynamodb', region_name=self.negative_fake_region)
+        self.client.delete_table.assert_called_once_with(TableName=TABLE_NAME)
 
     def _given_instance_mock(self):
-        instance_mock = {"Table": {"TableName": TABLE_NAME, "CreationDateTime": 1, "TableStatus": "mocked"}}
+        instance_mock = {"Table": {"TableName": TABLE_NAME,
+                                   "CreationDateTime": datetime.datetime(2015, 1, 1),
+                                   "TableStatus": "mocked"}}
         return instance_mock
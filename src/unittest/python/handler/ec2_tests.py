@@ -13,13 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import boto.ec2
-import boto.exception
-import boto.ec2.regioninfo
-import boto.ec2.instance
-import boto.ec2.volume
+
+from botocore.exceptions import ClientError
 from unittest import TestCase
-from mock import patch, Mock
+from mock import patch
 from monocyte.handler import ec2
 from monocyte.handler import Resource
 
@@ -28,18 +25,22 @@ VOLUME_ID = "vol-12345"
 INSTANCE_ID = "id-12345"
 
 
+def client_error(code, message="test"):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, 'operation')
+
+
 class EC2InstanceHandlerTest(TestCase):
 
     def setUp(self):
-        self.ec2_mock = patch("monocyte.handler.ec2.ec2").start()
-        self.positive_fake_region = Mock(boto.ec2.regioninfo.EC2RegionInfo)
-        self.positive_fake_region.name = "allowed_region"
-        self.negative_fake_region = Mock(boto.ec2.regioninfo.EC2RegionInfo)
-        self.negative_fake_region.name = "forbidden_region"
+        self.get_client_mock = patch("monocyte.handler.ec2.get_client").start()
+        self.regions_mock = patch("monocyte.handler.ec2.get_available_regions").start()
+        self.positive_fake_region = "allowed_region"
+        self.negative_fake_region = "forbidden_region"
         self.resource_type = "ec2 Instance"
-        self.ec2_mock.regions.return_value = [self.positive_fake_region, self.negative_fake_region]
+        self.regions_mock.return_value = [self.positive_fake_region, self.negative_fake_region]
         self.logger_mock = patch("monocyte.handler.logging").start()
-        self.ec2_handler = ec2.Instance(lambda region_name: region_name == self.positive_fake_region.name)
+        self.ec2_handler = ec2.Instance(lambda region_name: region_name == self.positive_fake_region)
+        self.client = self.get_client_mock.return_value
 
         self.instance_mock = self._given_instance_mock()
 
@@ -49,6 +50,15 @@ class EC2InstanceHandlerTest(TestCase):
     def test_fetch_unwanted_resources_filtered_by_region(self):
         only_resource = list(self.ec2_handler.fetch_unwanted_resources())[0]
         self.assertEqual(only_resource.wrapped, self.instance_mock)
+        self.get_client_mock.assert_called_once_with('ec2', region_name=self.positive_fake_region)
+
+    def test_fetch_unwanted_resources_skips_terminated_instances_server_side(self):
+        list(self.ec2_handler.fetch_unwanted_resources())
+
+        filters = self.client.get_paginator.return_value.paginate.call_args[1]['Filters']
+        self.assertEqual(filters, [{'Name': 'instance-state-name', 'Values': ec2.UNWANTED_INSTANCE_STATES}])
+        for state in ec2.Instance.VALID_TARGET_STATES:
+            self.assertFalse(state in ec2.UNWANTED_INSTANCE_STATES)
 
     def test_fetch_unwanted_resources_filtered_by_ignored_resources(self):
         self.ec2_handler.ignored_resources = [INSTANCE_ID]
@@ -59,51 +69,114 @@ class EC2InstanceHandlerTest(TestCase):
         only_resource = list(self.ec2_handler.fetch_unwanted_resources())[0]
         resource_string = self.ec2_handler.to_string(only_resource)
 
-        self.assertTrue(self.instance_mock.id in resource_string)
-        self.assertTrue(self.instance_mock.instance_type in resource_string)
-        self.assertTrue(self.instance_mock.launch_time in resource_string)
-        self.assertTrue(self.instance_mock.public_dns_name in resource_string)
-        self.assertTrue(self.instance_mock.key_name in resource_string)
-        self.assertTrue(self.instance_mock.region.name in resource_string)
+        self.assertTrue(self.instance_mock['InstanceId'] in resource_string)
+        self.assertTrue(self.instance_mock['InstanceType'] in resource_string)
+        self.assertTrue(self.instance_mock['LaunchTime'] in resource_string)
+        self.assertTrue(self.instance_mock['PublicDnsName'] in resource_string)
+        self.assertTrue(self.instance_mock['KeyName'] in resource_string)
+        self.assertTrue(self.positive_fake_region in resource_string)
 
     def test_delete(self):
-        resource = Resource(self.instance_mock, self.resource_type, self.instance_mock.id,
-                            self.instance_mock.launch_time, self.negative_fake_region.name)
-        connection = self.ec2_mock.connect_to_region.return_value
+        resource = Resource(self.instance_mock, self.resource_type, self.instance_mock['InstanceId'],
+                            self.instance_mock['LaunchTime'], self.negative_fake_region)
 
-        e = boto.exception.EC2ResponseError(412, 'boom')
-        e.message = "test"
-        connection.terminate_instances.side_effect = e
+        self.client.terminate_instances.side_effect = client_error('DryRunOperation')
         self.assertRaises(Warning, self.ec2_handler.delete, resource)
 
+    def test_delete_raises_other_errors_in_dry_run(self):
+        resource = Resource(self.instance_mock, self.resource_type, self.instance_mock['InstanceId'],
+                            self.instance_mock['LaunchTime'], self.negative_fake_region)
+
+        self.client.terminate_instances.side_effect = client_error('UnauthorizedOperation')
+        self.assertRaises(ClientError, self.ec2_handler.delete, resource)
+
+    def test_delete_skips_instances_in_valid_target_state(self):
+        resource = self._given_instance_resource("id-1", state="shutting-down")
+
+        self.assertRaises(Warning, self.ec2_handler.delete, resource)
+        self.assertFalse(self.client.terminate_instances.called)
+
+    def test_delete_many_terminates_all_instances_in_one_call(self):
+        self.ec2_handler.dry_run = False
+        resources = [self._given_instance_resource("id-1"), self._given_instance_resource("id-2")]
+        self.client.terminate_instances.return_value = {'TerminatingInstances': [
+            {'InstanceId': "id-1"}, {'InstanceId': "id-2"}]}
+
+        results = self.ec2_handler.delete_many(resources)
+
+        self.client.terminate_instances.assert_called_once_with(InstanceIds=["id-1", "id-2"], DryRun=False)
+        self.get_client_mock.assert_called_once_with('ec2', region_name=self.negative_fake_region)
+        self.assertEqual(results, [(resources[0], None), (resources[1], None)])
+
+    def test_delete_many_reports_dry_run_for_every_instance(self):
+        resources = [self._given_instance_resource("id-1"), self._given_instance_resource("id-2")]
+        self.client.terminate_instances.side_effect = client_error('DryRunOperation')
+
+        results = self.ec2_handler.delete_many(resources)
+
+        self.assertEqual([resource for resource, _ in results], resources)
+        self.assertTrue(all(isinstance(exc, Warning) for _, exc in results))
+
+    def test_delete_many_skips_instances_in_valid_target_state(self):
+        self.ec2_handler.dry_run = False
+        terminated = self._given_instance_resource("id-1", state="terminated")
+        running = self._given_instance_resource("id-2")
+
+        results = self.ec2_handler.delete_many([terminated, running])
+
+        self.client.terminate_instances.assert_called_once_with(InstanceIds=["id-2"], DryRun=False)
+        self.assertTrue(isinstance(results[0][1], Warning))
+        self.assertEqual(results[1], (running, None))
+
+    def test_delete_many_retries_one_by_one_if_batch_fails(self):
+        self.ec2_handler.dry_run = False
+        resources = [self._given_instance_resource("id-1"), self._given_instance_resource("id-2")]
+        error = client_error('InvalidInstanceID.NotFound')
+
+        def terminate_instances(InstanceIds, DryRun):
+            if "id-2" in InstanceIds:
+                raise error
+            return {'TerminatingInstances': []}
+
+        self.client.terminate_instances.side_effect = terminate_instances
+
+        results = self.ec2_handler.delete_many(resources)
+
+        self.assertEqual(results, [(resources[0], None), (resources[1], error)])
+
+    def _given_instance_resource(self, instance_id, state="running"):
+        instance = {'InstanceId': instance_id, 'State': {'Name': state}, 'LaunchTime': "01.01.2015"}
+        return Resource(instance, self.resource_type, instance_id, "01.01.2015", self.negative_fake_region)
+
     def _given_instance_mock(self):
-        instance_mock = Mock(boto.ec2.instance, image_id="ami-1112")
-        instance_mock.id = INSTANCE_ID
-        instance_mock.instance_type = "m1.small"
-        instance_mock.launch_time = "01.01.2015"
-        instance_mock.public_dns_name = "test.aws.com"
-        instance_mock.key_name = "test-ssh-key"
-        instance_mock.region = self.positive_fake_region
-        instance_mock._state = boto.ec2.instance.InstanceState(16, "running")
-        instance_mock.state = instance_mock._state.name
-
-        self.ec2_mock.connect_to_region.return_value.get_only_instances.return_value = [instance_mock]
+        instance_mock = {
+            'InstanceId': INSTANCE_ID,
+            'ImageId': "ami-1112",
+            'InstanceType': "m1.small",
+            'LaunchTime': "01.01.2015",
+            'PublicDnsName': "test.aws.com",
+            'KeyName': "test-ssh-key",
+            'State': {'Code': 16, 'Name': "running"}
+        }
+
+        self.client.get_paginator.return_value.paginate.return_value = [
+            {'Reservations': [{'Instances': [instance_mock]}]}]
         return instance_mock
 
 
 class EC2VolumeHandlerTest(TestCase):
 
     def setUp(self):
-        self.ec2_mock = patch("monocyte.handler.ec2.ec2").start()
-        self.positive_fake_region = Mock(boto.ec2.regioninfo.EC2RegionInfo)
-        self.positive_fake_region.name = "allowed_region"
-        self.negative_fake_region = Mock(boto.ec2.regioninfo.EC2RegionInfo)
-        self.negative_fake_region.name = "forbidden_region"
+        self.get_client_mock = patch("monocyte.handler.ec2.get_client").start()
+        self.regions_mock = patch("monocyte.handler.ec2.get_available_regions").start()
+        self.positive_fake_region = "allowed_region"
+        self.negative_fake_region = "forbidden_region"
         self.resource_type = "ec2 Volume"
 
-        self.ec2_mock.regions.return_value = [self.positive_fake_region, self.negative_fake_region]
+        self.regions_mock.return_value = [self.positive_fake_region, self.negative_fake_region]
         self.logger_mock = patch("monocyte.handler.logging").start()
-        self.ec2_handler = ec2.Volume(lambda region_name: region_name == self.positive_fake_region.name)
+        self.ec2_handler = ec2.Volume(lambda region_name: region_name == self.positive_fake_region)
+        self.client = self.get_client_mock.return_value
 
         self.volume_mock = self._given_volume_mock()
 
@@ -114,6 +187,12 @@ class EC2VolumeHandlerTest(TestCase):
         only_resource = list(self.ec2_handler.fetch_unwanted_resources())[0]
         self.assertEqual(only_resource.wrapped, self.volume_mock)
 
+    def test_fetch_unwanted_resources_skips_deleted_volumes_server_side(self):
+        list(self.ec2_handler.fetch_unwanted_resources())
+
+        filters = self.client.get_paginator.return_value.paginate.call_args[1]['Filters']
+        self.assertEqual(filters, [{'Name': 'status', 'Values': ec2.UNWANTED_VOLUME_STATES}])
+
     def test_fetch_unwanted_resources_filtered_by_ignored_resources(self):
         self.ec2_handler.ignored_resources = [VOLUME_ID]
         empty_list = list(self.ec2_handler.fetch_unwanted_resources())
@@ -123,27 +202,36 @@ class EC2VolumeHandlerTest(TestCase):
         only_resource = list(self.ec2_handler.fetch_unwanted_resources())[0]
         resource_string = self.ec2_handler.to_string(only_resource)
 
-        self.assertTrue(self.volume_mock.id in resource_string)
-        self.assertTrue(self.volume_mock.create_time in resource_string)
-        self.assertTrue(self.volume_mock.region.name in resource_string)
+        self.assertTrue(self.volume_mock['VolumeId'] in resource_string)
+        self.assertTrue(self.volume_mock['CreateTime'] in resource_string)
+        self.assertTrue(self.positive_fake_region in resource_string)
 
     def test_delete(self):
-        resource = Resource(self.volume_mock, self.resource_type, self.volume_mock.id,
-                            self.volume_mock.create_time, self.negative_fake_region.name)
-        connection = self.ec2_mock.connect_to_region.return_value
+        resource = Resource(self.volume_mock, self.resource_type, self.volume_mock['VolumeId'],
+                            self.volume_mock['CreateTime'], self.negative_fake_region)
 
-        e = boto.exception.EC2ResponseError(412, 'boom')
-        e.message = "test"
-        connection.delete_volume.side_effect = e
+        self.client.delete_volume.side_effect = client_error('DryRunOperation')
 
         self.assertRaises(Warning, self.ec2_handler.delete, resource)
 
+    def test_delete_many_uses_one_client(self):
+        self.ec2_handler.dry_run = False
+        resources = [Resource({'VolumeId': volume_id}, self.resource_type, volume_id, "01.01.2015",
+                              self.negative_fake_region) for volume_id in ["vol-1", "vol-2"]]
+        error = client_error('VolumeInUse')
+        self.client.delete_volume.side_effect = [None, error]
+
+        results = self.ec2_handler.delete_many(resources)
+
+        self.get_client_mock.assert_called_once_with('ec2', region_name=self.negative_fake_region)
+        self.assertEqual(results, [(resources[0], None), (resources[1], error)])
+
     def _given_volume_mock(self):
-        volume_mock = Mock(boto.ec2.volume)
-        volume_mock.id = VOLUME_ID
-        volume_mock.create_time = "01.01.2015"
-        volume_mock.region = self.positive_fake_region
-        volume_mock.status = "OK"
+        volume_mock = {
+            'VolumeId': VOLUME_ID,
+            'CreateTime': "01.01.2015",
+            'State': "available"
+        }
 
-        self.ec2_mock.connect_to_region.return_value.get_all_volumes.return_value = [volume_mock]
+        self.client.get_paginator.return_value.paginate.return_value = [{'Volumes': [volume_mock]}]
         return volume_mock
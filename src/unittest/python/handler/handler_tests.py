@@ -1,27 +1,31 @@
+import shutil
+import tempfile
+import threading
+import time
+import boto3
 import unittest2
 from mock import Mock, patch
-from monocyte.handler import Handler
+from monocyte import discovery
+from monocyte.deadline import DeadlineExceeded
+from monocyte.handler import Handler, REGION_QUEUE_SIZE, map_ordered
 
 
 class HandlerTest(unittest2.TestCase):
 
     def setUp(self):
-        self.identity_mock = Mock()
-        self.identity_mock.get.return_value = 'any account id'
-        self.sts_mock = Mock()
-        self.sts_mock.get_caller_identity.return_value = self.identity_mock
-        self.boto_mock = patch('monocyte.handler.boto3').start()
-        self.boto_mock.client.return_value = self.sts_mock
+        self.get_account_id_mock = patch('monocyte.handler.get_account_id').start()
+        self.get_account_id_mock.return_value = 'any account id'
 
         def mock_region_filter():
             return True
         self.handler = TestHandler(mock_region_filter)
 
+    def tearDown(self):
+        patch.stopall()
+
     def test_get_account_id(self):
 
         account_id = self.handler.get_account_id()
-        self.boto_mock.client.assert_called_once_with('sts')
-        self.identity_mock.get.assert_called_once_with('Account')
 
         self.assertEqual('any account id', account_id)
 
@@ -34,8 +38,270 @@ class HandlerTest(unittest2.TestCase):
         self.handler.whitelist = {}
 
         self.assertEqual({}, self.handler.get_whitelist())
+        self.assertFalse(self.get_account_id_mock.called)
+
+    def test_get_whitelisted_arns_indexes_arns_with_reasons(self):
+        self.handler.whitelist = {'any account id': {'Arns': [{'Arn': 'arn:a', 'Reason': 'reason a'},
+                                                              {'Arn': 'arn:b'}]},
+                                  'other account id': {'Arns': [{'Arn': 'arn:c', 'Reason': 'reason c'}]}}
+
+        self.assertEqual({'arn:a': 'reason a', 'arn:b': None}, self.handler.get_whitelisted_arns())
+        self.assertTrue(self.handler.is_arn_whitelisted('arn:b'))
+        self.assertFalse(self.handler.is_arn_whitelisted('arn:c'))
+
+    def test_get_whitelisted_arns_is_built_once(self):
+        self.handler.whitelist = {'any account id': {'Arns': [{'Arn': 'arn:a', 'Reason': 'reason a'}]}}
+
+        for _ in range(3):
+            self.handler.is_arn_whitelisted('arn:a')
+
+        self.assertEqual(self.get_account_id_mock.call_count, 1)
+
+    def test_setting_whitelist_rebuilds_index(self):
+        self.handler.whitelist = {'any account id': {'Arns': [{'Arn': 'arn:a'}]}}
+        self.assertTrue(self.handler.is_arn_whitelisted('arn:a'))
+
+        self.handler.whitelist = {'any account id': {'Arns': [{'Arn': 'arn:b'}]}}
+
+        self.assertFalse(self.handler.is_arn_whitelisted('arn:a'))
+        self.assertTrue(self.handler.is_arn_whitelisted('arn:b'))
+
+    def test_get_cache_shares_only_caches_that_are_not_per_account(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.handler.cache_dir = cache_dir
+        self.handler.get_cache('shared', per_account=False).set('key', 'value')
+        self.handler.get_cache('own').set('key', 'value')
+        self.get_account_id_mock.return_value = 'other account id'
+        other_handler = TestHandler(lambda: True, cache_dir=cache_dir)
+
+        self.assertEqual(other_handler.get_cache('shared', per_account=False).get('key'), 'value')
+        self.assertIsNone(other_handler.get_cache('own').get('key'))
+
+    def test_fetch_in_regions_keeps_region_order(self):
+        self.handler.region_names = ['region-a', 'region-b', 'region-c']
+        delays = {'region-a': 0.05, 'region-b': 0.0, 'region-c': 0.02}
+
+        def fetch_region(region_name):
+            time.sleep(delays[region_name])
+            return [region_name + '-1', region_name + '-2']
+
+        resources = list(self.handler.fetch_in_regions(fetch_region))
+
+        self.assertEqual(resources, ['region-a-1', 'region-a-2', 'region-b-1', 'region-b-2',
+                                     'region-c-1', 'region-c-2'])
+
+    def test_fetch_in_regions_propagates_exceptions(self):
+        self.handler.region_names = ['region-a']
+
+        def fetch_region(region_name):
+            raise ValueError(region_name)
+
+        self.assertRaises(ValueError, list, self.handler.fetch_in_regions(fetch_region))
+
+    def test_fetch_in_regions_keeps_partial_results_of_regions_out_of_time(self):
+        self.handler.region_names = ['region-a', 'region-b']
+        self.handler.region_timeout = 0.05
+
+        def fetch_region(region_name):
+            yield region_name + '-1'
+            if region_name == 'region-a':
+                time.sleep(0.1)
+            yield region_name + '-2'
+            yield region_name + '-3'
+
+        resources = list(self.handler.fetch_in_regions(fetch_region))
+
+        self.assertEqual(resources, ['region-a-1', 'region-a-2', 'region-b-1', 'region-b-2', 'region-b-3'])
+        self.assertEqual([region_name for region_name, _ in self.handler.incomplete_regions], ['region-a'])
+
+    def test_fetch_in_regions_streams_resources_while_regions_are_listed(self):
+        self.handler.region_names = ['region-a']
+        release = threading.Event()
+
+        def fetch_region(region_name):
+            yield 'first'
+            release.wait(5)
+            yield 'second'
+
+        resources = self.handler.fetch_in_regions(fetch_region)
+
+        self.assertEqual(next(resources), 'first')
+        release.set()
+        self.assertEqual(list(resources), ['second'])
+
+    def test_fetch_in_regions_stops_listing_when_nobody_reads(self):
+        self.handler.region_names = ['region-a', 'region-b', 'region-c']
+        self.handler.region_workers = 2
+        listed = dict((region_name, []) for region_name in self.handler.region_names)
+
+        def fetch_region(region_name):
+            for number in range(10000):
+                listed[region_name].append(number)
+                yield number
+
+        resources = self.handler.fetch_in_regions(fetch_region)
+        next(resources)
+        time.sleep(0.1)
+
+        self.assertTrue(len(listed['region-a']) <= REGION_QUEUE_SIZE + 2)
+        self.assertTrue(len(listed['region-b']) <= REGION_QUEUE_SIZE + 1)
+        self.assertEqual(listed['region-c'], [])
+        resources.close()
+
+    def test_paginate_stops_at_deadline(self):
+        client = Mock()
+        client.get_paginator.return_value.paginate.return_value = [{'Items': [1]}, {'Items': [2]}]
+        items = self.handler.paginate(client, 'list_items', 'Items')
+
+        self.assertEqual(next(items), 1)
+        self.handler.deadline.cancel()
+        self.assertRaises(DeadlineExceeded, next, items)
+
+    def test_paginate_yields_items_of_all_pages_lazily(self):
+        pages_read = []
+
+        def pages(**kwargs):
+            for page in [{'Items': [1, 2]}, {'Items': [3]}, {}]:
+                pages_read.append(page)
+                yield page
+        client = Mock()
+        client.get_paginator.return_value.paginate.side_effect = pages
+
+        items = self.handler.paginate(client, 'list_items', 'Items', Filter='any')
+
+        self.assertEqual(next(items), 1)
+        self.assertEqual(len(pages_read), 1)
+        self.assertEqual(list(items), [2, 3])
+        client.get_paginator.assert_called_once_with('list_items')
+        client.get_paginator.return_value.paginate.assert_called_once_with(Filter='any')
+
+    def get_paginator(self, service_name, operation_name):
+        client = boto3.client(service_name, region_name='us-east-1', aws_access_key_id='any',
+                              aws_secret_access_key='any')
+        paginator = client.get_paginator(operation_name)
+        paginator.paginate = Mock(return_value=[])
+        return paginator
+
+    def test_paginate_uses_configured_page_size(self):
+        self.handler.page_size = 50
+        client = Mock()
+        client.get_paginator.return_value = self.get_paginator('ec2', 'describe_volumes')
+
+        list(self.handler.paginate(client, 'describe_volumes', 'Volumes'))
+
+        client.get_paginator.return_value.paginate.assert_called_once_with(PaginationConfig={'PageSize': 50})
+
+    def test_paginate_uses_service_default_for_operations_without_page_size(self):
+        self.handler.page_size = 100
+        client = Mock()
+        client.get_paginator.return_value = self.get_paginator('cloudformation', 'list_stacks')
+
+        list(self.handler.paginate(client, 'list_stacks', 'StackSummaries', StackStatusFilter=['CREATE_COMPLETE']))
+
+        client.get_paginator.return_value.paginate.assert_called_once_with(StackStatusFilter=['CREATE_COMPLETE'])
+
+
+class TaggingDiscoveryTest(unittest2.TestCase):
+    def setUp(self):
+        self.fetch_inventory_mock = patch('monocyte.handler.discovery.fetch_inventory').start()
+        self.fetch_inventory_mock.side_effect = lambda region_name, page_size: {
+            'region-a': {'test:item': ['arn:a']}, 'region-b': {'other:item': ['arn:b']}}[region_name]
+        self.handler = TestHandler(lambda region_name: True, discovery_mode=discovery.TAGGING_DISCOVERY)
+        self.handler.region_names = ['region-a', 'region-b']
+        patch.dict(discovery.HANDLER_RESOURCE_TYPES, {self.handler.name: 'test:item'}).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_skips_regions_without_tagged_resources(self):
+        self.assertEqual(list(self.handler.fetch_unwanted_resources()), ['region-a-item'])
+
+    def test_remembers_skipped_regions_without_reporting_them_as_incomplete(self):
+        list(self.handler.fetch_unwanted_resources())
+
+        self.assertEqual(self.handler.skipped_regions, ['region-b'])
+        self.assertEqual(self.handler.incomplete_regions, [])
+
+    def test_inventory_is_shared_by_the_handlers_of_a_run(self):
+        other_handler = TestHandler(lambda region_name: True, discovery_mode=discovery.TAGGING_DISCOVERY,
+                                    snapshots=self.handler.snapshots)
+        other_handler.region_names = self.handler.region_names
+
+        list(self.handler.fetch_unwanted_resources())
+        list(other_handler.fetch_unwanted_resources())
+
+        self.assertEqual(self.fetch_inventory_mock.call_count, 2)
+
+    def test_service_discovery_sweeps_all_regions(self):
+        self.handler.discovery_mode = discovery.SERVICE_DISCOVERY
+
+        self.assertEqual(list(self.handler.fetch_unwanted_resources()), ['region-a-item', 'region-b-item'])
+        self.assertFalse(self.fetch_inventory_mock.called)
+        self.assertEqual(self.handler.incomplete_regions, [])
+
+    def test_sweeps_region_if_tagging_api_fails(self):
+        self.fetch_inventory_mock.side_effect = Exception("AccessDenied")
+
+        self.assertEqual(list(self.handler.fetch_unwanted_resources()), ['region-a-item', 'region-b-item'])
+
+    def test_rejects_unknown_discovery_mode(self):
+        self.assertRaises(ValueError, TestHandler, lambda region_name: True, discovery_mode='guessing')
+
+
+class MapOrderedTest(unittest2.TestCase):
+    def test_returns_results_in_order_of_items(self):
+        self.assertEqual(list(map_ordered(lambda x: x * 2, [3, 1, 2], 2)), [6, 2, 4])
+
+    def test_returns_nothing_for_no_items(self):
+        self.assertEqual(list(map_ordered(lambda x: x, [], 2)), [])
+
+    def test_runs_items_concurrently(self):
+        started = threading.Event()
+
+        def wait_for_other(item):
+            if item == 'first':
+                return started.wait(5)
+            started.set()
+            return True
+
+        self.assertEqual(list(map_ordered(wait_for_other, ['first', 'second'], 2)), [True, True])
+
+    def test_never_uses_more_than_max_workers(self):
+        lock = threading.Lock()
+        running = []
+        maximum = []
+
+        def track(item):
+            with lock:
+                running.append(item)
+                maximum.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(item)
+
+        list(map_ordered(track, range(10), 3))
+
+        self.assertTrue(max(maximum) <= 3)
+
+    def test_takes_items_as_workers_become_free(self):
+        taken = []
+
+        def items():
+            for item in range(100):
+                taken.append(item)
+                yield item
+
+        results = map_ordered(lambda x: x, items(), 3)
+
+        self.assertEqual(next(results), 0)
+        self.assertEqual(taken, [0, 1, 2, 3])
+        results.close()
 
 
 class TestHandler(Handler):
     def fetch_region_names(self):
         return []
+
+    def _fetch_unwanted_resources(self, region_name):
+        return [region_name + '-item']
@@ -1,27 +1,45 @@
 from __future__ import print_function, absolute_import, division
 
+import datetime
 import os
 import unittest2
+from dateutil.tz import tzutc
+from monocyte.deadline import DeadlineExceeded
 from monocyte.handler import Resource
 from mock import patch, MagicMock
 from monocyte.handler.iam import User, InlinePolicy
-from monocyte.handler.iam import IamPolicy, Policy
+from monocyte.handler.iam import IamPolicy, Policy, AUTHORIZATION_DETAILS_FILTER
+from monocyte.snapshots import RunSnapshots
 
 os.environ['http_proxy'] = ''
 os.environ['https_proxy'] = ''
 os.environ['no_proxy'] = ''
 
 
+def paginate_list_calls(client_mock):
+    """Serve each paginator from the mocked list call of the same name, as one page."""
+    def get_paginator(operation_name):
+        paginator = MagicMock()
+        paginator.paginate.side_effect = lambda **kwargs: [getattr(client_mock, operation_name)(**kwargs)]
+        return paginator
+    client_mock.get_paginator.side_effect = get_paginator
+
+
+def authorization_details(users=(), roles=(), policies=()):
+    return {'UserDetailList': list(users), 'RoleDetailList': list(roles), 'Policies': list(policies)}
+
+
 class AwsIamUserHandlerTest(unittest2.TestCase):
     def setUp(self):
         def mock_region_filter(ignore):
             return True
 
         self.user_handler = User(mock_region_filter)
-        self.boto3Mock = patch("monocyte.handler.iam.boto3").start()
+        self.get_client_mock = patch("monocyte.handler.iam.get_client").start()
+        patch("monocyte.handler.get_account_id", return_value='123456789012').start()
         self.iamMock = MagicMock()
-        self.iamMock.list_users.return_value = {'Users': []}
-        self.boto3Mock.client.return_value = self.iamMock
+        paginate_list_calls(self.iamMock)
+        self.get_client_mock.return_value = self.iamMock
         self.user_arn = 'arn:aws:iam::123456789:user/test1'
         self.user = {
             'UserName': 'test1',
@@ -29,23 +47,50 @@ class AwsIamUserHandlerTest(unittest2.TestCase):
             'CreateDate': '2016-11-29'
         }
 
-        self.iamMock.list_users.return_value = {'Users': [self.user]}
+        self.iamMock.get_account_authorization_details.return_value = authorization_details(users=[self.user])
 
         def mock_whitelist():
             return {}
 
         self.user_handler.get_whitelist = mock_whitelist
 
+    def tearDown(self):
+        patch.stopall()
+
     def test_get_users_returns_users(self):
-        self.iamMock.list_users.return_value = {'Users': ['Klaus']}
+        self.iamMock.get_account_authorization_details.return_value = authorization_details(users=['Klaus'])
 
-        users = self.user_handler.get_users()
+        users = list(self.user_handler.get_users())
 
-        self.boto3Mock.client.assert_called_once_with('iam')
+        self.get_client_mock.assert_called_once_with('iam')
+        self.iamMock.get_account_authorization_details.assert_called_once_with(Filter=AUTHORIZATION_DETAILS_FILTER)
         self.assertEqual(users, ['Klaus'])
 
+    def test_snapshot_is_shared_between_iam_handlers_of_a_run(self):
+        self.user_handler.snapshots = RunSnapshots()
+        policy_handler = InlinePolicy(lambda region_name: True, snapshots=self.user_handler.snapshots)
+
+        list(self.user_handler.fetch_unwanted_resources())
+        list(policy_handler.fetch_unwanted_resources())
+
+        self.assertEqual(self.iamMock.get_account_authorization_details.call_count, 1)
+
+    def test_snapshot_is_fetched_again_in_a_new_run(self):
+        list(self.user_handler.fetch_unwanted_resources())
+        self.iamMock.get_account_authorization_details.return_value = authorization_details()
+        next_run_handler = User(lambda region_name: True)
+
+        self.assertEqual(list(next_run_handler.fetch_unwanted_resources()), [])
+        self.assertEqual(self.iamMock.get_account_authorization_details.call_count, 2)
+
+    def test_snapshot_is_not_fetched_after_the_deadline(self):
+        self.user_handler.deadline.cancel()
+
+        self.assertRaises(DeadlineExceeded, list, self.user_handler.fetch_unwanted_resources())
+        self.assertFalse(self.iamMock.get_account_authorization_details.called)
+
     def test_fetch_unwanted_resources_returns_empty_generator_if_users_are_empty(self):
-        self.iamMock.list_users.return_value = {'Users': []}
+        self.iamMock.get_account_authorization_details.return_value = authorization_details()
         unwanted_users = self.user_handler.fetch_unwanted_resources()
         self.assertEqual(len(list(unwanted_users)), 0)
 
@@ -82,6 +127,83 @@ class AwsIamUserHandlerTest(unittest2.TestCase):
 
         self.assertEqual(len(list(unwanted_users)), 0)
 
+
+CREDENTIAL_REPORT_HEADER = ("user,arn,user_creation_time,password_enabled,"
+                            "access_key_1_active,access_key_1_last_rotated,access_key_1_last_used_date,"
+                            "access_key_2_active,access_key_2_last_rotated,access_key_2_last_used_date")
+
+
+def credential_report_row(name, password_enabled='false', key_1=('false', 'N/A', 'N/A'), key_2=('false', 'N/A', 'N/A')):
+    arn = 'arn:aws:iam::123456789012:root' if name == '<root_account>' else 'arn:aws:iam::123456789012:user/' + name
+    return ",".join((name, arn, '2015-01-01T00:00:00+00:00', password_enabled) + key_1 + key_2)
+
+
+def days_ago(days):
+    return (datetime.datetime.now(tzutc()) - datetime.timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+class AwsIamUserCredentialReportTest(unittest2.TestCase):
+    def setUp(self):
+        self.get_client_mock = patch("monocyte.handler.iam.get_client").start()
+        self.sleep_mock = patch("monocyte.handler.iam.time.sleep").start()
+        self.iamMock = self.get_client_mock.return_value
+        self.iamMock.generate_credential_report.return_value = {'State': 'COMPLETE'}
+        report = "\n".join([
+            CREDENTIAL_REPORT_HEADER,
+            credential_report_row('<root_account>', password_enabled='not_supported'),
+            credential_report_row('nothing'),
+            credential_report_row('console', password_enabled='true'),
+            credential_report_row('fresh', key_1=('true', days_ago(10), days_ago(1))),
+            credential_report_row('stale', key_2=('true', days_ago(400), 'N/A')),
+            credential_report_row('idle', key_1=('true', days_ago(30), days_ago(200)))])
+        self.iamMock.get_credential_report.return_value = {'Content': report.encode('utf-8')}
+        self.user_handler = User(lambda region_name: True, use_credential_report=True)
+        self.user_handler.get_whitelist = lambda: {}
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_only_users_with_static_credentials_are_reported(self):
+        resources = list(self.user_handler.fetch_unwanted_resources())
+
+        self.assertEqual([resource.resource_id.split('/')[-1] for resource in resources],
+                         ['console', 'fresh', 'stale', 'idle'])
+        self.assertEqual(resources[0].creation_date, datetime.datetime(2015, 1, 1, tzinfo=tzutc()))
+        self.assertFalse(self.iamMock.list_users.called)
+        self.assertFalse(self.iamMock.list_access_keys.called)
+
+    def test_keys_are_classified_by_age_and_last_use(self):
+        resources = dict((resource.resource_id.split('/')[-1], resource.reason)
+                         for resource in self.user_handler.fetch_unwanted_resources())
+
+        self.assertIn("console password enabled", resources['console'])
+        self.assertIn("active access key 1.", resources['fresh'])
+        self.assertIn("active access key 2 (400 days old, never used)", resources['stale'])
+        self.assertIn("active access key 1 (unused for 200 days)", resources['idle'])
+
+    def test_ignored_users_are_skipped(self):
+        self.user_handler.ignored_resources = ['arn:aws:iam::123456789012:user/stale']
+
+        resources = list(self.user_handler.fetch_unwanted_resources())
+
+        self.assertEqual(len(resources), 3)
+
+    def test_report_generation_is_awaited(self):
+        self.iamMock.generate_credential_report.side_effect = [{'State': 'STARTED'}, {'State': 'INPROGRESS'},
+                                                               {'State': 'COMPLETE'}]
+
+        list(self.user_handler.fetch_unwanted_resources())
+
+        self.assertEqual(self.sleep_mock.call_count, 2)
+
+    def test_report_generation_is_not_awaited_after_the_deadline(self):
+        self.iamMock.generate_credential_report.return_value = {'State': 'INPROGRESS'}
+        self.sleep_mock.side_effect = lambda seconds: self.user_handler.deadline.cancel()
+
+        self.assertRaises(DeadlineExceeded, list, self.user_handler.fetch_unwanted_resources())
+        self.assertEqual(self.iamMock.generate_credential_report.call_count, 1)
+
+
 class PolicyTests(unittest2.TestCase):
     class_to_test = Policy
     reason = "Please follow the principal of least privilege and do not use Action : *"
@@ -89,11 +211,11 @@ class PolicyTests(unittest2.TestCase):
         def mock_region_filter(ignore):
             return True
 
-        self.boto3Mock = patch("monocyte.handler.iam.boto3").start()
+        self.get_client_mock = patch("monocyte.handler.iam.get_client").start()
+        patch("monocyte.handler.get_account_id", return_value='123456789012').start()
         self.iamClientMock = MagicMock()
-        self.boto3Mock.client.return_value = self.iamClientMock
-        self.iamResourceMock = MagicMock()
-        self.boto3Mock.resource.return_value = self.iamResourceMock
+        paginate_list_calls(self.iamClientMock)
+        self.get_client_mock.return_value = self.iamClientMock
         self.policy_handler = self.class_to_test(mock_region_filter)
 
         def mock_whitelist():
@@ -101,55 +223,15 @@ class PolicyTests(unittest2.TestCase):
 
         self.policy_handler.get_whitelist = mock_whitelist
 
-    def test_check_action_for_forbidden_string_returns_false_for_no_wildcard(self):
-        actions = ['is3:s3', 's23:333']
-        self.assertFalse(self.policy_handler.check_policy_action_for_forbidden_string(actions))
-
-    def test_check_action_for_forbidden_string_returns_true_for_one_wildcard(self):
-        actions = ['*', 's23:333']
-        self.assertTrue(self.policy_handler.check_policy_action_for_forbidden_string(actions))
+    def tearDown(self):
+        patch.stopall()
 
-    def test_check_action_for_forbidden_string_returns_true_for_two_wildcard(self):
-        actions = ['*:*', 's23:333']
-        self.assertTrue(self.policy_handler.check_policy_action_for_forbidden_string(actions))
+    def _given_policy_document(self, document):
+        self.iamClientMock.get_policy_version.return_value = {'PolicyVersion': {'Document': document}}
 
-    def test_gather_actions_returns_list_for_action_list(self):
-        policy_document = {'Statement': [{'Action': ['logs:CreateLogGroup', 'logs:foobar'],
-                                            'Effect': 'Allow',
-                                            'Resource': 'arn:aws:logs::*'}]}
-        expected_list = ['logs:CreateLogGroup', 'logs:foobar']
-        self.assertEqual(expected_list, self.policy_handler.gather_actions(policy_document))
-
-    def test_gather_actions_returns_list_for_action_string(self):
-        policy_document = {'Statement': [{'Action': 'logs:CreateLogGroup',
-                                          'Effect': 'Allow',
-                                          'Resource': 'arn:aws:logs::*'}]}
-        expected_list = ['logs:CreateLogGroup']
-        self.assertEqual(expected_list, self.policy_handler.gather_actions(policy_document))
-
-    def test_gather_actions_returns_list_for_multiple_action_string(self):
-        policy_document = {'Statement': [{'Action': 'logs:CreateLogGroup',
-                                          'Effect': 'Allow',
-                                          'Resource': 'arn:aws:logs::*'},
-                                         {'Action': 'logs2:CreateLogGroup',
-                                          'Effect': 'Allow',
-                                          'Resource': 'arn:aws:logs::*'}]}
-        expected_list = ['logs:CreateLogGroup', 'logs2:CreateLogGroup']
-        self.assertEqual(expected_list, self.policy_handler.gather_actions(policy_document))
-
-    def test_gather_actions_returns_list_for_statement_no_list_but_action(self):
-        policy_document = {'Statement': {'Action':['logs:CreateLogGroup', 'ec2:Attach'],
-                                          'Effect': 'Allow',
-                                          'Resource': 'arn:aws:logs::*'}}
-        expected_list = ['logs:CreateLogGroup', 'ec2:Attach']
-        self.assertEqual(expected_list, self.policy_handler.gather_actions(policy_document))
-
-    def test_gather_actions_returns_list_for_statement_no_list_and_action_no_list(self):
-        policy_document = {'Statement': {'Action': 'ec2:Attach',
-                                         'Effect': 'Allow',
-                                         'Resource': 'arn:aws:logs::*'}}
-        expected_list = ['ec2:Attach']
-        self.assertEqual(expected_list, self.policy_handler.gather_actions(policy_document))
+    def _given_role_with_inline_policy(self, role, document):
+        role['RolePolicyList'] = [{'PolicyName': 'policy-0', 'PolicyDocument': document}]
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details(roles=[role])
 
     def test_is_arn_in_whitelist_empty_whitelist(self):
         self.policy_handler.whitelist = {}
@@ -165,29 +247,26 @@ class PolicyTests(unittest2.TestCase):
 class IamPolicyTest(PolicyTests):
     class_to_test = IamPolicy
     def test_get_policies_return_policies(self):
-        self.iamClientMock.list_policies.return_value = {'IsTruncated': False,
-                                                         'Policies': [{'Arn': 'arn:aws:iam:123456789'}]}
-        policies = self.policy_handler.get_policies()
-        self.boto3Mock.client.assert_called_once_with('iam')
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details(
+            policies=[{'Arn': 'arn:aws:iam:123456789'}])
+        policies = list(self.policy_handler.get_policies())
+        self.get_client_mock.assert_called_once_with('iam')
         self.assertEqual(policies, [{'Arn': 'arn:aws:iam:123456789'}])
 
     def test_get_policy_document_return_document(self):
-        policyVersionMock = MagicMock(document={'Statement': [{'Action': ['s3:test3', 's4:test4']}]})
-        self.iamResourceMock.PolicyVersion.return_value = policyVersionMock
+        self._given_policy_document({'Statement': [{'Action': ['s3:test3', 's4:test4']}]})
         document = self.policy_handler.get_policy_document('arn', 'version')
-        self.boto3Mock.resource.assert_called_once_with('iam')
+        self.iamClientMock.get_policy_version.assert_called_once_with(PolicyArn='arn', VersionId='version')
         self.assertEqual(document, {'Statement': [{'Action': ['s3:test3', 's4:test4']}]})
 
     def test_fetch_unwanted_resources_returns_empty_if_no_policies(self):
-        policyVersionMock = MagicMock(document={})
-        self.iamResourceMock.PolicyVersion.return_value = policyVersionMock
-        self.iamClientMock.list_policies.return_value = {'IsTruncated': False, 'Policies': []}
+        self._given_policy_document({})
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details()
         self.assertEqual(len(list(self.policy_handler.fetch_unwanted_resources())), 0)
 
     def test_fetch_unwanted_resources_returns_true_if_forbidden_action(self):
         iam_policy = 'iam.IamPolicy'
-        policyVersionMock = MagicMock(document={'Statement': [{'Action': ['s3:test3', '*:*'], 'Resource': 'aws:s2222'}]})
-        self.iamResourceMock.PolicyVersion.return_value = policyVersionMock
+        self._given_policy_document({'Statement': [{'Action': ['s3:test3', '*:*'], 'Resource': 'aws:s2222'}]})
         policy = {'IsTruncated': False,
                   'Policies': [{'Arn': 'arn:aws:iam:123456789', 'DefaultVersionId': 'v1', 'CreateDate': '2012-06-12'}]}
         expected_unwanted_user = Resource(resource=policy['Policies'][0],
@@ -196,146 +275,132 @@ class IamPolicyTest(PolicyTests):
                                           creation_date=policy['Policies'][0]['CreateDate'],
                                           region='global', reason=self.reason)
 
-        self.iamClientMock.list_policies.return_value = policy
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details(
+            policies=policy['Policies'])
         unwanted_resource = self.policy_handler.fetch_unwanted_resources()
         self.assertEqual(list(unwanted_resource)[0], expected_unwanted_user)
 
     def test_fetch_unwanted_resources_returns_false_if_no_forbidden_action(self):
-        policyVersionMock = MagicMock(document={'Statement': [{'Action': ['s3:test3', 's*:s*'], 'Resource': 'aws:s2222'}]})
-        self.iamResourceMock.PolicyVersion.return_value = policyVersionMock
+        self._given_policy_document({'Statement': [{'Action': ['s3:test3', 's*:s*'], 'Resource': 'aws:s2222'}]})
         policy = {'IsTruncated': False,
                   'Policies': [{'Arn': 'arn:aws:iam:123456789', 'DefaultVersionId': 'v1', 'CreateDate': '2012-06-12'}]}
 
-        self.iamClientMock.list_policies.return_value = policy
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details(
+            policies=policy['Policies'])
         unwanted_resource = self.policy_handler.fetch_unwanted_resources()
         self.assertEqual(len(list(unwanted_resource)),0)
 
+    def test_fetch_unwanted_resources_uses_default_version_of_snapshot(self):
+        policy = {'Arn': 'arn:aws:iam:123456789', 'DefaultVersionId': 'v2', 'CreateDate': '2012-06-12',
+                  'PolicyVersionList': [
+                      {'VersionId': 'v1', 'IsDefaultVersion': False,
+                       'Document': {'Statement': [{'Action': 's3:test3'}]}},
+                      {'VersionId': 'v2', 'IsDefaultVersion': True,
+                       'Document': {'Statement': [{'Action': '*'}]}}]}
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details(policies=[policy])
+
+        unwanted_resources = list(self.policy_handler.fetch_unwanted_resources())
+
+        self.assertEqual([resource.resource_id for resource in unwanted_resources], [policy['Arn']])
+        self.iamClientMock.get_policy_version.assert_not_called()
+
+    def test_policy_versions_are_not_read_after_the_deadline(self):
+        policies = [{'Arn': 'arn:aws:iam:%d' % i, 'DefaultVersionId': 'v1', 'CreateDate': '2012-06-12'}
+                    for i in range(3)]
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details(policies=policies)
+        self.policy_handler.get_authorization_details()
+        self.policy_handler.deadline.cancel()
+
+        self.assertRaises(DeadlineExceeded, list, self.policy_handler.fetch_unwanted_resources())
+        self.iamClientMock.get_policy_version.assert_not_called()
+
+    def test_identical_documents_are_analyzed_once(self):
+        statement = {'Statement': [{'Effect': 'Allow', 'Action': '*'}]}
+        policies = [{'Arn': 'arn:aws:iam:%d' % i, 'CreateDate': '2012-06-12',
+                     'PolicyVersionList': [{'VersionId': 'v1', 'IsDefaultVersion': True, 'Document': statement}]}
+                    for i in range(3)]
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details(policies=policies)
+
+        unwanted_resources = list(self.policy_handler.fetch_unwanted_resources())
+
+        self.assertEqual(len(unwanted_resources), 3)
+        self.assertEqual((self.policy_handler.analyzer.misses, self.policy_handler.analyzer.hits), (1, 2))
 
 
 class InlinePolicyTest(PolicyTests):
     class_to_test = InlinePolicy
 
     def test_get_iam_role_name_return_role_name(self):
-        self.iamClientMock.list_roles.return_value = {'Roles': [{'Arn': 'arn:aws:iam::123456789101:role/foo-bar-file',
-                                                                 'AssumeRolePolicyDocument': {
-                                                                     'Statement': [{'Action': 'sts:AssumeRole',
-                                                                                     'Effect': 'Allow',
-                                                                                     'Principal': {
-                                                                                         'AWS': 'arn:aws:iam::9876543210:root'},
-                                                                                     'Sid': ''}],
-                                                                     'Version': '2012-10-17'},
-                                                                 'CreateDate': '01.01.1989',
-                                                                 'Path': '/',
-                                                                 'RoleId': 'FOOAJ4DHXC5V55TMCIBAR',
-                                                                 'RoleName': 'foo-bar-file'}]}
-        role = self.policy_handler.get_all_iam_roles_in_account()
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details(roles=[
+            {'Arn': 'arn:aws:iam::123456789101:role/foo-bar-file',
+             'AssumeRolePolicyDocument': {
+                 'Statement': [{'Action': 'sts:AssumeRole',
+                                'Effect': 'Allow',
+                                'Principal': {
+                                    'AWS': 'arn:aws:iam::9876543210:root'},
+                                'Sid': ''}],
+                 'Version': '2012-10-17'},
+             'CreateDate': '01.01.1989',
+             'Path': '/',
+             'RoleId': 'FOOAJ4DHXC5V55TMCIBAR',
+             'RoleName': 'foo-bar-file'}])
+        role = list(self.policy_handler.get_all_iam_roles_in_account())
         self.assertEqual(role[0]['RoleName'], 'foo-bar-file')
 
     def test_get_iam_role_names_return_role_names(self):
-        self.iamClientMock.list_roles.return_value = {'Roles': [{'Arn': 'arn:aws:iam::123456789101:role/foo-bar-file',
-                                                                 'AssumeRolePolicyDocument': {
-                                                                     'Statement': [{'Action': 'sts:AssumeRole',
-                                                                                     'Effect': 'Allow',
-                                                                                     'Principal': {
-                                                                                         'AWS': 'arn:aws:iam::9876543210:root'},
-                                                                                     'Sid': ''}],
-                                                                     'Version': '2012-10-17'},
-                                                                 'CreateDate': '01.01.1989',
-                                                                 'Path': '/',
-                                                                 'RoleId': 'FOOAJ4DHXC5V55TMCIBAR',
-                                                                 'RoleName': 'foo-bar-file'},
-                                                                {'Arn': 'arn:aws:iam::66666666666:role/foo-foo-foo',
-                                                                 'AssumeRolePolicyDocument': {
-                                                                     'Statement': [{'Action': 'sts:AssumeRole',
-                                                                                     'Effect': 'Allow',
-                                                                                     'Principal': {
-                                                                                         'Service': 'lambda.amazonaws.com'}}],
-                                                                     'Version': '2012-10-17'},
-                                                                 'CreateDate': '01.01.1970',
-                                                                 'Path': '/',
-                                                                 'RoleId': 'HSKASODO2S80SDDAD',
-                                                                 'RoleName': 'foo-foo-key'}]}
+        self.iamClientMock.get_account_authorization_details.return_value = authorization_details(roles=[
+            {'Arn': 'arn:aws:iam::123456789101:role/foo-bar-file',
+             'AssumeRolePolicyDocument': {
+                 'Statement': [{'Action': 'sts:AssumeRole',
+                                'Effect': 'Allow',
+                                'Principal': {
+                                    'AWS': 'arn:aws:iam::9876543210:root'},
+                                'Sid': ''}],
+                 'Version': '2012-10-17'},
+             'CreateDate': '01.01.1989',
+             'Path': '/',
+             'RoleId': 'FOOAJ4DHXC5V55TMCIBAR',
+             'RoleName': 'foo-bar-file'},
+            {'Arn': 'arn:aws:iam::66666666666:role/foo-foo-foo',
+             'AssumeRolePolicyDocument': {
+                 'Statement': [{'Action': 'sts:AssumeRole',
+                                'Effect': 'Allow',
+                                'Principal': {
+                                    'Service': 'lambda.amazonaws.com'}}],
+                 'Version': '2012-10-17'},
+             'CreateDate': '01.01.1970',
+             'Path': '/',
+             'RoleId': 'HSKASODO2S80SDDAD',
+             'RoleName': 'foo-foo-key'}])
         role_names = self.policy_handler.get_all_iam_roles_in_account()
         roles = []
         for role in role_names:
             roles.append(role['RoleName'])
         self.assertEqual(roles, ['foo-bar-file', 'foo-foo-key'])
 
-    def test_get_all_inline_policies_for_role_returns_empty_list_for_no_inline_policies(self):
-        role_name = ''
-        role_object = MagicMock()
-        role_policy_object = MagicMock()
-        self.iamResourceMock.Role.return_value = role_object
-        role_object.policies.all.return_value = role_policy_object
-
-        role_policies = self.policy_handler.get_all_inline_policies_for_role(role_name)
-        role_object.policies.all.assert_called_once()
-        self.iamResourceMock.Role.assert_called_once()
-        role_policy_object.assert_not_called()
-
-        self.assertEqual(role_policies, [])
-
-    def test_get_all_inline_policies_for_role_returns_inline_policy(self):
-        role_name = 'foo-bar-file'
-        role_mock = MagicMock()
-        self.iamResourceMock.Role.return_value = role_mock
-        role_mock.policies.all.return_value = [42]
-
-        role_policies = self.policy_handler.get_all_inline_policies_for_role(role_name)
-        self.assertEqual(role_policies, [42])
-
-    def test_check_inline_policy_action_for_forbidden_string_returns_false_if_string_not_found(self):
-        policy_document = "S3:foo"
-        return_value = self.policy_handler.check_policy_action_for_forbidden_string(policy_document)
-        self.assertFalse(return_value)
-
-    def test_check_inline_policy_action_for_forbidden_string_returns_false_if_policiy_list_not_found(self):
-        policy_document = ['S3:foo', 's3:bar']
-        return_value = self.policy_handler.check_policy_action_for_forbidden_string(policy_document)
-        self.assertFalse(return_value)
-
-    def test_check_inline_policy_action_for_forbidden_string_returns_true_if_string_found(self):
-        policy_document = "*:*"
-        return_value = self.policy_handler.check_policy_action_for_forbidden_string(policy_document)
-        self.assertTrue(return_value)
-
-    def test_check_inline_policy_action_for_forbidden_string_returns_true_if_policy_list_found(self):
-        policy_document = ['*:*', 's3:3']
-        return_value = self.policy_handler.check_policy_action_for_forbidden_string(policy_document)
-        self.assertTrue(return_value)
-
     def test_fetch_unwanted_resources_returns_empty_if_no_role_found(self):
         self.assertEqual(len(list(self.policy_handler.fetch_unwanted_resources())), 0)
 
     def test_fetch_unwanted_resources_return_false_if_elb_in_action(self):
-        role_mock = MagicMock(arn='arn:aws:iam::123456789101:role/foo-bar-file',create_date='01.01.1989', role_name='foo-bar-file')
-        list_role_mock = {'Roles': [role_mock]}
-        self.iamClientMock.list_roles.return_value = list_role_mock
-
-        policy_mock = MagicMock(policy_document={'Statement': [{'Action': ['elasticloadbalancing:test3', 's3:test1'], 'Resource': ['arn:aws:s3:::test3']}]})
-        role_mock.policies.all.return_value = [policy_mock]
-
-        self.iamResourceMock.Role.return_value = role_mock
+        role_mock = {'Arn': 'arn:aws:iam::123456789101:role/foo-bar-file', 'CreateDate': '01.01.1989',
+                     'RoleName': 'foo-bar-file'}
+        document = {'Statement': [{'Action': ['elasticloadbalancing:test3', 's3:test1'], 'Resource': ['arn:aws:s3:::test3']}]}
+        self._given_role_with_inline_policy(role_mock, document)
 
         unwanted_resource = self.policy_handler.fetch_unwanted_resources()
         self.assertEqual(len(list(unwanted_resource)), 0)
 
     def test_fetch_unwanted_resources_return_false_if_action_string_not_found(self):
-        role_mock = MagicMock(arn='arn:aws:iam::123456789101:role/foo-bar-file',create_date='01.01.1989', role_name='foo-bar-file')
-        list_role_mock = {'Roles': [role_mock]}
-        self.iamClientMock.list_roles.return_value = list_role_mock
-
-        policy_mock = MagicMock(policy_document={'Statement': [{'Action': ['s4:test3', 's*:s*'], 'Resource': ['arn:aws:s3:::test3']}]})
-        role_mock.policies.all.return_value = [policy_mock]
-
-        self.iamResourceMock.Role.return_value = role_mock
+        role_mock = {'Arn': 'arn:aws:iam::123456789101:role/foo-bar-file', 'CreateDate': '01.01.1989',
+                     'RoleName': 'foo-bar-file'}
+        document = {'Statement': [{'Action': ['s4:test3', 's*:s*'], 'Resource': ['arn:aws:s3:::test3']}]}
+        self._given_role_with_inline_policy(role_mock, document)
 
         unwanted_resource = self.policy_handler.fetch_unwanted_resources()
         self.assertEqual(len(list(unwanted_resource)), 0)
 
     def test_fetch_unwanted_resources_return_true_if_action_string_found(self):
         inline_policy = 'iam.InlinePolicy'
-        role_mock = MagicMock()
         sample_role = {'Arn': 'arn:aws:iam::123456789101:role/foo-bar-file',
                        'AssumeRolePolicyDocument': {
                            'Statement': [{'Action': 'sts:AssumeRole',
@@ -348,13 +413,8 @@ class InlinePolicyTest(PolicyTests):
                        'Path': '/',
                        'RoleId': 'FOOAJ4DHXC5V55TMCIBAR',
                        'RoleName': 'foo-bar-file'}
-        list_role_mock = {'Roles': [sample_role]}
-        self.iamClientMock.list_roles.return_value = list_role_mock
-
-        policy_mock = MagicMock(policy_document={'Statement': [{'Action': ['s4:test3', '*:*'], 'Resource': ['arn:aws:s3:::test3']}]})
-        role_mock.policies.all.return_value = [policy_mock]
-
-        self.iamResourceMock.Role.return_value = role_mock
+        document = {'Statement': [{'Action': ['s4:test3', '*:*'], 'Resource': ['arn:aws:s3:::test3']}]}
+        self._given_role_with_inline_policy(sample_role, document)
         expected_unwanted_role = Resource(resource=sample_role,
                                           resource_type=inline_policy,
                                           resource_id=sample_role['Arn'],
@@ -365,10 +425,10 @@ class InlinePolicyTest(PolicyTests):
         unwanted_resource_list = list(unwanted_resource)
         self.assertEqual(len(list(unwanted_resource_list)), 1)
         self.assertEqual(expected_unwanted_role, unwanted_resource_list[0])
+        self.iamClientMock.get_role_policy.assert_not_called()
 
     def test_fetch_unwanted_resources_return_true_if_action_and_resource_string_found(self):
         inline_policy = 'iam.InlinePolicy'
-        role_mock = MagicMock()
         sample_role = {'Arn': 'arn:aws:iam::123456789101:role/foo-bar-file',
                        'AssumeRolePolicyDocument': {
                            'Statement': [{'Action': 'sts:AssumeRole',
@@ -381,13 +441,8 @@ class InlinePolicyTest(PolicyTests):
                        'Path': '/',
                        'RoleId': 'FOOAJ4DHXC5V55TMCIBAR',
                        'RoleName': 'foo-bar-file'}
-        list_role_mock = {'Roles': [sample_role]}
-        self.iamClientMock.list_roles.return_value = list_role_mock
-
-        policy_mock = MagicMock(policy_document={'Statement': [{'Action': ['elasticloadbalancing:test3', '*:*'], 'Resource': ['arn:aws:s3:::test3']}]})
-        role_mock.policies.all.return_value = [policy_mock]
-
-        self.iamResourceMock.Role.return_value = role_mock
+        document = {'Statement': [{'Action': ['elasticloadbalancing:test3', '*:*'], 'Resource': ['arn:aws:s3:::test3']}]}
+        self._given_role_with_inline_policy(sample_role, document)
         expected_unwanted_role = Resource(resource=sample_role,
                                           resource_type=inline_policy,
                                           resource_id=sample_role['Arn'],
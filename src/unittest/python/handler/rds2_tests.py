@@ -13,10 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import boto.rds2
-import boto.regioninfo
 from unittest import TestCase
-from mock import patch, Mock
+from mock import patch
 from monocyte.handler import rds2, Resource
 
 SNAPSHOT_IDENTIFIER = "mySnapshotIdentifier"
@@ -26,15 +24,15 @@ INSTANCE_IDENTIFIER = "myInstanceIdentifier"
 
 class RDSInstanceTest(TestCase):
     def setUp(self):
-        self.rds2_mock = patch("monocyte.handler.rds2.rds2").start()
+        self.get_client_mock = patch("monocyte.handler.rds2.get_client").start()
+        self.regions_mock = patch("monocyte.handler.rds2.get_available_regions").start()
+        self.client = self.get_client_mock.return_value
         self.instance_mock = self._given_instance_mock()
 
-        self.positive_fake_region = Mock(boto.regioninfo.RegionInfo)
-        self.positive_fake_region.name = "allowed_region"
-        self.negative_fake_region = Mock(boto.regioninfo.RegionInfo)
-        self.negative_fake_region.name = "forbidden_region"
+        self.positive_fake_region = "allowed_region"
+        self.negative_fake_region = "forbidden_region"
         self.resource_type = "rds2 Instance"
-        self.rds2_mock.regions.return_value = [self.positive_fake_region, self.negative_fake_region]
+        self.regions_mock.return_value = [self.positive_fake_region, self.negative_fake_region]
         self.logger_mock = patch("monocyte.handler.logging").start()
         self.rds_instance = rds2.Instance(lambda region_name: True)
 
@@ -42,20 +40,19 @@ class RDSInstanceTest(TestCase):
         patch.stopall()
 
     def test_fetch_unwanted_resources_filtered_by_region(self):
-        self.rds2_mock.connect_to_region.return_value.describe_db_instances.return_value = \
-            self._given_db_instances_response()
+        self.client.get_paginator.return_value.paginate.return_value = self._given_db_instances_response()
 
         only_resource = list(self.rds_instance.fetch_unwanted_resources())[0]
         self.assertEqual(only_resource.wrapped, self.instance_mock)
 
     def test_fetch_unwanted_resources_filtered_by_ignored_resources(self):
+        self.client.get_paginator.return_value.paginate.return_value = self._given_db_instances_response()
         self.rds_instance.ignored_resources = [INSTANCE_IDENTIFIER]
         empty_list = list(self.rds_instance.fetch_unwanted_resources())
         self.assertEqual(empty_list, [])
 
     def test_to_string(self):
-        self.rds2_mock.connect_to_region.return_value.describe_db_instances.return_value = \
-            self._given_db_instances_response()
+        self.client.get_paginator.return_value.paginate.return_value = self._given_db_instances_response()
 
         only_resource = list(self.rds_instance.fetch_unwanted_resources())[0]
         resource_string = self.rds_instance.to_string(only_resource)
@@ -66,7 +63,7 @@ class RDSInstanceTest(TestCase):
     def test_skip_deletion_in_dry_run(self):
         self.rds_instance.dry_run = True
         resource = Resource(self.instance_mock, self.resource_type, self.instance_mock["DBInstanceIdentifier"],
-                            self.instance_mock["InstanceCreateTime"], self.negative_fake_region.name)
+                            self.instance_mock["InstanceCreateTime"], self.negative_fake_region)
 
         deleted_resource = self.rds_instance.delete(resource)
 
@@ -77,7 +74,7 @@ class RDSInstanceTest(TestCase):
         self.instance_mock["DBInstanceStatus"] = rds2.DELETION_STATUS
 
         resource = Resource(self.instance_mock, self.resource_type, self.instance_mock["DBInstanceIdentifier"],
-                            self.instance_mock["InstanceCreateTime"], self.negative_fake_region.name)
+                            self.instance_mock["InstanceCreateTime"], self.negative_fake_region)
 
         self.assertRaises(Warning, self.rds_instance.delete, resource)
 
@@ -85,25 +82,20 @@ class RDSInstanceTest(TestCase):
         self.rds_instance.dry_run = False
 
         resource = Resource(self.instance_mock, self.resource_type, self.instance_mock["DBInstanceIdentifier"],
-                            self.instance_mock["InstanceCreateTime"], self.negative_fake_region.name)
+                            self.instance_mock["InstanceCreateTime"], self.negative_fake_region)
 
-        self.rds2_mock.connect_to_region.return_value.delete_db_instance.return_value = \
-            self._given_delete_db_instance_response()
+        self.client.delete_db_instance.return_value = self._given_delete_db_instance_response()
 
         self.rds_instance.delete(resource)
+        self.client.delete_db_instance.assert_called_once_with(
+            DBInstanceIdentifier=self.instance_mock["DBInstanceIdentifier"], SkipFinalSnapshot=True)
         self.logger_mock.getLogger.return_value.info.assert_called_with(rds2.DELETION_STATEMENT %
                                                                         self.instance_mock["DBInstanceIdentifier"])
 
         self.assertEqual(self.instance_mock["DBInstanceIdentifier"], resource.wrapped["DBInstanceIdentifier"])
 
     def _given_db_instances_response(self):
-        return {
-            'DescribeDBInstancesResponse': {
-                'DescribeDBInstancesResult': {
-                    'DBInstances': [self.instance_mock]
-                }
-            }
-        }
+        return [{'DBInstances': [self.instance_mock]}]
 
     def _given_instance_mock(self):
         return {
@@ -114,29 +106,25 @@ class RDSInstanceTest(TestCase):
 
     def _given_delete_db_instance_response(self):
         return {
-            "DeleteDBInstanceResponse": {
-                "DeleteDBInstanceResult": {
-                    "DBInstance": {
-                        "DBInstanceStatus": "deleting",
-                        "DBInstanceIdentifier": self.instance_mock["DBInstanceIdentifier"],
-                        "InstanceCreateTime": self.instance_mock["InstanceCreateTime"]
-                    }
-                }
+            "DBInstance": {
+                "DBInstanceStatus": "deleting",
+                "DBInstanceIdentifier": self.instance_mock["DBInstanceIdentifier"],
+                "InstanceCreateTime": self.instance_mock["InstanceCreateTime"]
             }
         }
 
 
 class RDSSnapshotTest(TestCase):
     def setUp(self):
-        self.rds2_mock = patch("monocyte.handler.rds2.rds2").start()
+        self.get_client_mock = patch("monocyte.handler.rds2.get_client").start()
+        self.regions_mock = patch("monocyte.handler.rds2.get_available_regions").start()
+        self.client = self.get_client_mock.return_value
         self.snapshot_mock = self._given_snapshot_mock()
 
-        self.positive_fake_region = Mock(boto.regioninfo.RegionInfo)
-        self.positive_fake_region.name = "allowed_region"
-        self.negative_fake_region = Mock(boto.regioninfo.RegionInfo)
-        self.negative_fake_region.name = "forbidden_region"
+        self.positive_fake_region = "allowed_region"
+        self.negative_fake_region = "forbidden_region"
         self.resource_type = "rds2 Snapshot"
-        self.rds2_mock.regions.return_value = [self.positive_fake_region, self.negative_fake_region]
+        self.regions_mock.return_value = [self.positive_fake_region, self.negative_fake_region]
         self.logger_mock = patch("monocyte.handler.logging").start()
         self.rds_snapshot = rds2.Snapshot(lambda region_name: True)
 
@@ -144,20 +132,27 @@ class RDSSnapshotTest(TestCase):
         patch.stopall()
 
     def test_fetch_unwanted_resources_filtered_by_region(self):
-        self.rds2_mock.connect_to_region.return_value.describe_db_snapshots.return_value = \
-            self._given_db_snapshot_response()
+        self.client.get_paginator.return_value.paginate.return_value = self._given_db_snapshot_response()
 
         only_resource = list(self.rds_snapshot.fetch_unwanted_resources())[0]
         self.assertEqual(only_resource.wrapped, self.snapshot_mock)
 
+    def test_fetch_unwanted_resources_lists_manual_snapshots_only(self):
+        self.client.get_paginator.return_value.paginate.return_value = self._given_db_snapshot_response()
+
+        list(self.rds_snapshot.fetch_unwanted_resources())
+
+        self.client.get_paginator.assert_called_with('describe_db_snapshots')
+        self.client.get_paginator.return_value.paginate.assert_called_with(SnapshotType="manual")
+
     def test_fetch_unwanted_resources_filtered_by_ignored_resources(self):
+        self.client.get_paginator.return_value.paginate.return_value = self._given_db_snapshot_response()
         self.rds_snapshot.ignored_resources = [SNAPSHOT_IDENTIFIER]
         empty_list = list(self.rds_snapshot.fetch_unwanted_resources())
         self.assertEqual(empty_list, [])
 
     def test_to_string(self):
-        self.rds2_mock.connect_to_region.return_value.describe_db_snapshots.return_value = \
-            self._given_db_snapshot_response()
+        self.client.get_paginator.return_value.paginate.return_value = self._given_db_snapshot_response()
 
         only_resource = list(self.rds_snapshot.fetch_unwanted_resources())[0]
         resource_string = self.rds_snapshot.to_string(only_resource)
@@ -168,7 +163,7 @@ class RDSSnapshotTest(TestCase):
     def test_skip_deletion_in_dry_run(self):
         self.rds_snapshot.dry_run = True
         resource = Resource(self.snapshot_mock, self.resource_type, self.snapshot_mock["DBSnapshotIdentifier"],
-                            self.snapshot_mock["SnapshotCreateTime"], self.negative_fake_region.name)
+                            self.snapshot_mock["SnapshotCreateTime"], self.negative_fake_region)
 
         deleted_resource = self.rds_snapshot.delete(resource)
 
@@ -179,7 +174,7 @@ class RDSSnapshotTest(TestCase):
         self.snapshot_mock["Status"] = rds2.DELETION_STATUS
 
         resource = Resource(self.snapshot_mock, self.resource_type, self.snapshot_mock["DBSnapshotIdentifier"],
-                            self.snapshot_mock["SnapshotCreateTime"], self.negative_fake_region.name)
+                            self.snapshot_mock["SnapshotCreateTime"], self.negative_fake_region)
 
         self.assertRaises(Warning, self.rds_snapshot.delete, resource)
 
@@ -188,31 +183,26 @@ class RDSSnapshotTest(TestCase):
         self.snapshot_mock["SnapshotType"] = rds2.AUTOMATED_STATUS
 
         resource = Resource(self.snapshot_mock, self.resource_type, self.snapshot_mock["DBSnapshotIdentifier"],
-                            self.snapshot_mock["SnapshotCreateTime"], self.negative_fake_region.name)
+                            self.snapshot_mock["SnapshotCreateTime"], self.negative_fake_region)
 
         self.assertRaises(Warning, self.rds_snapshot.delete, resource)
 
     def test_does_delete_if_not_dry_run(self):
         self.rds_snapshot.dry_run = False
         resource = Resource(self.snapshot_mock, self.resource_type, self.snapshot_mock["DBSnapshotIdentifier"],
-                            self.snapshot_mock["SnapshotCreateTime"], self.negative_fake_region.name)
+                            self.snapshot_mock["SnapshotCreateTime"], self.negative_fake_region)
 
-        self.rds2_mock.connect_to_region.return_value.delete_db_snapshot.return_value = \
-            self._given_delete_db_snapshot_response()
+        self.client.delete_db_snapshot.return_value = self._given_delete_db_snapshot_response()
 
         self.rds_snapshot.delete(resource)
+        self.client.delete_db_snapshot.assert_called_once_with(
+            DBSnapshotIdentifier=self.snapshot_mock["DBSnapshotIdentifier"])
         self.logger_mock.getLogger.return_value.info.assert_called_with(rds2.DELETION_STATEMENT %
                                                                         self.snapshot_mock["DBSnapshotIdentifier"])
         self.assertEqual(self.snapshot_mock["DBSnapshotIdentifier"], resource.wrapped["DBSnapshotIdentifier"])
 
     def _given_db_snapshot_response(self):
-        return {
-            "DescribeDBSnapshotsResponse": {
-                "DescribeDBSnapshotsResult": {
-                    "DBSnapshots": [self.snapshot_mock]
-                }
-            }
-        }
+        return [{"DBSnapshots": [self.snapshot_mock]}]
 
     def _given_snapshot_mock(self):
         return {
@@ -224,13 +214,9 @@ class RDSSnapshotTest(TestCase):
 
     def _given_delete_db_snapshot_response(self):
         return {
-            "DeleteDBSnapshotResponse": {
-                "DeleteDBSnapshotResult": {
-                    "DBSnapshot": {
-                        "Status": "deleted",
-                        "DBSnapshotIdentifier": self.snapshot_mock["DBSnapshotIdentifier"],
-                        "SnapshotCreateTime": self.snapshot_mock["SnapshotCreateTime"]
-                    }
-                }
+            "DBSnapshot": {
+                "Status": "deleted",
+                "DBSnapshotIdentifier": self.snapshot_mock["DBSnapshotIdentifier"],
+                "SnapshotCreateTime": self.snapshot_mock["SnapshotCreateTime"]
             }
         }
@@ -14,9 +14,16 @@
 # limitations under the License.
 
 import boto3
+import datetime
+import threading
+import shutil
+import tempfile
 from moto import mock_s3, mock_sts
-from mock import patch
-from monocyte.handler import s3
+from botocore.exceptions import ClientError
+from dateutil.tz import tzutc
+from mock import Mock, patch
+from monocyte.deadline import Deadline, DeadlineExceeded
+from monocyte.handler import s3, Resource
 import os
 import unittest2
 
@@ -128,3 +135,320 @@ class S3BucketNewTest(unittest2.TestCase):
     def _given_bucket_mock(self, bucket_name, region_name):
         client = boto3.client('s3', region_name=region_name)
         client.create_bucket(Bucket=bucket_name)
+
+
+class S3BucketLocationTest(unittest2.TestCase):
+
+    def setUp(self):
+        self.logger_mock = patch("monocyte.handler.logging").start()
+        self.get_client_mock = patch("monocyte.handler.s3.get_client").start()
+        self.client = self.get_client_mock.return_value
+        self.get_account_id_mock = patch("monocyte.handler.get_account_id", return_value='111111111111').start()
+        self.cache_dir = tempfile.mkdtemp()
+        self.s3_handler = s3.Bucket(lambda region_name: region_name == 'eu-west-1', cache_dir=self.cache_dir)
+        self.s3_handler.region_names = ['eu-west-1']
+        self.creation_date = datetime.datetime(2015, 1, 1)
+        self.client.list_buckets.return_value = {'Buckets': [
+            {'Name': 'bucket-eu', 'CreationDate': self.creation_date},
+            {'Name': 'bucket-us', 'CreationDate': self.creation_date}]}
+        locations = {'bucket-eu': 'EU', 'bucket-us': None}
+        self.client.get_bucket_location.side_effect = \
+            lambda Bucket: {'LocationConstraint': locations[Bucket]}
+
+    def tearDown(self):
+        patch.stopall()
+        shutil.rmtree(self.cache_dir)
+
+    def test_fetch_unwanted_resources_resolves_locations(self):
+        resources = list(self.s3_handler.fetch_unwanted_resources())
+
+        self.assertEqual([(resource.resource_id, resource.region) for resource in resources],
+                         [('bucket-eu', 'eu-west-1')])
+        self.assertEqual(self.client.get_bucket_location.call_count, 2)
+
+    def test_repeated_sweep_uses_cached_locations(self):
+        list(self.s3_handler.fetch_unwanted_resources())
+        self.client.get_bucket_location.reset_mock()
+
+        other_handler = s3.Bucket(lambda region_name: region_name == 'eu-west-1', cache_dir=self.cache_dir)
+        resources = list(other_handler.fetch_unwanted_resources())
+
+        self.assertEqual([resource.resource_id for resource in resources], ['bucket-eu'])
+        self.assertFalse(self.client.get_bucket_location.called)
+
+    def test_sweeps_of_other_accounts_keep_cached_locations(self):
+        list(self.s3_handler.fetch_unwanted_resources())
+
+        self.get_account_id_mock.return_value = '222222222222'
+        self.client.list_buckets.return_value = {'Buckets': []}
+        list(s3.Bucket(lambda region_name: True, cache_dir=self.cache_dir).fetch_unwanted_resources())
+
+        self.get_account_id_mock.return_value = '111111111111'
+        self.client.list_buckets.return_value = {'Buckets': [
+            {'Name': 'bucket-eu', 'CreationDate': self.creation_date},
+            {'Name': 'bucket-us', 'CreationDate': self.creation_date}]}
+        self.client.get_bucket_location.reset_mock()
+        list(s3.Bucket(lambda region_name: True, cache_dir=self.cache_dir).fetch_unwanted_resources())
+
+        self.assertFalse(self.client.get_bucket_location.called)
+
+    def test_recreated_bucket_is_looked_up_again(self):
+        list(self.s3_handler.fetch_unwanted_resources())
+        self.client.get_bucket_location.reset_mock()
+        self.client.list_buckets.return_value['Buckets'][1]['CreationDate'] = datetime.datetime(2016, 1, 1)
+
+        list(self.s3_handler.fetch_unwanted_resources())
+
+        self.client.get_bucket_location.assert_called_once_with(Bucket='bucket-us')
+
+    def test_locations_are_not_looked_up_after_the_deadline(self):
+        self.s3_handler.deadline.cancel()
+
+        self.assertRaises(DeadlineExceeded, list, self.s3_handler.fetch_unwanted_resources())
+        self.client.get_bucket_location.assert_not_called()
+
+    def test_failed_location_lookup_skips_bucket(self):
+        self.client.get_bucket_location.side_effect = Exception("bucket is gone")
+
+        resources = list(self.s3_handler.fetch_unwanted_resources())
+
+        self.assertEqual(resources, [])
+
+
+class FakeVersionedBucketClient(object):
+    """Just enough of a versioned S3 bucket to drive the BucketEmptier.
+
+    Like S3, a listing continues after KeyMarker, and rejects a
+    VersionIdMarker of a version that no longer exists.
+    """
+
+    def __init__(self, keys, versions_per_key=1, uploads=(), failing=()):
+        self.versions = sorted((key, 'v%d' % version) for key in keys for version in range(versions_per_key))
+        self.uploads = list(uploads)
+        self.failing = set(failing)
+        self.aborted = []
+        self.delete_calls = []
+        self.list_calls = []
+        self.lock = threading.Lock()
+
+    def list_object_versions(self, Bucket, Prefix='', MaxKeys=1000, Delimiter=None,
+                             KeyMarker=None, VersionIdMarker=None):
+        with self.lock:
+            self.list_calls.append(Prefix)
+            if VersionIdMarker is not None and (KeyMarker, VersionIdMarker) not in self.versions:
+                raise ClientError({'Error': {'Code': 'InvalidArgument', 'Message': 'Invalid version id specified'}},
+                                  'ListObjectVersions')
+            matching = [(key, version) for key, version in self.versions
+                        if key.startswith(Prefix) and (Delimiter is None or Delimiter not in key[len(Prefix):])]
+        if KeyMarker is not None:
+            matching = [(key, version) for key, version in matching
+                        if key > KeyMarker or (key == KeyMarker and VersionIdMarker is not None and
+                                               version > VersionIdMarker)]
+        page = matching[:MaxKeys]
+        response = {'Versions': [{'Key': key, 'VersionId': version} for key, version in page],
+                    'IsTruncated': len(matching) > MaxKeys}
+        if response['IsTruncated']:
+            response['NextKeyMarker'], response['NextVersionIdMarker'] = page[-1]
+        return response
+
+    def delete_objects(self, Bucket, Delete):
+        objects = set((item['Key'], item['VersionId']) for item in Delete['Objects'])
+        failed = objects.intersection(self.failing)
+        with self.lock:
+            self.delete_calls.append(len(objects))
+            self.versions = [item for item in self.versions if item not in objects - failed]
+        return {'Errors': [{'Key': key, 'VersionId': version, 'Message': 'Access Denied'}
+                           for key, version in sorted(failed)]}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+
+    def get_paginator(self, operation_name):
+        client = self
+
+        class Paginator(object):
+            def paginate(self, Bucket, Delimiter=None):
+                if operation_name == 'list_multipart_uploads':
+                    return [{'Uploads': client.uploads}]
+                prefixes = sorted(set(key.split('/')[0] + '/' for key, _ in client.versions if '/' in key))
+                return [{'CommonPrefixes': [{'Prefix': prefix} for prefix in prefixes]}]
+        return Paginator()
+
+
+class BucketEmptierTest(unittest2.TestCase):
+
+    def test_empties_all_versions_in_full_batches(self):
+        keys = ['a/%04d' % i for i in range(1500)] + ['b/%04d' % i for i in range(500)] + ['root']
+        client = FakeVersionedBucketClient(keys, versions_per_key=2)
+        emptier = s3.BucketEmptier(client, 'bucket', workers=4)
+
+        self.assertTrue(emptier.empty())
+
+        self.assertEqual(client.versions, [])
+        self.assertEqual(emptier.deleted, 4002)
+        self.assertEqual(sorted(set(client.list_calls)), ['', 'a/', 'b/'])
+        self.assertEqual(client.delete_calls.count(1000), 4)
+
+    def test_aborts_multipart_uploads(self):
+        client = FakeVersionedBucketClient([], uploads=[{'Key': 'big', 'UploadId': 'upload-1'}])
+
+        s3.BucketEmptier(client, 'bucket').empty()
+
+        self.assertEqual(client.aborted, ['upload-1'])
+
+    def test_stops_exactly_at_max_deletions_and_continues_in_the_next_run(self):
+        keys = ['a/%04d' % i for i in range(2000)] + ['b/%04d' % i for i in range(2000)]
+        client = FakeVersionedBucketClient(keys)
+
+        first_run = s3.BucketEmptier(client, 'bucket', workers=4, max_deletions=700)
+        self.assertFalse(first_run.empty())
+        self.assertEqual(first_run.deleted, 700)
+        self.assertEqual(len(client.versions), 3300)
+
+        second_run = s3.BucketEmptier(client, 'bucket', workers=4)
+        self.assertTrue(second_run.empty())
+        self.assertEqual(second_run.deleted, 3300)
+        self.assertEqual(client.versions, [])
+
+    def test_skips_versions_that_cannot_be_deleted(self):
+        keys = ['a/%04d' % i for i in range(2500)]
+        client = FakeVersionedBucketClient(keys, failing=[(key, 'v0') for key in keys[:1200]])
+
+        self.assertFalse(s3.BucketEmptier(client, 'bucket', logger=Mock()).empty())
+
+        self.assertEqual(client.versions, [(key, 'v0') for key in keys[:1200]])
+
+    def test_stops_at_deadline_and_continues_in_the_next_run(self):
+        client = FakeVersionedBucketClient(['a/%04d' % i for i in range(3000)])
+        deadline = Deadline()
+        delete_objects = client.delete_objects
+
+        def delete_objects_until_deadline(**kwargs):
+            deadline.cancel()
+            return delete_objects(**kwargs)
+        client.delete_objects = delete_objects_until_deadline
+
+        emptier = s3.BucketEmptier(client, 'bucket', workers=1, deadline=deadline)
+        self.assertRaises(DeadlineExceeded, emptier.empty)
+        self.assertEqual(len(client.versions), 2000)
+
+        client.delete_objects = delete_objects
+        self.assertTrue(s3.BucketEmptier(client, 'bucket').empty())
+        self.assertEqual(client.versions, [])
+
+    @mock_s3
+    @patch("monocyte.handler.s3.DELETE_OBJECTS_BATCH_SIZE", 10)
+    def test_empties_versioned_bucket_over_several_runs(self):
+        client = boto3.client('s3', region_name=s3.US_STANDARD_REGION)
+        client.create_bucket(Bucket='versioned')
+        client.put_bucket_versioning(Bucket='versioned', VersioningConfiguration={'Status': 'Enabled'})
+        for number in range(15):
+            for _ in range(2):
+                client.put_object(Bucket='versioned', Key='a/%02d' % number, Body=b'x')
+        client.delete_object(Bucket='versioned', Key='a/00')
+
+        first_run = s3.BucketEmptier(client, 'versioned', max_deletions=25)
+        self.assertFalse(first_run.empty())
+        self.assertEqual(first_run.deleted, 25)
+
+        second_run = s3.BucketEmptier(client, 'versioned')
+        self.assertTrue(second_run.empty())
+        self.assertEqual(second_run.deleted, 6)
+        response = client.list_object_versions(Bucket='versioned')
+        self.assertEqual(response.get('Versions', []) + response.get('DeleteMarkers', []), [])
+
+    def test_delete_reports_partially_emptied_bucket(self):
+        get_client_mock = patch("monocyte.handler.s3.get_client").start()
+        self.addCleanup(patch.stopall)
+        get_client_mock.return_value = FakeVersionedBucketClient(['a/%04d' % i for i in range(2000)])
+        handler = s3.Bucket(lambda region_name: True, dry_run=False, max_deletions_per_run=1000)
+
+        self.assertRaises(Warning, handler.delete, 'bucket')
+        self.assertEqual(len(get_client_mock.return_value.versions), 1000)
+
+
+class S3BucketDrainTest(unittest2.TestCase):
+
+    def setUp(self):
+        self.logger_mock = patch("monocyte.handler.logging").start()
+        self.get_client_mock = patch("monocyte.handler.s3.get_client").start()
+        self.client = self.get_client_mock.return_value
+        self.client.get_bucket_lifecycle_configuration.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchLifecycleConfiguration', 'Message': ''}}, 'GetBucketLifecycleConfiguration')
+        patch("monocyte.handler.get_account_id", return_value='111111111111').start()
+        self.cache_dir = tempfile.mkdtemp()
+        self.s3_handler = self._given_handler()
+        self.creation_date = datetime.datetime(2015, 1, 1)
+        self.resource = Resource("Bucket big-bucket", "s3.Bucket", "big-bucket", self.creation_date, "eu-west-1")
+
+    def tearDown(self):
+        patch.stopall()
+        shutil.rmtree(self.cache_dir)
+
+    def _given_handler(self, cache_dir=True):
+        handler = s3.Bucket(lambda region_name: region_name == 'eu-west-1', dry_run=False,
+                            empty_strategy="lifecycle", cache_dir=self.cache_dir if cache_dir else None)
+        handler.region_names = ['eu-west-1']
+        return handler
+
+    def _given_bucket_content(self, versions):
+        self.client.list_object_versions.return_value = {'Versions': versions}
+        self.client.list_multipart_uploads.return_value = {}
+
+    def test_unknown_strategy_is_rejected(self):
+        self.assertRaises(ValueError, s3.Bucket, lambda region_name: True, empty_strategy="burn")
+
+    def test_first_delete_attaches_lifecycle_configuration(self):
+        self.assertRaises(Warning, self.s3_handler.delete, self.resource)
+
+        self.client.put_bucket_lifecycle_configuration.assert_called_once_with(
+            Bucket='big-bucket', LifecycleConfiguration=s3.DRAIN_LIFECYCLE_CONFIGURATION)
+        self.assertFalse(self.client.delete_bucket.called)
+        self.assertIn("Draining", self.resource.reason)
+
+    @patch('monocyte.handler.s3.datetime')
+    def test_drain_start_is_recorded_in_utc(self, datetime_mock):
+        datetime_mock.datetime.now.return_value = datetime.datetime(2020, 1, 2, 3, 4, tzinfo=tzutc())
+
+        self.assertRaises(Warning, self.s3_handler.delete, self.resource)
+
+        datetime_mock.datetime.now.assert_called_once_with(tzutc())
+        self.assertIn("since 2020-01-02 03:04 UTC", self.resource.reason)
+
+    def test_bucket_is_kept_while_draining(self):
+        self._given_bucket_content([{'Key': 'any', 'VersionId': 'v1'}])
+        self.assertRaises(Warning, self.s3_handler.delete, self.resource)
+
+        self.assertRaises(Warning, self._given_handler().delete, self.resource)
+
+        self.assertEqual(self.client.put_bucket_lifecycle_configuration.call_count, 1)
+        self.assertFalse(self.client.delete_bucket.called)
+
+    def test_drained_bucket_is_deleted(self):
+        self.assertRaises(Warning, self.s3_handler.delete, self.resource)
+        self._given_bucket_content([])
+
+        self._given_handler().delete(self.resource)
+
+        self.client.delete_bucket.assert_called_once_with(Bucket='big-bucket')
+        self.assertEqual(self._given_handler().get_cache('s3_draining').keys(), [])
+
+    def test_drain_is_recognized_without_cache(self):
+        self.client.get_bucket_lifecycle_configuration.side_effect = None
+        self.client.get_bucket_lifecycle_configuration.return_value = s3.DRAIN_LIFECYCLE_CONFIGURATION
+        self._given_bucket_content([])
+
+        self._given_handler(cache_dir=False).delete(self.resource)
+
+        self.assertFalse(self.client.put_bucket_lifecycle_configuration.called)
+        self.client.delete_bucket.assert_called_once_with(Bucket='big-bucket')
+
+    def test_fetch_reports_draining_buckets(self):
+        self.assertRaises(Warning, self.s3_handler.delete, self.resource)
+        self.client.list_buckets.return_value = {'Buckets': [{'Name': 'big-bucket', 'CreationDate': self.creation_date}]}
+        self.client.get_bucket_location.return_value = {'LocationConstraint': 'EU'}
+
+        resources = list(self._given_handler().fetch_unwanted_resources())
+
+        self.assertEqual(len(resources), 1)
+        self.assertIn("Draining through a lifecycle configuration since", resources[0].reason)
@@ -15,23 +15,37 @@
 
 from __future__ import print_function
 import datetime
+import threading
+import time
 from unittest import TestCase
-from boto.regioninfo import RegionInfo
 from mock import Mock, patch
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 from monocyte import Monocyte
-from monocyte.handler import Resource, Handler
+from monocyte.deadline import Deadline, DeadlineExceeded
+from monocyte.plugins.streaming import StreamingPlugin
+from monocyte.handler import REGION_QUEUE_SIZE, Resource, Handler
 from monocyte.cli import apply_default_config
 
 
 REGION_NOT_ALLOWED = "test handler"
 
 
+class FakeCloudWatchLogsHandler(object):
+    def __init__(self, *args):
+        pass
+
+
 class MonocyteTest(TestCase):
 
     def setUp(self):
         self.logger_mock = patch("monocyte.logging").start()
         self.logger_mock.INFO = 20
+        self.load_region_catalogue_mock = patch("monocyte.clients.registry.load_region_catalogue").start()
         self.config = {
             "handler_names": ["dummy"]
         }
@@ -42,6 +56,9 @@ class MonocyteTest(TestCase):
         self.not_allowed_region = "US"
         self.ignored_region = "us-gov-west-1"
 
+    def tearDown(self):
+        patch.stopall()
+
     def test_is_region_allowed(self):
         self.assertTrue(self.monocyte.is_region_allowed(self.allowed_region))
         self.assertFalse(self.monocyte.is_region_allowed(self.not_allowed_region))
@@ -59,6 +76,7 @@ class MonocyteTest(TestCase):
         handler.fetch_unwanted_resources.return_value = [Resource(
             "foo", "test_type", "test_id", datetime.datetime.now(), "test_region")]
         handler.to_string.return_value = "test handler"
+        handler.DELETE_BATCH_SIZE = 1
         self.monocyte.handle_service(handler)
 
         self.logger_mock.getLogger.return_value.warning.assert_called_with(REGION_NOT_ALLOWED)
@@ -84,6 +102,408 @@ class MonocyteTest(TestCase):
         result_resource_ids = set([resource.resource_id for resource in self.monocyte.unwanted_resources])
         self.assertEqual(sorted(expected_resource_ids), sorted(result_resource_ids.intersection(expected_resource_ids)))
 
+    @patch("monocyte.Monocyte.get_all_handler_classes")
+    def test_region_catalogue_is_loaded_before_handlers_are_created(self, fetch_mock):
+        calls = []
+        self.load_region_catalogue_mock.side_effect = lambda catalogue: calls.append("regions")
+        fetch_mock.side_effect = lambda: calls.append("handlers") or {"monocyte.handler.dummy": DummyHandler}
+
+        self.monocyte.search_and_destroy_unwanted_resources()
+
+        self.assertEqual(calls, ["regions", "handlers"])
+
+    @patch("monocyte.Monocyte.get_all_handler_classes")
+    def test_search_continues_if_regions_cannot_be_resolved(self, fetch_mock):
+        fetch_mock.return_value = {"monocyte.handler.dummy": DummyHandler}
+        self.load_region_catalogue_mock.side_effect = Exception("UnauthorizedOperation")
+
+        self.assertEqual(self.monocyte.search_and_destroy_unwanted_resources(), 0)
+
+    def test_log_handlers_are_added_once_per_logger(self):
+        logger = Mock(handlers=[])
+        logger.addHandler.side_effect = logger.handlers.append
+
+        Monocyte(logger=logger, **self.config)
+        Monocyte(logger=logger, **self.config)
+
+        self.assertEqual(logger.addHandler.call_count, 1)
+
+    @patch("monocyte.CloudWatchLogsHandler", FakeCloudWatchLogsHandler)
+    @patch("monocyte.Monocyte.get_all_handler_classes")
+    def test_cloudwatch_handler_is_added_once_per_logger(self, fetch_mock):
+        fetch_mock.return_value = {"monocyte.handler.dummy": DummyHandler}
+        logger = Mock(handlers=[])
+        logger.addHandler.side_effect = logger.handlers.append
+        self.config["cloudwatchlogs"] = {"region": "eu-west-1", "groupname": "monocyte", "log_level": "INFO"}
+
+        for _ in range(2):
+            Monocyte(logger=logger, **self.config).search_and_destroy_unwanted_resources()
+
+        self.assertEqual([type(handler) for handler in logger.handlers].count(FakeCloudWatchLogsHandler), 1)
+
+    @patch("monocyte.Monocyte.get_all_handler_classes")
+    def test_instantiate_handlers_passes_handler_config(self, fetch_mock):
+        fetch_mock.return_value = {"monocyte.handler.dummy": ConfigurableHandler}
+        self.monocyte.handler_config = {"dummy": {"flavour": "strawberry"}}
+
+        handlers = self.monocyte.instantiate_handlers()
+
+        self.assertEqual(handlers[0].flavour, "strawberry")
+        self.assertEqual(handlers[0].dry_run, self.monocyte.dry_run)
+
+    @patch("monocyte.Monocyte.get_all_handler_classes")
+    def test_instantiate_handlers_passes_discovery_mode(self, fetch_mock):
+        fetch_mock.return_value = {"monocyte.handler.dummy": ConfigurableHandler}
+        self.monocyte.handler_config = {"dummy": {"flavour": "vanilla"}}
+        self.monocyte.discovery_mode = "tagging"
+
+        handlers = self.monocyte.instantiate_handlers()
+
+        self.assertEqual(handlers[0].discovery_mode, "tagging")
+
+    @patch("monocyte.Monocyte.get_all_handler_classes")
+    def test_handlers_of_a_run_share_snapshots(self, fetch_mock):
+        fetch_mock.return_value = {"monocyte.handler.dummy": DummyHandler, "monocyte.handler.other": DummyHandler}
+        self.monocyte.handler_names = ["dummy", "other"]
+
+        first_run = self.monocyte.instantiate_handlers()
+        second_run = self.monocyte.instantiate_handlers()
+
+        self.assertIs(first_run[0].snapshots, first_run[1].snapshots)
+        self.assertIsNot(first_run[0].snapshots, second_run[0].snapshots)
+
+    def test_handle_service_records_outcomes(self):
+        resources = [Resource("foo", "test_type", str(i), datetime.datetime.now(), "us-west-1")
+                     for i in range(20)]
+
+        def delete(resource):
+            if resource.resource_id == "3":
+                raise Exception("boom")
+            if resource.resource_id == "4":
+                raise Warning("dry run")
+
+        handler = QueueingHandler(resources, delete)
+        self.monocyte.handle_service(handler)
+
+        self.assertEqual(len(handler.deleted), 20)
+        self.assertEqual(sorted(r.resource_id for r in self.monocyte.unwanted_resources),
+                         sorted(str(i) for i in range(20) if i != 3))
+        self.assertEqual(len(self.monocyte.problematic_resources), 1)
+        self.assertEqual(self.monocyte.problematic_resources[0][0].resource_id, "3")
+
+    def test_handle_service_skips_allowed_regions(self):
+        handler = QueueingHandler([Resource("foo", "test_type", "test_id", datetime.datetime.now(), "eu-west-1")])
+
+        self.monocyte.handle_service(handler)
+
+        self.assertEqual(handler.deleted, [])
+        self.assertEqual(self.monocyte.unwanted_resources, [])
+
+    def test_handle_service_blocks_discovery_while_queue_is_full(self):
+        self.monocyte.deletion_workers = 1
+        self.monocyte.deletion_queue_size = 2
+        release = threading.Event()
+        discovered = []
+
+        def fetch_unwanted_resources():
+            for i in range(10):
+                discovered.append(i)
+                yield Resource("foo", "test_type", str(i), datetime.datetime.now(), "us-west-1")
+
+        handler = QueueingHandler(fetch_unwanted_resources(), lambda resource: release.wait(5))
+
+        service_thread = threading.Thread(target=self.monocyte.handle_service, args=(handler,))
+        service_thread.start()
+        service_thread.join(0.2)
+        # One resource in deletion, two waiting in the queue, one waiting for a free slot.
+        self.assertEqual(len(discovered), 4)
+
+        release.set()
+        service_thread.join(5)
+        self.assertEqual(len(self.monocyte.unwanted_resources), 10)
+
+    def test_handle_service_pauses_region_listing_while_queue_is_full(self):
+        self.monocyte.deletion_workers = 1
+        self.monocyte.deletion_queue_size = 2
+        release = threading.Event()
+        handler = RegionalHandler(['us-west-1', 'us-west-2', 'us-east-1'], 1000, lambda resource: release.wait(5))
+        handler.region_workers = 2
+
+        service_thread = threading.Thread(target=self.monocyte.handle_service, args=(handler,))
+        service_thread.start()
+        service_thread.join(0.2)
+        # Four resources in the deletion pipeline and per running region
+        # a full queue plus one resource waiting for a free slot.
+        self.assertTrue(len(handler.listed) <= 4 + 2 * (REGION_QUEUE_SIZE + 1))
+        self.assertTrue(service_thread.is_alive())
+
+        release.set()
+        service_thread.join(10)
+        self.assertEqual(len(self.monocyte.unwanted_resources), 3000)
+
+    def test_handle_service_passes_batches_per_region(self):
+        resources = [Resource("foo", "test_type", str(i), datetime.datetime.now(), region)
+                     for i, region in enumerate(["us-west-1"] * 5 + ["us-east-1"] * 2)]
+        handler = QueueingHandler(resources)
+        handler.DELETE_BATCH_SIZE = 3
+
+        self.monocyte.handle_service(handler)
+
+        batches = sorted([resource.resource_id for resource in batch] for batch in handler.batches)
+        self.assertEqual(batches, [["0", "1", "2"], ["3", "4"], ["5", "6"]])
+        self.assertEqual(len(self.monocyte.unwanted_resources), 7)
+
+    def test_handle_service_maps_batch_results_to_resources(self):
+        resources = [Resource("foo", "test_type", str(i), datetime.datetime.now(), "us-west-1")
+                     for i in range(3)]
+        handler = QueueingHandler(resources)
+        handler.DELETE_BATCH_SIZE = 3
+        handler.delete_many = lambda batch: [(batch[0], None), (batch[1], Exception("boom")),
+                                             (batch[2], Warning("dry run"))]
+
+        self.monocyte.handle_service(handler)
+
+        self.assertEqual(sorted(r.resource_id for r in self.monocyte.unwanted_resources), ["0", "2"])
+        self.assertEqual([problem[0].resource_id for problem in self.monocyte.problematic_resources], ["1"])
+
+    def test_handle_service_records_failing_batch_as_problematic(self):
+        resources = [Resource("foo", "test_type", str(i), datetime.datetime.now(), "us-west-1")
+                     for i in range(2)]
+        handler = QueueingHandler(resources)
+        handler.DELETE_BATCH_SIZE = 2
+
+        def delete_many(batch):
+            raise Exception("boom")
+
+        handler.delete_many = delete_many
+        self.monocyte.handle_service(handler)
+
+        self.assertEqual(len(self.monocyte.problematic_resources), 2)
+
+    def test_get_handler_dependencies_ignores_inactive_handlers(self):
+        instance = self._given_handler("ec2.Instance")
+        volume = self._given_handler("ec2.Volume", ["ec2.Instance", "not.Activated"])
+
+        dependencies = self.monocyte.get_handler_dependencies([volume, instance])
+
+        self.assertEqual(dependencies, {"ec2.Volume": set(["ec2.Instance"]), "ec2.Instance": set()})
+
+    def test_get_handler_dependencies_uses_configured_dependencies(self):
+        stack = self._given_handler("cloudformation.Stack")
+        bucket = self._given_handler("s3.Bucket")
+        self.monocyte.handler_dependencies = {"s3.Bucket": ["cloudformation.Stack"]}
+
+        dependencies = self.monocyte.get_handler_dependencies([stack, bucket])
+
+        self.assertEqual(dependencies["s3.Bucket"], set(["cloudformation.Stack"]))
+
+    def test_get_handler_dependencies_detects_cycles(self):
+        first = self._given_handler("first.Handler", ["second.Handler"])
+        second = self._given_handler("second.Handler", ["first.Handler"])
+
+        self.assertRaises(ValueError, self.monocyte.get_handler_dependencies, [first, second])
+
+    def test_run_handlers_waits_for_dependencies(self):
+        instance = self._given_handler("ec2.Instance")
+        volume = self._given_handler("ec2.Volume", ["ec2.Instance"])
+        finished = []
+
+        def handle_service(handler):
+            if handler is volume:
+                self.assertIn(instance.name, finished)
+            finished.append(handler.name)
+
+        self.monocyte.handle_service = handle_service
+        self.monocyte.run_handlers([volume, instance])
+
+        self.assertEqual(finished, ["ec2.Instance", "ec2.Volume"])
+
+    def test_run_handlers_runs_independent_handlers_concurrently(self):
+        started = threading.Event()
+        results = []
+        first = self._given_handler("first.Handler")
+        second = self._given_handler("second.Handler")
+
+        def handle_service(handler):
+            if handler is first:
+                results.append(started.wait(5))
+            else:
+                started.set()
+
+        self.monocyte.handle_service = handle_service
+        self.monocyte.run_handlers([first, second])
+
+        self.assertEqual(results, [True])
+
+    def test_run_handlers_continues_after_failing_handler(self):
+        instance = self._given_handler("ec2.Instance")
+        volume = self._given_handler("ec2.Volume", ["ec2.Instance"])
+        handled = []
+
+        def handle_service(handler):
+            handled.append(handler.name)
+            if handler is instance:
+                raise Exception("boom")
+
+        self.monocyte.handle_service = handle_service
+        self.monocyte.run_handlers([instance, volume])
+
+        self.assertEqual(handled, ["ec2.Instance", "ec2.Volume"])
+
+    def test_run_handlers_stops_at_run_deadline(self):
+        instance = self._given_handler("ec2.Instance")
+        volume = self._given_handler("ec2.Volume", ["ec2.Instance"])
+        cancelled = threading.Event()
+
+        def handle_service(handler):
+            # Like a real handler, stop once the deadline is cancelled.
+            while not handler.deadline.expired():
+                time.sleep(0.01)
+            cancelled.set()
+
+        self.monocyte.handle_service = handle_service
+        self.monocyte.deadline = Deadline(0.1)
+        self.monocyte.run_handlers([instance, volume])
+
+        self.assertTrue(cancelled.wait(5))
+        reasons = [(resource.region, str(exc)) for resource, _, exc in self.monocyte.problematic_resources]
+        self.assertEqual(reasons, [("all", "Run deadline reached, ec2.Instance was cancelled"),
+                                   ("all", "Run deadline reached, ec2.Volume did not start")])
+
+    def test_run_handler_reports_incomplete_regions(self):
+        handler = self._given_handler("ec2.Instance")
+        handler.resource_type = "ec2.Instance"
+        handler.incomplete_regions = [("us-west-1", DeadlineExceeded("Time is up"))]
+        self.monocyte.handle_service = Mock()
+
+        self.monocyte.run_handler(handler)
+
+        resource, reported_handler, exc = self.monocyte.problematic_resources[0]
+        self.assertEqual((resource.resource_type, resource.region, resource.reason),
+                         ("ec2.Instance", "us-west-1", "Time is up"))
+        self.assertIs(reported_handler, handler)
+        self.assertTrue(isinstance(exc, DeadlineExceeded))
+
+    def test_incomplete_handler_is_reported_once(self):
+        handler = self._given_handler("ec2.Instance")
+        handler.resource_type = "ec2.Instance"
+        handler.incomplete_regions = [("us-west-1", DeadlineExceeded("Time is up"))]
+        self.monocyte.handle_service = Mock(side_effect=DeadlineExceeded("Time is up, the search was not finished"))
+
+        self.monocyte.record_incomplete(handler, "all", DeadlineExceeded("Run deadline reached"))
+        self.monocyte.run_handler(handler)
+
+        reasons = [(resource.region, resource.reason) for resource, _, _ in self.monocyte.problematic_resources]
+        self.assertEqual(reasons, [("all", "Run deadline reached")])
+
+    def test_run_handler_logs_skipped_regions_once(self):
+        handler = self._given_handler("ec2.Instance")
+        handler.skipped_regions = ["us-west-2", "ap-south-1"]
+        self.monocyte.handle_service = Mock()
+        self.monocyte.logger = Mock()
+
+        self.monocyte.run_handler(handler)
+
+        self.assertEqual(self.monocyte.problematic_resources, [])
+        self.monocyte.logger.info.assert_called_with("%s: skipped %d regions without tagged resources: %s",
+                                                     "ec2.Instance", 2, "ap-south-1, us-west-2")
+
+    def test_handle_service_stops_search_at_deadline(self):
+        handler = QueueingHandler([Resource("foo", "test_type", "1", datetime.datetime.now(), "us-west-1")])
+        handler.deadline.cancel()
+
+        self.assertRaises(DeadlineExceeded, self.monocyte.handle_service, handler)
+        self.assertEqual(handler.deleted, [])
+
+    def test_queued_batches_are_not_deleted_after_deadline(self):
+        resources = [Resource("foo", "test_type", str(i), datetime.datetime.now(), "us-west-1") for i in range(3)]
+        handler = QueueingHandler(resources)
+        handler.deadline.cancel()
+        work_queue = queue.Queue()
+        work_queue.put(resources)
+        work_queue.put(None)
+
+        self.monocyte.delete_queued_batches(handler, work_queue)
+
+        self.assertEqual(handler.deleted, [])
+        self.assertEqual([resource for resource, _, _ in self.monocyte.problematic_resources], resources)
+
+    @patch("monocyte.get_item_from_module")
+    def test_streaming_plugins_get_results_while_handlers_run(self, get_item_mock):
+        get_item_mock.side_effect = lambda module_name, item_name: {
+            "Streaming": RecordingPlugin, "Batch": BatchPlugin}[item_name]
+        self.monocyte.config["plugins"] = [{"module": "any", "item": "Streaming", "config": {"flavour": "mint"}},
+                                           {"module": "any", "item": "Batch"}]
+        handler = QueueingHandler([Resource("foo", "test_type", "1", datetime.datetime.now(), "us-west-1")])
+        error = Exception("boom")
+
+        BatchPlugin.runs = []
+        self.monocyte.start_plugins()
+        streaming = self.monocyte.plugins[0][1]
+        self.monocyte.handle_service(handler)
+        self.monocyte.record_problematic_resource(handler.resources[0], handler, error)
+        self.assertEqual(BatchPlugin.runs, [])
+
+        self.monocyte.finish_plugins()
+
+        self.assertEqual(streaming.calls, [("resource", "1"), ("problem", "1"), ("finish",)])
+        self.assertEqual(streaming.flavour, "mint")
+        self.assertEqual(BatchPlugin.runs, [(handler.resources, [(handler.resources[0], handler, error)])])
+
+    @patch("monocyte.get_item_from_module")
+    def test_failing_plugin_callback_does_not_stop_the_run(self, get_item_mock):
+        get_item_mock.return_value = RecordingPlugin
+        self.monocyte.config["plugins"] = [{"module": "any", "item": "Streaming"}]
+        self.monocyte.start_plugins()
+        self.monocyte.plugins[0][1].on_resource = Mock(side_effect=Exception("boom"))
+        resource = Resource("foo", "test_type", "1", datetime.datetime.now(), "us-west-1")
+
+        self.monocyte.record_unwanted_resource(resource)
+        self.monocyte.finish_plugins()
+
+        self.assertEqual(self.monocyte.unwanted_resources, [resource])
+
+    @patch("monocyte.get_item_from_module")
+    def test_failing_plugin_does_not_stop_the_other_plugins(self, get_item_mock):
+        get_item_mock.return_value = RecordingPlugin
+        self.monocyte.config["plugins"] = [{"module": "any", "item": "Failing"}, {"module": "any", "item": "Working"}]
+        self.monocyte.start_plugins()
+        self.monocyte.plugins[0][1].on_finish = Mock(side_effect=AttributeError("boom"))
+        working = self.monocyte.plugins[1][1]
+
+        self.monocyte.finish_plugins()
+
+        self.assertEqual(working.calls, [("finish",)])
+
+    @patch("monocyte.get_item_from_module")
+    def test_slow_plugin_does_not_hold_up_results(self, get_item_mock):
+        get_item_mock.return_value = RecordingPlugin
+        self.monocyte.config["plugins"] = [{"module": "any", "item": "Streaming"}]
+        self.monocyte.start_plugins()
+        plugin = self.monocyte.plugins[0][1]
+        release = threading.Event()
+        plugin.on_resource = Mock(side_effect=lambda resource: release.wait(5))
+        resources = [Resource("foo", "test_type", str(i), datetime.datetime.now(), "us-west-1") for i in range(3)]
+
+        recorder = threading.Thread(target=lambda: [self.monocyte.record_unwanted_resource(resource)
+                                                    for resource in resources])
+        recorder.start()
+        recorder.join(1)
+
+        self.assertFalse(recorder.is_alive())
+        self.assertEqual(self.monocyte.unwanted_resources, resources)
+        release.set()
+        self.monocyte.finish_plugins()
+        self.assertEqual([call[0][0] for call in plugin.on_resource.call_args_list], resources)
+
+    def _given_handler(self, name, depends_on=None):
+        handler = Mock()
+        handler.name = name
+        handler.DEPENDS_ON = depends_on or []
+        handler.incomplete_regions = []
+        handler.skipped_regions = []
+        return handler
+
 
 class DummyHandler(Handler):
     def fetch_unwanted_resources(self):
@@ -100,3 +520,77 @@ class DummyHandler(Handler):
         if self.dry_run:
             return
         return
+
+
+class RegionalHandler(DummyHandler):
+    def __init__(self, region_names, resources_per_region, delete_function):
+        super(RegionalHandler, self).__init__(lambda region_name: True)
+        self.region_names = region_names
+        self.resources_per_region = resources_per_region
+        self.delete_function = delete_function
+        self.listed = []
+
+    def fetch_unwanted_resources(self):
+        return self.fetch_in_regions(self._fetch_unwanted_resources)
+
+    def _fetch_unwanted_resources(self, region_name):
+        for number in range(self.resources_per_region):
+            self.listed.append(number)
+            yield Resource("foo", "test_type", str(number), datetime.datetime.now(), region_name)
+
+    def delete(self, resource):
+        self.delete_function(resource)
+
+
+class RecordingPlugin(StreamingPlugin):
+    def __init__(self, dry_run, flavour=None):
+        super(RecordingPlugin, self).__init__(dry_run)
+        self.flavour = flavour
+        self.calls = []
+
+    def on_resource(self, resource):
+        self.calls.append(("resource", resource.resource_id))
+
+    def on_problem(self, resource, service_handler, exception):
+        self.calls.append(("problem", resource.resource_id))
+
+    def on_finish(self):
+        self.calls.append(("finish",))
+
+
+class BatchPlugin(object):
+    runs = []
+
+    def __init__(self, unwanted_resources, problematic_resources, dry_run):
+        self.unwanted_resources = unwanted_resources
+        self.problematic_resources = problematic_resources
+
+    def run(self):
+        BatchPlugin.runs.append((self.unwanted_resources, self.problematic_resources))
+
+
+class ConfigurableHandler(DummyHandler):
+    def __init__(self, region_filter, flavour=None, **kwargs):
+        self.flavour = flavour
+        super(ConfigurableHandler, self).__init__(region_filter, **kwargs)
+
+
+class QueueingHandler(DummyHandler):
+    def __init__(self, resources, delete_function=None):
+        super(QueueingHandler, self).__init__(lambda region_name: True)
+        self.resources = resources
+        self.delete_function = delete_function
+        self.deleted = []
+        self.batches = []
+
+    def fetch_unwanted_resources(self):
+        return self.resources
+
+    def delete(self, resource):
+        self.deleted.append(resource)
+        if self.delete_function:
+            self.delete_function(resource)
+
+    def delete_many(self, resources):
+        self.batches.append(resources)
+        return super(QueueingHandler, self).delete_many(resources)
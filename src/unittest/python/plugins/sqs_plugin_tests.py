@@ -6,6 +6,7 @@ from unittest2 import TestCase
 from moto import mock_sqs
 import boto3
 from mock import patch
+from monocyte.handler import Resource
 from monocyte.plugins.sqs_plugin import AwsSQSPlugin
 
 os.environ['http_proxy'] = ''
@@ -74,6 +75,22 @@ class AwsSQSPluginTest(TestCase):
 
         self.assertEqual(json.loads(plugin.get_body()), expected_body)
 
+    @patch('monocyte.plugins.sqs_plugin.AwsSQSPlugin._get_account_alias')
+    def test_get_body_lists_swept_accounts(self, mock_alias):
+        mock_alias.return_value = "the alias"
+        plugin = self._get_plugin()
+        plugin.unwanted_resources = [Resource(42, "ec2 instance", "1", "date1", "us", account_id="111111111111"),
+                                     Resource(42, "ec2 instance", "2", "date1", "us", account_id="222222222222")]
+        plugin.problematic_resources = [(Resource(23, "ec2 volume", "3", "date2", "us", account_id="222222222222"),
+                                         None, Exception("boom"))]
+
+        body = json.loads(plugin.get_body())
+
+        self.assertEqual(body['account'], "the alias")
+        self.assertEqual(body['accounts'], {
+            "111111111111": "Found 1 unwanted and 0 problematic resources.",
+            "222222222222": "Found 1 unwanted and 1 problematic resources."})
+
     @patch('monocyte.plugins.sqs_plugin.AwsSQSPlugin.get_body')
     @patch('monocyte.plugins.sqs_plugin.AwsSQSPlugin.send_message')
     def test_run_with_no_errors(self, mock_send_message, mock_get_body):
@@ -3,6 +3,7 @@ from __future__ import print_function, absolute_import, division
 import boto3
 import os
 from mock import Mock, patch
+from monocyte.deadline import DeadlineExceeded
 from monocyte.handler import Resource
 from monocyte.plugins.status_mail_plugin import StatusMailPlugin, UsofaStatusMailPlugin
 from moto import mock_ses, mock_s3
@@ -55,8 +56,8 @@ class StatusMailPluginTest(TestCase):
             Resource(42, "ec2 instance", "12345", "date1", "us"),
             Resource(42, "ec2 volume", "3312345", "date2", "us")]
         self.problematic_resources = [
-            Resource(23, "ec2 instance", "67890", "date1", "us"),
-            Resource(23, "ec2 volume", "1112345", "date2", "us")]
+            (Resource(23, "ec2 instance", "67890", "date1", "us"), Mock(), Exception("boom")),
+            (Resource(23, "ec2 volume", "1112345", "date2", "us"), Mock(), Exception("boom"))]
         self.dry_run = True
         self.reason = 'Do not do it'
         self.test_region = "eu-west-1"
@@ -161,6 +162,52 @@ class StatusMailPluginTest(TestCase):
         self.maxDiff = None
         self.assertEqual(body, expected_body)
 
+    @patch('monocyte.plugins.status_mail_plugin.StatusMailPlugin._get_account_alias')
+    def test_of_email_body_incomplete_sweep(self, mock_get_account_alias):
+        mock_get_account_alias.return_value = "test-account"
+        exc = DeadlineExceeded("Run deadline reached")
+        placeholder = Resource(None, "ec2 instance", "(incomplete sweep)", None, "us", reason=str(exc))
+        test_status_mail_plugin = StatusMailPlugin([],
+                                                   [(placeholder, Mock(), exc)],
+                                                   self.dry_run,
+                                                   region=self.test_region,
+                                                   sender=self.test_sender,
+                                                   recipients=self.test_recipients)
+
+        body = test_status_mail_plugin.body
+
+        self.assertIn("\tec2 instance with identifier (incomplete sweep). Run deadline reached\n", body)
+
+    @patch('monocyte.plugins.status_mail_plugin.StatusMailPlugin._get_account_alias')
+    def test_of_email_body_groups_resources_by_account(self, mock_get_account_alias):
+        unwanted_resources = [Resource(42, "ec2 instance", "12345", "date1", "us", account_id="222222222222"),
+                              Resource(42, "ec2 volume", "3312345", "date2", "us", account_id="111111111111")]
+        problematic_resources = [(Resource(23, "ec2 instance", "67890", "date1", "us", account_id="222222222222"),
+                                  Mock(), Exception("boom"))]
+        test_status_mail_plugin = StatusMailPlugin(unwanted_resources,
+                                                   problematic_resources,
+                                                   self.dry_run,
+                                                   region=self.test_region,
+                                                   sender=self.test_sender,
+                                                   recipients=self.test_recipients)
+
+        body = test_status_mail_plugin.body
+
+        self.assertIn("""
+Account: 111111111111
+Region: us
+\tec2 volume with identifier 3312345, created date2.
+
+Account: 222222222222
+Region: us
+\tec2 instance with identifier 12345, created date1.
+
+Additionally we had issues checking the following resource, please ensure that they are in the proper region:
+Region: us
+\tec2 instance with identifier 67890, created date1.
+""", body)
+        self.assertFalse(mock_get_account_alias.called)
+
     def test_email_sending_only_if_resources_are_given(self):
         self.test_status_mail_plugin.unwanted_resources = []
         self.test_status_mail_plugin.problematic_resources = []
@@ -213,8 +260,8 @@ class UsofaStatusMailPluginTest(TestCase):
             Resource(42, "ec2 instance", "12345", "date1", "us"),
             Resource(42, "ec2 volume", "3312345", "date2", "us")]
         self.problematic_resources = [
-            Resource(23, "ec2 instance", "67890", "date1", "us"),
-            Resource(23, "ec2 volume", "1112345", "date2", "us")]
+            (Resource(23, "ec2 instance", "67890", "date1", "us"), Mock(), Exception("boom")),
+            (Resource(23, "ec2 volume", "1112345", "date2", "us"), Mock(), Exception("boom"))]
         self.dry_run = True
         self.test_region = "eu-west-1"
         self.test_sender = "sender@test.invalid"
@@ -261,6 +308,19 @@ class UsofaStatusMailPluginTest(TestCase):
         expected_recipients = ['foo@test.invalid']
         self.assertEqual(recipients, expected_recipients)
 
+    @patch('monocyte.plugins.status_mail_plugin.UsofaStatusMailPlugin._get_usofa_data')
+    def test_recipients_of_swept_accounts_are_found_by_id(self, mock_get_usofa_data):
+        mock_get_usofa_data.return_value = {
+            'testaccount': {'id': '42', 'email': 'foo@test.invalid'},
+            'otheraccount': {'id': '43', 'email': 'bar@test.invalid'}}
+        self.test_status_mail_plugin.unwanted_resources = [
+            Resource(42, "ec2 instance", "12345", "date1", "us", account_id="43")]
+        self.test_status_mail_plugin.problematic_resources = []
+
+        recipients = self.test_status_mail_plugin.recipients
+
+        self.assertEqual(recipients, self.test_recipients + ['bar@test.invalid'])
+
     @mock_s3
     def test_get_usofa_data__ok(self):
         conn = boto3.client('s3', region_name=self.test_region)
@@ -0,0 +1,76 @@
+from __future__ import print_function, absolute_import, division
+
+from unittest import TestCase
+
+from monocyte.cache import JsonCache
+from monocyte.policy_analyzer import PolicyAnalyzer, covers
+
+
+def document(*statements):
+    return {'Version': '2012-10-17', 'Statement': list(statements)}
+
+
+class CoversTest(TestCase):
+    def test_wildcards(self):
+        self.assertTrue(covers('*', 'iam:*'))
+        self.assertTrue(covers('s3:*', 's3:getobject'))
+        self.assertTrue(covers('s3:get*', 's3:getobject'))
+        self.assertTrue(covers('s3:getobjec?', 's3:getobject'))
+        self.assertFalse(covers('s3:get*', 's3:*'))
+        self.assertFalse(covers('s*:s*', '*'))
+
+    def test_regex_characters_are_literal(self):
+        self.assertFalse(covers('s3:get.bject', 's3:getobject'))
+
+
+class PolicyAnalyzerTest(TestCase):
+    def setUp(self):
+        self.analyzer = PolicyAnalyzer()
+
+    def test_full_wildcard_is_forbidden(self):
+        self.assertTrue(self.analyzer.is_forbidden(document({'Effect': 'Allow', 'Action': '*', 'Resource': '*'})))
+        self.assertTrue(self.analyzer.is_forbidden(document({'Effect': 'Allow', 'Action': ['s3:x', '*:*']})))
+
+    def test_single_statement_dict_is_supported(self):
+        self.assertTrue(self.analyzer.is_forbidden({'Statement': {'Effect': 'Allow', 'Action': '*'}}))
+
+    def test_service_wildcard_is_allowed_by_default(self):
+        self.assertFalse(self.analyzer.is_forbidden(document({'Effect': 'Allow', 'Action': 's3:*'})))
+
+    def test_deny_statements_are_ignored(self):
+        self.assertFalse(self.analyzer.is_forbidden(document({'Effect': 'Deny', 'Action': '*'})))
+
+    def test_action_names_are_case_insensitive(self):
+        analyzer = PolicyAnalyzer(forbidden_actions=['IAM:*'])
+        self.assertTrue(analyzer.is_forbidden(document({'Effect': 'Allow', 'Action': 'iam:*'})))
+
+    def test_not_action_allows_everything_it_does_not_exclude(self):
+        analyzer = PolicyAnalyzer(forbidden_actions=['iam:*'])
+        self.assertTrue(analyzer.is_forbidden(document({'Effect': 'Allow', 'NotAction': 's3:*'})))
+        self.assertFalse(analyzer.is_forbidden(document({'Effect': 'Allow', 'NotAction': ['s3:*', 'iam:*']})))
+        self.assertFalse(analyzer.is_forbidden(document({'Effect': 'Allow', 'NotAction': 'iam:Pass*'})))
+
+    def test_get_violations_lists_all_forbidden_actions_allowed(self):
+        analyzer = PolicyAnalyzer(forbidden_actions=['*', 'iam:*', 'ec2:*'])
+        violations = analyzer.get_violations(document({'Effect': 'Allow', 'Action': ['iam:*', 'ec2:Describe*']}))
+        self.assertEqual(violations, ['iam:*'])
+
+    def test_document_given_as_json_string(self):
+        self.assertTrue(self.analyzer.is_forbidden('{"Statement": [{"Effect": "Allow", "Action": "*"}]}'))
+
+    def test_verdicts_are_cached_by_content(self):
+        verdicts = JsonCache()
+        analyzer = PolicyAnalyzer(verdicts=verdicts)
+        analyzer.is_forbidden(document({'Effect': 'Allow', 'Action': '*'}))
+        analyzer.is_forbidden(document({'Action': '*', 'Effect': 'Allow'}))
+        analyzer.is_forbidden(document({'Effect': 'Allow', 'Action': 's3:*'}))
+
+        self.assertEqual((analyzer.misses, analyzer.hits), (2, 1))
+        self.assertEqual(len(verdicts.keys()), 2)
+
+    def test_verdicts_depend_on_forbidden_actions(self):
+        verdicts = JsonCache()
+        policy = document({'Effect': 'Allow', 'Action': 'iam:*'})
+
+        self.assertFalse(PolicyAnalyzer(verdicts=verdicts).is_forbidden(policy))
+        self.assertTrue(PolicyAnalyzer(forbidden_actions=['iam:*'], verdicts=verdicts).is_forbidden(policy))
@@ -0,0 +1,141 @@
+from __future__ import print_function, absolute_import, division
+
+from unittest import TestCase
+
+from mock import Mock
+
+from monocyte.ratelimit import TokenBucket, AdaptiveRateLimiter, RateLimiterRegistry
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_burst_up_to_capacity_does_not_wait(self):
+        bucket = TokenBucket(2, capacity=3, clock=self.clock.time, sleep=self.clock.sleep)
+
+        for _ in range(3):
+            bucket.acquire()
+
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_waits_for_next_token(self):
+        bucket = TokenBucket(2, clock=self.clock.time, sleep=self.clock.sleep)
+
+        waited = [bucket.acquire() for _ in range(4)]
+
+        self.assertEqual(waited, [False, False, True, True])
+        self.assertEqual(self.clock.sleeps, [0.5, 0.5])
+        self.assertAlmostEqual(self.clock.now, 1.0)
+
+    def test_tokens_refill_over_time(self):
+        bucket = TokenBucket(1, capacity=2, clock=self.clock.time, sleep=self.clock.sleep)
+        bucket.acquire()
+        bucket.acquire()
+
+        self.clock.now += 10
+        bucket.acquire()
+        bucket.acquire()
+
+        self.assertEqual(self.clock.sleeps, [])
+
+
+class AdaptiveRateLimiterTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = AdaptiveRateLimiter(10, min_rate=1, max_rate=10.5, clock=self.clock.time,
+                                           sleep=self.clock.sleep)
+
+    def _use_all_tokens(self):
+        for _ in range(int(self.limiter.bucket.capacity) + 1):
+            self.limiter.acquire()
+
+    def test_success_increases_rate_once_per_interval_up_to_maximum(self):
+        self.limiter.max_rate = 12.5
+        self.clock.now += 1
+        self._use_all_tokens()
+        for _ in range(100):
+            self.limiter.on_success()
+        self.assertEqual(self.limiter.rate, 11)
+
+        for _ in range(3):
+            self.clock.now += 1
+            self._use_all_tokens()
+            self.limiter.on_success()
+        self.assertEqual(self.limiter.rate, 12.5)
+
+    def test_rate_is_not_raised_while_nobody_waits(self):
+        for _ in range(5):
+            self.clock.now += 1
+            self.limiter.acquire()
+            self.limiter.on_success()
+
+        self.assertEqual(self.limiter.rate, 10)
+
+    def test_throttling_halves_rate_once_per_cooldown(self):
+        self.limiter.on_throttle()
+        self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 5)
+
+        self.clock.now += 1
+        self.limiter.on_throttle()
+        self.assertEqual(self.limiter.rate, 2.5)
+        self.assertEqual(self.limiter.throttled, 3)
+
+    def test_rate_never_drops_below_minimum(self):
+        for _ in range(10):
+            self.clock.now += 1
+            self.limiter.on_throttle()
+
+        self.assertEqual(self.limiter.rate, 1)
+
+
+class RateLimiterRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = RateLimiterRegistry({'ec2': 42})
+
+    def test_limiter_per_account_service_and_region(self):
+        limiter = self.registry.get_limiter('account', 'ec2', 'eu-west-1')
+
+        self.assertIs(limiter, self.registry.get_limiter('account', 'ec2', 'eu-west-1'))
+        self.assertIsNot(limiter, self.registry.get_limiter('account', 'ec2', 'us-east-1'))
+        self.assertIsNot(limiter, self.registry.get_limiter('other account', 'ec2', 'eu-west-1'))
+        self.assertEqual(limiter.rate, 42)
+        self.assertEqual(self.registry.get_limiter('account', 'iam', None).rate, 10)
+
+    def test_high_limit_services_start_and_end_higher(self):
+        limiter = self.registry.get_limiter('account', 's3', 'eu-central-1')
+
+        self.assertEqual(limiter.rate, 500)
+        self.assertEqual(limiter.max_rate, 3500)
+        self.assertEqual(RateLimiterRegistry({'ec2': 300}).get_limiter('account', 'ec2', None).max_rate, 300)
+
+    def test_attached_client_reports_attempts(self):
+        client = Mock()
+        limiter = self.registry.attach(client, 'account', 'ec2', 'eu-west-1')
+        limiter.acquire = Mock()
+        limiter.on_success = Mock()
+        limiter.on_throttle = Mock()
+        handlers = dict((call[0][0], call[0][1]) for call in client.meta.events.register.call_args_list)
+
+        handlers['before-send'](request=None)
+        handlers['needs-retry'](response=(None, {'ResponseMetadata': {}}), attempts=1)
+        handlers['needs-retry'](response=(None, {'Error': {'Code': 'RequestLimitExceeded'}}), attempts=2)
+        handlers['needs-retry'](response=None, caught_exception=IOError(), attempts=3)
+
+        self.assertEqual(limiter.acquire.call_count, 1)
+        self.assertEqual(limiter.on_success.call_count, 1)
+        self.assertEqual(limiter.on_throttle.call_count, 1)
@@ -0,0 +1,56 @@
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import Mock
+
+from monocyte.regions import RegionCatalogue
+
+
+class RegionCatalogueTest(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.client = Mock()
+        self.client.describe_regions.return_value = {'Regions': [
+            {'RegionName': 'eu-west-1', 'OptInStatus': 'opt-in-not-required'},
+            {'RegionName': 'eu-south-1', 'OptInStatus': 'opted-in'},
+            {'RegionName': 'af-south-1', 'OptInStatus': 'not-opted-in'},
+            {'RegionName': 'me-south-1', 'OptInStatus': 'not-opted-in'}]}
+        self.catalogue = RegionCatalogue(max_age=60, clock=lambda: self.now, logger=Mock())
+
+    def test_returns_regions_that_are_not_opted_in(self):
+        disabled = self.catalogue.get_disabled_regions('123456789012', self.client)
+
+        self.assertEqual(disabled, set(['af-south-1', 'me-south-1']))
+        self.client.describe_regions.assert_called_once_with(AllRegions=True)
+
+    def test_uses_cached_regions_until_they_are_too_old(self):
+        self.catalogue.get_disabled_regions('123456789012', self.client)
+        self.now += 60
+        self.catalogue.get_disabled_regions('123456789012', self.client)
+        self.assertEqual(self.client.describe_regions.call_count, 1)
+
+        self.now += 1
+        self.catalogue.get_disabled_regions('123456789012', self.client)
+        self.assertEqual(self.client.describe_regions.call_count, 2)
+
+    def test_caches_regions_per_account(self):
+        self.catalogue.get_disabled_regions('123456789012', self.client)
+        self.catalogue.get_disabled_regions('210987654321', self.client)
+
+        self.assertEqual(self.catalogue.get_cache('123456789012').keys(), ['123456789012'])
+        self.assertEqual(self.catalogue.get_cache('210987654321').keys(), ['210987654321'])
+        self.assertEqual(self.catalogue.get_cache('123456789012').get('123456789012'),
+                         {'fetched_at': 1000.0, 'disabled': ['af-south-1', 'me-south-1']})
+
+    def test_keeps_one_cache_file_per_account(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        catalogue = RegionCatalogue(cache_dir, clock=lambda: self.now, logger=Mock())
+
+        catalogue.get_disabled_regions('123456789012', self.client)
+        catalogue.get_disabled_regions('210987654321', self.client)
+
+        self.assertEqual(sorted(os.listdir(cache_dir)), ['regions-123456789012.json', 'regions-210987654321.json'])
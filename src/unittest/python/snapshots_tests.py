@@ -0,0 +1,26 @@
+from __future__ import print_function, absolute_import, division
+
+from unittest import TestCase
+from mock import Mock
+
+from monocyte.snapshots import RunSnapshots
+
+
+class RunSnapshotsTest(TestCase):
+    def setUp(self):
+        self.snapshots = RunSnapshots()
+
+    def test_snapshot_is_fetched_once_per_key(self):
+        fetch = Mock(return_value='snapshot')
+
+        self.assertEqual(self.snapshots.get('key', fetch), 'snapshot')
+        self.assertEqual(self.snapshots.get('key', fetch), 'snapshot')
+        self.snapshots.get('other key', fetch)
+
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_failed_fetch_is_tried_again(self):
+        fetch = Mock(side_effect=[Exception("throttled"), 'snapshot'])
+
+        self.assertRaises(Exception, self.snapshots.get, 'key', fetch)
+        self.assertEqual(self.snapshots.get('key', fetch), 'snapshot')